@@ -0,0 +1,6 @@
+"""
+Micro-benchmarks for the traceid hot paths.
+
+Each bench_*.py module exposes a cases() function and can be run on its own, e.g.:
+    python -m benchmarks.bench_logging
+"""
@@ -0,0 +1,141 @@
+"""
+Run the benchmark suite.
+
+    python -m benchmarks                              # run every bench_*.py module
+    python -m benchmarks logging traceid              # run selected modules
+    python -m benchmarks --json results.json          # write machine-readable results
+    python -m benchmarks --save-baseline              # store the results as the baseline
+    python -m benchmarks --baseline --threshold 0.2   # fail if a case is 20% slower than the baseline
+    python -m benchmarks --profile "JSONFormatter"    # profile the matching cases with cProfile
+"""
+
+import argparse
+import cProfile
+import importlib
+import json
+import os
+import pkgutil
+import platform
+import pstats
+import sys
+import time
+import typing
+
+import benchmarks
+from benchmarks.common import Case, compare, run
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def discover() -> list[str]:
+    """
+    Return the names of the bench_*.py modules, without the bench_ prefix.
+    """
+    return sorted(
+        module.name[len("bench_") :]
+        for module in pkgutil.iter_modules(benchmarks.__path__)
+        if module.name.startswith("bench_")
+    )
+
+
+def load_cases(name: str) -> list[Case]:
+    return importlib.import_module(f"benchmarks.bench_{name}").cases()
+
+
+def profile(cases: typing.Iterable[Case], pattern: str, limit: int) -> None:
+    for case in cases:
+        if pattern not in case.name:
+            continue
+        print(f"--- {case.name} ---")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        for _ in range(case.number):
+            case.func()
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(limit)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark the traceid hot paths."
+    )
+    parser.add_argument(
+        "modules", nargs="*", help=f"Modules to run, any of: {', '.join(discover())}."
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds per case.")
+    parser.add_argument("--json", metavar="PATH", help="Write the results as JSON.")
+    parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        help="Compare with a baseline file (default: benchmarks/baseline.json).",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        metavar="PATH",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        help="Store the results as the baseline (default: benchmarks/baseline.json).",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Relative slowdown that counts as a regression (default: 0.25).",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATTERN",
+        help="Profile the cases whose name contains PATTERN.",
+    )
+    parser.add_argument(
+        "--profile-limit", type=int, default=20, help="Functions shown per profile."
+    )
+    args = parser.parse_args(argv)
+
+    available = discover()
+    modules = args.modules or available
+    for name in modules:
+        if name not in available:
+            parser.error(f"unknown module {name!r}, available: {', '.join(available)}")
+
+    if args.profile is not None:
+        for name in modules:
+            profile(load_cases(name), args.profile, args.profile_limit)
+        return 0
+
+    results: dict[str, dict[str, float]] = {}
+    for name in modules:
+        print(f"## {name}")
+        results[name] = run(load_cases(name), repeat=args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "unit": "ns/op",
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regression over {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import io
+import logging
+import uuid
+
+from benchmarks.common import Case, run
+from traceid.binary import BinaryDecoder, BinaryFormatter
+from traceid.logging import JSONFormatter
+from traceid.traceid import TraceId
+
+RECORDS = 1_000
+
+
+def make_records() -> list[logging.LogRecord]:
+    records = []
+    for i in range(RECORDS):
+        record = logging.LogRecord(
+            "app.checkout",
+            logging.INFO,
+            __file__,
+            42,
+            "order %d paid",
+            (i,),
+            None,
+            func="pay",
+        )
+        record.created += i * 0.001
+        records.append(record)
+    return records
+
+
+def encode_all(formatter: BinaryFormatter, records: list[logging.LogRecord]) -> bytes:
+    formatter.reset()
+    return b"".join(formatter.format_bytes(record) + b"\n" for record in records)
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.UUID("4bf92f35-77b3-4da6-a3ce-929d0e0e4736"), coverage=True)
+    records = make_records()
+    json_formatter = JSONFormatter()
+    binary_formatter = BinaryFormatter()
+    lines = b"".join(json_formatter.format_bytes(record) + b"\n" for record in records)
+    stream = encode_all(binary_formatter, records)
+    print(
+        f"{'size per record, JSON / binary':<48} {len(lines) / RECORDS:>9.1f} B "
+        f"{len(stream) / RECORDS:>9.1f} B ({len(stream) / len(lines):.0%})"
+    )
+    return [
+        Case(
+            f"{RECORDS} records: JSONFormatter.format_bytes",
+            lambda: [json_formatter.format_bytes(record) for record in records],
+            number=20,
+        ),
+        Case(
+            f"{RECORDS} records: BinaryFormatter.format_bytes",
+            lambda: encode_all(binary_formatter, records),
+            number=20,
+        ),
+        Case(
+            f"{RECORDS} records: decode binary to JSON lines",
+            lambda: BinaryDecoder().feed(stream),
+            number=20,
+        ),
+        Case(
+            f"{RECORDS} records: json.loads of JSON lines",
+            lambda: [__import__("json").loads(line) for line in io.BytesIO(lines)],
+            number=20,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from benchmarks.common import Case, run
+from traceid.traceid import TraceId
+
+TASKS = 1000
+THREADS = 8
+CALLS = 10
+
+
+async def task_body() -> None:
+    with TraceId.scope():
+        for _ in range(CALLS):
+            TraceId.get()
+
+
+async def gather_tasks() -> None:
+    await asyncio.gather(*(task_body() for _ in range(TASKS)))
+
+
+def thread_body() -> None:
+    for _ in range(TASKS // THREADS):
+        with TraceId.scope():
+            for _ in range(CALLS):
+                TraceId.get()
+
+
+def run_threads() -> None:
+    threads = [threading.Thread(target=thread_body) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def cases() -> list[Case]:
+    loop = asyncio.new_event_loop()
+    return [
+        Case(
+            f"{TASKS} asyncio tasks: scope + {CALLS} get",
+            lambda: loop.run_until_complete(gather_tasks()),
+            number=20,
+        ),
+        Case(
+            f"{THREADS} threads, {TASKS} scopes + {CALLS} get",
+            run_threads,
+            number=20,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
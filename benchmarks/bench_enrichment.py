@@ -0,0 +1,97 @@
+import logging
+import typing
+import uuid
+
+from benchmarks.common import Case, NullStream, run
+from traceid.logging import JSONFormatter, TraceIdFilter
+from traceid.traceid import TraceId
+
+
+class EagerTraceIdFilter(logging.Filter):
+    """TraceIdFilter setting every trace field on every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = TraceId.current()
+        if context is None:
+            record.trace_id = record.span_id = record.parent_span_id = None
+        else:
+            record.trace_id = context.text
+            record.span_id = context.span_id
+            record.parent_span_id = context.parent_id
+        return True
+
+
+class EagerJSONFormatter(JSONFormatter):
+    """JSONFormatter computing the message, exception and stack whatever its keys are."""
+
+    def format_dict(self, record: logging.LogRecord) -> dict[str, typing.Any]:
+        record.trace_id = self.formatTraceId()
+        record.message = record.getMessage()
+        if self.usesTime():
+            record.asctime = self.format_time(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.stack_info:
+            record.stack_info = self.formatStack(record.stack_info)
+        return self._extract(record)
+
+
+def make_logger(
+    name: str,
+    trace_filter: logging.Filter,
+    formatter_class: type[JSONFormatter],
+) -> logging.Logger:
+    """
+    A DEBUG logger with three handlers: an INFO access log without the message,
+    a WARNING log with messages and an ERROR log with the exception text.
+    """
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.filters.clear()
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addFilter(trace_filter)
+    for level, keys in (
+        (logging.INFO, ["levelname", "name", "trace_id"]),
+        (logging.WARNING, ["asctime", "levelname", "trace_id", "message"]),
+        (logging.ERROR, ["trace_id", "message", "exc_text"]),
+    ):
+        handler = logging.StreamHandler(NullStream())  # type: ignore
+        handler.setLevel(level)
+        handler.setFormatter(formatter_class(keys=keys))
+        logger.addHandler(handler)
+    return logger
+
+
+def log_mix(logger: logging.Logger, exc_info) -> None:
+    logger.debug("debug %s", "record")
+    logger.info("info %s", "record")
+    logger.info("info %s", "record")
+    logger.warning("warning %s", "record")
+    logger.error("error %s", "record", exc_info=exc_info)
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.uuid4(), coverage=True)
+    try:
+        raise RuntimeError("failed")
+    except RuntimeError as exc:
+        exc_info = (type(exc), exc, exc.__traceback__)
+    eager = make_logger("bench.eager", EagerTraceIdFilter(), EagerJSONFormatter)
+    lazy = make_logger("bench.lazy", TraceIdFilter(), JSONFormatter)
+    return [
+        Case(
+            "3 handlers, 5 levels (eager enrichment)",
+            lambda: log_mix(eager, exc_info),
+            number=5_000,
+        ),
+        Case(
+            "3 handlers, 5 levels (lazy enrichment)",
+            lambda: log_mix(lazy, exc_info),
+            number=5_000,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,48 @@
+import concurrent.futures
+import uuid
+
+from benchmarks.common import Case, run
+from traceid.executors import (
+    TraceIdProcessPoolExecutor,
+    TraceIdThreadPoolExecutor,
+)
+from traceid.traceid import TraceId
+
+
+def noop() -> None:
+    pass
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.uuid4(), coverage=True)
+    # The executors are shut down when the interpreter exits.
+    thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    traced_thread_pool = TraceIdThreadPoolExecutor(max_workers=1)
+    process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+    traced_process_pool = TraceIdProcessPoolExecutor(max_workers=1)
+    return [
+        Case(
+            "ThreadPoolExecutor submit+result",
+            lambda: thread_pool.submit(noop).result(),
+            number=10_000,
+        ),
+        Case(
+            "TraceIdThreadPoolExecutor submit+result",
+            lambda: traced_thread_pool.submit(noop).result(),
+            number=10_000,
+        ),
+        Case(
+            "ProcessPoolExecutor submit+result",
+            lambda: process_pool.submit(noop).result(),
+            number=1_000,
+        ),
+        Case(
+            "TraceIdProcessPoolExecutor submit+result",
+            lambda: traced_process_pool.submit(noop).result(),
+            number=1_000,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,15 @@
+import uuid
+
+from benchmarks.common import Case, run
+from traceid.traceid import GENERATORS
+
+
+def cases() -> list[Case]:
+    result = [Case("uuid.uuid4", uuid.uuid4)]
+    for name, generator in GENERATORS.items():
+        result.append(Case(f"generator {name}", generator))
+    return result
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,63 @@
+import atexit
+import os
+import shutil
+import tempfile
+import uuid
+
+from benchmarks.common import Case, run
+from traceid.index import TraceIndex
+
+LINES = 200_000
+TRACES = 10_000
+
+
+def write_log(path: str) -> str:
+    """
+    Write a JSON-lines log of LINES records spread over TRACES traces, and return one of the trace IDs.
+    """
+    traces = [str(uuid.uuid4()) for _ in range(TRACES)]
+    with open(path, "wb") as f:
+        for i in range(LINES):
+            f.write(
+                b'{"asctime": "2024-01-01T00:%02d:%02d.%06d+00:00", "levelname": "INFO", "name": "bench", '
+                b'"module": "bench", "lineno": 42, "trace_id": "%s", "exc_text": null, "message": "request %d"}\n'
+                % (i // 60 % 60, i % 60, i, traces[i % TRACES].encode(), i)
+            )
+    return traces[TRACES // 2]
+
+
+def scan(path: str, traceid: str) -> list[bytes]:
+    """A full scan of the log for the lines of a trace."""
+    needle = f'"trace_id": "{traceid}"'.encode()
+    with open(path, "rb") as f:
+        return [line for line in f if needle in line]
+
+
+def cases() -> list[Case]:
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, True)
+    path = os.path.join(directory, "bench.log")
+    traceid = write_log(path)
+    index = TraceIndex(path)
+    index.update()
+    size_mb = os.path.getsize(path) / 1e6
+    print(f"log: {LINES} lines, {size_mb:.1f} MB")
+
+    def build() -> None:
+        os.remove(index.index_path)
+        index.update()
+
+    return [
+        Case(f"build index ({size_mb:.0f} MB)", build, number=1),
+        Case("update (nothing appended)", index.update, number=1_000),
+        Case("full scan for one trace", lambda: scan(path, traceid), number=3),
+        Case(
+            "index lookup for one trace",
+            lambda: list(index.lines_for(traceid)),
+            number=1_000,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases(), repeat=3)
@@ -0,0 +1,211 @@
+import datetime
+import json
+import logging
+import uuid
+
+from benchmarks.common import Case, NullStream, run
+from traceid.logging import RESERVED, JSONFormatter, SamplingFilter, TraceIdFilter
+from traceid.serializers import BACKENDS
+from traceid.traceid import TraceId
+
+
+class LegacyTraceIdFilter(logging.Filter):
+    """TraceIdFilter as it was before TraceId.peek() existed."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if TraceId.is_set():
+            record.trace_id = TraceId.get()
+        else:
+            record.trace_id = None
+        return True
+
+
+def legacy_format_trace_id() -> str | None:
+    if TraceId.is_set():
+        if isinstance(TraceId.get(), uuid.UUID):
+            return str(TraceId.get())
+        return TraceId.get()  # type: ignore
+    else:
+        return None
+
+
+def legacy_format_time(record: logging.LogRecord) -> str:
+    return datetime.datetime.fromtimestamp(record.created).astimezone().isoformat()
+
+
+class LegacyJSONFormatter(JSONFormatter):
+    """JSONFormatter.format with the per-key membership test loop and no time cache."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.trace_id = self.formatTraceId()
+        record.message = record.getMessage()
+        if self.usesTime():
+            record.asctime = legacy_format_time(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.stack_info:
+            record.stack_info = self.formatStack(record.stack_info)
+
+        data = {}
+        for key in self.keys:
+            if key in RESERVED or hasattr(record, key):
+                data[key] = getattr(record, key)
+            else:
+                raise AttributeError(f"Attribute {key} not found in log record.")
+
+        return json.dumps(
+            data,
+            ensure_ascii=self.json_ensure_ascii,
+            indent=self.json_indent,
+            separators=self.json_separators,
+            default=self.json_default,
+        )
+
+
+def make_record() -> logging.LogRecord:
+    return logging.LogRecord(
+        "bench", logging.INFO, __file__, 1, "hello %s", ("world",), None
+    )
+
+
+STATIC_FIELDS = {
+    "service": "checkout",
+    "host": "checkout-7d9f8b6c5-x2x7q",
+    "version": "1.24.3",
+    "region": "eu-west-1",
+    "zone": "eu-west-1b",
+    "env": "production",
+    "team": "payments",
+    "commit": "9fceb02d0ae598e95dc970b74767f19372d61af8",
+}
+DYNAMIC_KEYS = ["asctime", "levelname", "trace_id", "message"]
+
+
+def static_field_cases(record: logging.LogRecord) -> list[Case]:
+    """
+    A 12-field record: 8 constant fields added to the record as attributes (e.g. by a filter)
+    and serialized for every record, or given to JSONFormatter as static_fields.
+    """
+    record_with_fields = logging.makeLogRecord(record.__dict__)
+    record_with_fields.__dict__.update(STATIC_FIELDS)
+    result = []
+    for backend in ("json", "orjson"):
+        try:
+            per_record = JSONFormatter(
+                keys=[*DYNAMIC_KEYS, *STATIC_FIELDS], json_backend=backend
+            )
+        except ImportError:
+            continue
+        static = JSONFormatter(
+            keys=DYNAMIC_KEYS, static_fields=STATIC_FIELDS, json_backend=backend
+        )
+        result += [
+            Case(
+                f"12 fields, record attributes ({backend})",
+                lambda f=per_record: f.format(record_with_fields),
+                number=20_000,
+            ),
+            Case(
+                f"12 fields, static_fields ({backend})",
+                lambda f=static: f.format(record),
+                number=20_000,
+            ),
+        ]
+    return result
+
+
+RESERVED_TUPLE = tuple(RESERVED)
+
+
+def legacy_extras(record: logging.LogRecord) -> dict:
+    """Extras found by scanning record.__dict__ against a tuple."""
+    return {
+        key: value
+        for key, value in record.__dict__.items()
+        if key not in RESERVED_TUPLE
+    }
+
+
+def extras_cases(record: logging.LogRecord) -> list[Case]:
+    record_with_extras = logging.makeLogRecord(record.__dict__)
+    record_with_extras.__dict__.update(user="alice", request_id=42, path="/")
+    capture = JSONFormatter(capture_extras=True)
+    return [
+        Case(
+            "extras: tuple scan of __dict__ (0 extras)", lambda: legacy_extras(record)
+        ),
+        Case(
+            "extras: frozenset diff of __dict__ (0 extras)",
+            lambda: record.__dict__.keys() - capture._not_extra,
+        ),
+        Case(
+            "JSONFormatter.format (capture_extras, 0 extras)",
+            lambda: capture.format(record),
+            number=20_000,
+        ),
+        Case(
+            "JSONFormatter.format (capture_extras, 3 extras)",
+            lambda: capture.format(record_with_extras),
+            number=20_000,
+        ),
+    ]
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.uuid4(), coverage=True)
+    record = make_record()
+    legacy_filter = LegacyTraceIdFilter()
+    trace_filter = TraceIdFilter()
+    formatter = JSONFormatter()
+    sampling_filter = SamplingFilter(rate=0.5, max_lines_per_trace=10**12)
+    legacy_formatter = LegacyJSONFormatter()
+    result = [
+        Case("filter (legacy is_set + get)", lambda: legacy_filter.filter(record)),
+        Case("filter (cached text)", lambda: trace_filter.filter(record)),
+        Case(
+            "SamplingFilter (cached decision)", lambda: sampling_filter.filter(record)
+        ),
+        Case("formatTraceId (legacy)", legacy_format_trace_id),
+        Case("formatTraceId (cached text)", formatter.formatTraceId),
+        Case("format_time (legacy)", lambda: legacy_format_time(record)),
+        Case("format_time (second cache)", lambda: formatter.format_time(record)),
+        Case(
+            "JSONFormatter.format (legacy key loop)",
+            lambda: legacy_formatter.format(record),
+            number=20_000,
+        ),
+        Case("JSONFormatter.format", lambda: formatter.format(record), number=20_000),
+    ]
+    logger = logging.getLogger("bench.end_to_end")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(NullStream())  # type: ignore
+    handler.setFormatter(formatter)
+    handler.addFilter(trace_filter)
+    logger.addHandler(handler)
+    result.append(
+        Case(
+            "logger.info end-to-end (null stream)",
+            lambda: logger.info("hello %s", "world"),
+            number=20_000,
+        )
+    )
+    for backend in BACKENDS:
+        try:
+            backend_formatter = JSONFormatter(json_backend=backend)
+        except ImportError:
+            continue
+        result.append(
+            Case(
+                f"JSONFormatter.format_bytes ({backend})",
+                lambda f=backend_formatter: f.format_bytes(record),
+                number=20_000,
+            )
+        )
+    result += static_field_cases(record)
+    result += extras_cases(record)
+    return result
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,86 @@
+import logging
+import uuid
+
+from benchmarks.common import Case, run
+from traceid import metrics
+from traceid.logging import JSONFormatter
+from traceid.traceid import TraceContext, TraceId
+
+
+def uninstrumented_set(traceid, coverage=False):
+    """TraceId.set() without the metrics check."""
+    if traceid is None:
+        raise ValueError("TraceId cannot be set to None.")
+    if not coverage and TraceId.is_set():
+        raise ValueError("TraceId is already set.")
+    return TraceId.traceid_var.set(TraceContext(traceid))
+
+
+def uninstrumented_clear(token=None):
+    """TraceId.clear() without the metrics check."""
+    if token is not None:
+        TraceId.traceid_var.reset(token)
+    else:
+        TraceId.traceid_var.set(None)
+
+
+def uninstrumented_set_and_reset() -> None:
+    uninstrumented_clear(uninstrumented_set("bench", coverage=True))
+
+
+def set_and_reset() -> None:
+    TraceId.clear(TraceId.set("bench", coverage=True))
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.uuid4(), coverage=True)
+    record = logging.LogRecord(
+        "bench", logging.INFO, __file__, 1, "hello %s", ("world",), None
+    )
+    formatter = JSONFormatter()
+
+    def uninstrumented_format() -> str:
+        return formatter._json_backend.dumps(formatter.format_dict(record))
+
+    metrics.disable()
+    return [
+        Case("set + clear(token) (no metrics check)", uninstrumented_set_and_reset),
+        Case("set + clear(token) (metrics disabled)", set_and_reset),
+        Case(
+            "JSONFormatter.format (no metrics check)",
+            uninstrumented_format,
+            number=20_000,
+        ),
+        Case(
+            "JSONFormatter.format (metrics disabled)",
+            lambda: formatter.format(record),
+            number=20_000,
+        ),
+    ]
+
+
+def enabled_cases() -> list[Case]:
+    """
+    The instrumented calls with metrics enabled. Not part of cases(), which must leave metrics disabled.
+    """
+    record = logging.LogRecord(
+        "bench", logging.INFO, __file__, 1, "hello %s", ("world",), None
+    )
+    formatter = JSONFormatter()
+    return [
+        Case("set + clear(token) (metrics enabled)", set_and_reset),
+        Case(
+            "JSONFormatter.format (metrics enabled)",
+            lambda: formatter.format(record),
+            number=20_000,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
+    metrics.enable()
+    try:
+        run(enabled_cases())
+    finally:
+        metrics.disable()
@@ -0,0 +1,110 @@
+import asyncio
+import typing
+
+from benchmarks.common import Case, run
+from traceid.middleware import TraceIdASGIMiddleware, TraceIdWSGIMiddleware
+from traceid.traceid import TraceId
+
+REQUESTS = 100
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/",
+    "raw_path": b"/",
+    "query_string": b"",
+    "root_path": "",
+    "server": ("127.0.0.1", 8000),
+    "client": ("127.0.0.1", 12345),
+    "headers": [(b"host", b"localhost"), (b"x-request-id", b"bench-request-id")],
+}
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def plain_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def asgi_case(name: str, app) -> Case:
+    loop = asyncio.new_event_loop()
+
+    async def requests():
+        for _ in range(REQUESTS):
+            await app(dict(SCOPE), receive, send)
+
+    return Case(
+        f"{name} x{REQUESTS}", lambda: loop.run_until_complete(requests()), number=20
+    )
+
+
+def starlette_cases() -> list[Case]:
+    try:
+        from starlette.applications import Starlette
+        from starlette.middleware.base import BaseHTTPMiddleware
+        from starlette.requests import Request
+        from starlette.responses import PlainTextResponse, Response
+        from starlette.routing import Route
+    except ImportError:
+        return []
+
+    async def homepage(request):
+        return PlainTextResponse("ok")
+
+    readme_app = Starlette(routes=[Route("/", homepage)])
+
+    # The pattern from the README. FastAPI's @app.middleware("http") wraps it in BaseHTTPMiddleware.
+    async def add_trace_id(
+        request: Request,
+        call_next: typing.Callable[[Request], typing.Awaitable[Response]],
+    ) -> Response:
+        trace_id = request.headers.get("X-Request-ID", None)
+        if trace_id is None:
+            TraceId.gen()
+        else:
+            TraceId.set(trace_id, coverage=True)
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = str(TraceId.get())
+        return response
+
+    readme_app.add_middleware(BaseHTTPMiddleware, dispatch=add_trace_id)
+    asgi_app = TraceIdASGIMiddleware(Starlette(routes=[Route("/", homepage)]))
+    return [
+        asgi_case("starlette + README http middleware", readme_app),
+        asgi_case("starlette + TraceIdASGIMiddleware", asgi_app),
+    ]
+
+
+def wsgi_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"ok"]
+
+
+def cases() -> list[Case]:
+    middleware = TraceIdWSGIMiddleware(wsgi_app)
+    environ = {"HTTP_X_REQUEST_ID": "bench-request-id"}
+    start_response = lambda status, headers, exc_info=None: None
+
+    def wsgi_request():
+        middleware(environ, start_response).close()  # type: ignore
+
+    return [
+        asgi_case("plain ASGI app", plain_app),
+        asgi_case("TraceIdASGIMiddleware", TraceIdASGIMiddleware(plain_app)),
+        *starlette_cases(),
+        Case("plain WSGI app", lambda: wsgi_app(environ, start_response)),
+        Case("TraceIdWSGIMiddleware", wsgi_request),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,54 @@
+import logging
+
+from benchmarks.common import Case, NullStream, run
+from traceid.logging import JSONFormatter
+from traceid.recorder import FlightRecorderHandler
+from traceid.traceid import TraceId
+
+LINES = 20
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"bench.recorder.{name}")
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger
+
+
+def request(logger: logging.Logger, fail: bool = False) -> None:
+    with TraceId.scope():
+        for i in range(LINES):
+            logger.debug("step %d", i)
+        if fail:
+            logger.error("failed")
+
+
+def cases() -> list[Case]:
+    TraceId.clear()
+    target = logging.StreamHandler(NullStream())
+    target.setFormatter(JSONFormatter())
+    direct = make_logger("direct", target)
+    recorded = make_logger("recorded", FlightRecorderHandler(target))
+    return [
+        Case(
+            f"scope + {LINES} debug: formatted",
+            lambda: request(direct),
+            number=2_000,
+        ),
+        Case(
+            f"scope + {LINES} debug: recorded, discarded",
+            lambda: request(recorded),
+            number=2_000,
+        ),
+        Case(
+            f"scope + {LINES} debug + error: recorded, flushed",
+            lambda: request(recorded, fail=True),
+            number=2_000,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,89 @@
+import logging
+
+from benchmarks.common import Case, NullStream, run
+from traceid import registry
+from traceid.logging import JSONFormatter
+from traceid.registry import ActiveTraceRegistry
+from traceid.traceid import TraceContext, TraceId
+
+LINES = 10
+TRACES = 10000
+
+
+def make_logger() -> logging.Logger:
+    handler = logging.StreamHandler(NullStream())
+    handler.setFormatter(JSONFormatter())
+    logger = logging.getLogger("bench.registry")
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def request(logger: logging.Logger) -> None:
+    with TraceId.scope():
+        for i in range(LINES):
+            logger.info("step %d", i)
+
+
+def with_registry(store: ActiveTraceRegistry, func):
+    def wrapper():
+        registry.active = store
+        try:
+            func()
+        finally:
+            registry.active = None
+
+    return wrapper
+
+
+def full_registry() -> ActiveTraceRegistry:
+    store = ActiveTraceRegistry(capacity=TRACES)
+    for i in range(TRACES):
+        store.start(TraceContext(f"trace-{i}"))
+    return store
+
+
+def cases() -> list[Case]:
+    TraceId.clear()
+    registry.disable()
+    logger = make_logger()
+    store = full_registry()
+    evicting = full_registry()
+    contexts = [TraceContext(f"new-{i}") for i in range(1000)]
+
+    def churn():
+        for context in contexts:
+            evicting.start(context)
+
+    return [
+        Case(
+            f"scope + {LINES} info: registry disabled",
+            lambda: request(logger),
+            number=2_000,
+        ),
+        Case(
+            f"scope + {LINES} info: registry enabled",
+            with_registry(ActiveTraceRegistry(), lambda: request(logger)),
+            number=2_000,
+        ),
+        Case(
+            "count a record",
+            lambda: store.count("trace-1", logging.INFO, 200),
+        ),
+        Case(
+            "start 1000 traces in a full registry (eviction)",
+            churn,
+            number=20,
+        ),
+        Case(
+            f"top 10 longest running of {TRACES} traces",
+            lambda: store.longest_running(10),
+            number=20,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,58 @@
+import logging
+import logging.handlers
+import os
+import tempfile
+import uuid
+
+from benchmarks.common import Case, run
+from traceid.logging import JSONFormatter
+from traceid.rotating import RotatingJSONFileHandler
+from traceid.traceid import TraceId
+
+MAX_BYTES = 4 << 20
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    handler.setFormatter(JSONFormatter())
+    logger = logging.getLogger(f"bench.rotating.{name}")
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.uuid4(), coverage=True)
+    directory = tempfile.mkdtemp()
+    stdlib = make_logger(
+        "stdlib",
+        logging.handlers.RotatingFileHandler(
+            os.path.join(directory, "stdlib.log"), maxBytes=MAX_BYTES, backupCount=2
+        ),
+    )
+    rotating = make_logger(
+        "traceid",
+        RotatingJSONFileHandler(
+            os.path.join(directory, "traceid.log"),
+            max_bytes=MAX_BYTES,
+            backup_count=2,
+            compression="gzip",
+        ),
+    )
+    return [
+        Case(
+            "stdlib RotatingFileHandler",
+            lambda: stdlib.info("hello %s", "world"),
+            number=20_000,
+        ),
+        Case(
+            "RotatingJSONFileHandler (gzip)",
+            lambda: rotating.info("hello %s", "world"),
+            number=20_000,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
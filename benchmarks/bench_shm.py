@@ -0,0 +1,80 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+
+from benchmarks.common import Case, run
+from traceid.logging import JSONFormatter
+from traceid.shm import SharedRingCollector, SharedRingHandler
+from traceid.traceid import TraceId
+
+PROCESSES = 4
+RECORDS = 5_000
+
+
+def log_records(handler: logging.Handler) -> None:
+    handler.setFormatter(JSONFormatter())
+    logger = logging.getLogger("bench.shm")
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    with TraceId.scope():
+        for i in range(RECORDS):
+            logger.info("request %d", i)
+    handler.close()
+
+
+def stream_worker(path: str) -> None:
+    # Every worker appends to the same file, as when they share stdout.
+    log_records(logging.StreamHandler(open(path, "a")))
+
+
+def ring_worker(directory: str) -> None:
+    log_records(SharedRingHandler(directory, size=1 << 22, block_timeout=10))
+
+
+def run_processes(target, arg) -> None:
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=target, args=(arg,)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def shared_stream(path: str) -> None:
+    run_processes(stream_worker, path)
+
+
+def shared_ring(directory: str, output: str) -> None:
+    with open(output, "ab") as stream:
+        collector = SharedRingCollector(directory, stream, interval=0.001).start()
+        run_processes(ring_worker, directory)
+        collector.stop()
+        collector.scan()  # removes the rings of the exited workers
+        collector.close()
+
+
+def cases() -> list[Case]:
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return []
+    tmp = tempfile.mkdtemp()
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tmp
+    rings = tempfile.mkdtemp(prefix="traceid-bench-", dir=directory)
+    return [
+        Case(
+            f"{PROCESSES} processes x {RECORDS} records: shared StreamHandler",
+            lambda: shared_stream(os.path.join(tmp, "stream.log")),
+            number=3,
+        ),
+        Case(
+            f"{PROCESSES} processes x {RECORDS} records: SharedRingHandler",
+            lambda: shared_ring(rings, os.path.join(tmp, "ring.log")),
+            number=3,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,24 @@
+from benchmarks.common import Case, run
+from traceid.traceid import TraceContext, TraceId
+
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def span_scope() -> None:
+    with TraceId.span():
+        pass
+
+
+def cases() -> list[Case]:
+    context = TraceContext.from_traceparent(TRACEPARENT)
+    TraceId.set_traceparent(TRACEPARENT, coverage=True)
+    return [
+        Case("parse traceparent", lambda: TraceContext.from_traceparent(TRACEPARENT)),
+        Case("serialize traceparent", context.to_traceparent),
+        Case("child span", context.child),
+        Case("span scope enter/exit", span_scope),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from benchmarks.common import Case, run
+from traceid.tasks import TraceTaskFactory
+from traceid.traceid import TraceId
+
+TASKS = 1000
+
+
+async def leaf() -> None:
+    await asyncio.sleep(0)
+
+
+async def gather_tasks() -> None:
+    async with TraceId.scope():
+        await asyncio.gather(*(leaf() for _ in range(TASKS)))
+
+
+def make_loop(factory: TraceTaskFactory | None) -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    loop.set_task_factory(factory)
+    return loop
+
+
+def cases() -> list[Case]:
+    TraceId.clear()
+    loops = [
+        ("no factory", make_loop(None)),
+        ("spans (default)", make_loop(TraceTaskFactory())),
+        (
+            "spans + perf_counter timing",
+            make_loop(TraceTaskFactory(timing=True, clock=time.perf_counter)),
+        ),
+        (
+            "spans + thread_time timing",
+            make_loop(TraceTaskFactory(timing=True)),
+        ),
+    ]
+    return [
+        Case(
+            f"gather {TASKS} tasks: {name}",
+            lambda loop=loop: loop.run_until_complete(gather_tasks()),
+            number=20,
+        )
+        for name, loop in loops
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
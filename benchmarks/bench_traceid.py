@@ -0,0 +1,40 @@
+import uuid
+
+from benchmarks.common import Case, run
+from traceid.traceid import TraceId
+
+
+def set_and_clear() -> None:
+    TraceId.set("bench", coverage=True)
+    TraceId.clear()
+
+
+def set_and_reset() -> None:
+    TraceId.clear(TraceId.set("bench", coverage=True))
+
+
+def scope() -> None:
+    with TraceId.scope("bench"):
+        pass
+
+
+def generated_scope() -> None:
+    with TraceId.scope():
+        pass
+
+
+def cases() -> list[Case]:
+    TraceId.set(uuid.uuid4(), coverage=True)
+    return [
+        Case("TraceId.get", TraceId.get),
+        Case("TraceId.peek", TraceId.peek),
+        Case("TraceId.is_set", TraceId.is_set),
+        Case("set + clear()", set_and_clear),
+        Case("set + clear(token)", set_and_reset),
+        Case("scope enter/exit", scope),
+        Case("scope enter/exit (generated uuid4)", generated_scope),
+    ]
+
+
+if __name__ == "__main__":
+    run(cases())
@@ -0,0 +1,73 @@
+import timeit
+import typing
+
+
+class Case(typing.NamedTuple):
+    """
+    A single benchmark case.
+    :param name: Name shown in the report.
+    :param func: Zero-argument callable executed `number` times per round.
+    :param number: Number of calls per round.
+    """
+
+    name: str
+    func: typing.Callable[[], typing.Any]
+    number: int = 100_000
+
+
+def measure(case: Case, repeat: int = 5) -> float:
+    """
+    Return the best time per call of a case, in nanoseconds.
+    """
+    timer = timeit.Timer(case.func)
+    best = min(timer.repeat(repeat=repeat, number=case.number))
+    return best / case.number * 1e9
+
+
+def run(cases: typing.Iterable[Case], repeat: int = 5) -> dict[str, float]:
+    """
+    Measure and print every case. Returns a mapping of case name to ns per call.
+    """
+    results = {}
+    for case in cases:
+        ns = measure(case, repeat=repeat)
+        results[case.name] = ns
+        print(f"{case.name:<48} {ns:>12.1f} ns/op {1e9 / ns:>14,.0f} ops/s")
+    return results
+
+
+class NullStream(object):
+    """
+    A text and binary stream that discards everything, for end-to-end logging benchmarks.
+    """
+
+    def write(self, data: typing.Any) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    """
+    Compare results with a baseline, both mapping module name to case name to ns per call.
+    Returns a description of every case that is more than `threshold` (e.g. 0.2 for 20%) slower
+    than the baseline. Cases missing from either side are ignored.
+    """
+    regressions = []
+    for module, module_results in results.items():
+        module_baseline = baseline.get(module, {})
+        for name, ns in module_results.items():
+            base = module_baseline.get(name)
+            if base is None or base <= 0:
+                continue
+            change = ns / base - 1
+            if change > threshold:
+                regressions.append(
+                    f"{module}: {name}: {base:.1f} -> {ns:.1f} ns/op (+{change:.0%})"
+                )
+    return regressions
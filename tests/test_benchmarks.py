@@ -0,0 +1,25 @@
+import unittest
+
+from benchmarks.__main__ import discover, main
+from benchmarks.common import compare
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_compare(self):
+        baseline = {"logging": {"format": 1000.0, "filter": 100.0, "removed": 1.0}}
+        results = {
+            "logging": {"format": 1300.0, "filter": 110.0, "added": 5.0},
+            "traceid": {"get": 50.0},
+        }
+        self.assertEqual(
+            compare(results, baseline, threshold=0.25),
+            ["logging: format: 1000.0 -> 1300.0 ns/op (+30%)"],
+        )
+        self.assertEqual(compare(results, baseline, threshold=0.5), [])
+
+    def test_discover(self):
+        modules = discover()
+        self.assertIn("logging", modules)
+        self.assertIn("concurrency", modules)
+        with self.assertRaises(SystemExit):
+            main(["unknown"])
@@ -0,0 +1,223 @@
+import contextlib
+import datetime
+import io
+import logging
+import os
+import tempfile
+import unittest
+import uuid
+
+from traceid.binary import BinaryDecoder, BinaryFormatter, decode, main
+from traceid.logging import BinaryStreamHandler, JSONFormatter, JSONFragment
+from traceid.traceid import TraceId
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def point_default(value):
+    return {"x": value.x, "y": value.y}
+
+
+class TestBinaryFormatter(unittest.TestCase):
+    def setUp(self):
+        TraceId.clear()
+        self.logger = logging.getLogger("test_binary")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.handlers.clear()
+        TraceId.clear()
+
+    def log_both(self, log, **kwargs):
+        """
+        Run log(logger) with a BinaryFormatter and a JSONFormatter built from the same kwargs.
+        Return the binary stream and the JSON lines.
+        """
+        binary, text = io.BytesIO(), io.BytesIO()
+        binary_handler = BinaryStreamHandler(binary)
+        binary_handler.setFormatter(BinaryFormatter(**kwargs))
+        json_handler = BinaryStreamHandler(text)
+        json_handler.setFormatter(JSONFormatter(**kwargs))
+        self.logger.handlers = [binary_handler, json_handler]
+        log(self.logger)
+        return binary.getvalue(), text.getvalue()
+
+    def assertRoundTrip(self, log, **kwargs):
+        binary, text = self.log_both(log, **kwargs)
+        decoded = b"".join(line + b"\n" for line in decode(io.BytesIO(binary)))
+        self.assertEqual(decoded, text)
+        return binary, text
+
+    def test_default_keys(self):
+        def log(logger):
+            with TraceId.scope():
+                for i in range(20):
+                    logger.info("hello %d", i)
+                    logger.warning("ünïcödé")
+            logger.debug("outside")
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                logger.exception("boom")
+
+        binary, text = self.assertRoundTrip(log)
+        self.assertLess(len(binary), len(text) / 2)
+
+    def test_values(self):
+        def log(logger):
+            logger.info(
+                "values",
+                extra={
+                    "none": None,
+                    "flag": True,
+                    "off": False,
+                    "count": -12345678901234567890,
+                    "ratio": 0.1,
+                    "nan": float("nan"),
+                    "items": [1, "two", {"three": 3.0}],
+                    "point": Point(1, 2),
+                    "raw": JSONFragment('{"a":[1,2]}'),
+                    "user.id": "u1",
+                },
+            )
+            logger.info("again", extra={"count": 1, "other": "x"})
+
+        for kwargs in (
+            dict(capture_extras=True, json_default=point_default),
+            dict(
+                capture_extras=True,
+                json_default=point_default,
+                static_fields={"service": "api", "version": 2},
+            ),
+            dict(
+                capture_extras=True,
+                json_default=point_default,
+                json_ensure_ascii=True,
+                json_separators=(",", ":"),
+            ),
+            dict(capture_extras=True, json_default=point_default, json_indent=2),
+            dict(
+                capture_extras=True, json_default=point_default, json_backend="orjson"
+            ),
+        ):
+            with self.subTest(kwargs=kwargs):
+                self.assertRoundTrip(log, **kwargs)
+
+    def test_ids(self):
+        def log(logger):
+            for traceid in (
+                uuid.uuid4(),
+                "4bf92f3577b34da6a3ce929d0e0e4736",
+                "4BF92F3577B34DA6A3CE929D0E0E4736",
+                "123e4567-E89B-12d3-a456-426614174000",
+                "not-an-id",
+                "",
+            ):
+                with TraceId.scope(traceid):
+                    with TraceId.span():
+                        logger.info("id")
+
+        keys = ["trace_id", "span_id", "parent_span_id", "message"]
+        binary, _ = self.assertRoundTrip(log, keys=keys)
+        self.assertNotIn(b"4bf92f3577b34da6a3ce929d0e0e4736", binary)
+        self.assertIn(b"4BF92F3577B34DA6A3CE929D0E0E4736", binary)
+
+    def test_time(self):
+        def log(logger):
+            for created in (0.0, 1.5, 1700000000.1234565, 1700000000.9999996, -1.25):
+                record = logger.makeRecord(
+                    logger.name, logging.INFO, __file__, 1, "t", (), None
+                )
+                record.created = created
+                logger.handle(record)
+
+        for kwargs in (
+            {},
+            dict(tzinfo=datetime.timezone.utc),
+            dict(tzinfo=datetime.timezone(datetime.timedelta(hours=-5, minutes=-30))),
+            dict(tzinfo=datetime.timezone(datetime.timedelta(seconds=3661))),
+            dict(datetimefmt="%Y-%m-%d %H:%M:%S"),
+            dict(datetimefmt="%H:%M:%S.%f"),
+        ):
+            with self.subTest(kwargs=kwargs):
+                self.assertRoundTrip(log, keys=["asctime", "message"], **kwargs)
+
+    def test_dictionaries(self):
+        def log(logger):
+            for i in range(50):
+                logger.info("message", extra={"request": i})
+
+        binary, _ = self.assertRoundTrip(log, capture_extras=True)
+        self.assertEqual(binary.count(b"request"), 1)
+        self.assertEqual(binary.count(b"test_binary"), 1)
+
+    def test_reset(self):
+        formatter = BinaryFormatter(keys=["message"])
+        record = logging.LogRecord("r", logging.INFO, __file__, 1, "one", (), None)
+        first = formatter.format_bytes(record)
+        self.assertTrue(first.startswith(b"\0TIDB"))
+        self.assertFalse(formatter.format_bytes(record).startswith(b"\0"))
+        formatter.keys = ["message", "levelname"]
+        self.assertTrue(formatter.format_bytes(record).startswith(b"\0TIDB"))
+        formatter.reset()
+        self.assertTrue(formatter.format_bytes(record).startswith(b"\0TIDB"))
+        self.assertEqual(
+            formatter.format(record), '{"message": "one", "levelname": "INFO"}'
+        )
+
+    def test_concatenated_streams(self):
+        def log(logger):
+            logger.info("one")
+            logger.handlers[0].formatter.reset()
+            logger.info("two")
+
+        self.assertRoundTrip(log, keys=["message", "levelname"])
+
+    def test_streaming(self):
+        def log(logger):
+            for i in range(30):
+                logger.info("message %d", i, extra={"n": i})
+
+        binary, text = self.log_both(log, capture_extras=True)
+        decoder = BinaryDecoder()
+        lines = []
+        for i in range(len(binary)):
+            lines.extend(decoder.feed(binary[i : i + 1]))
+        decoder.close()
+        self.assertEqual(b"".join(line + b"\n" for line in lines), text)
+
+    def test_errors(self):
+        binary, _ = self.log_both(lambda logger: logger.info("x"), keys=["message"])
+        decoder = BinaryDecoder()
+        decoder.feed(binary[:-3])
+        with self.assertRaises(ValueError):
+            decoder.close()
+        with self.assertRaises(ValueError):
+            BinaryDecoder().feed(b"\0NOPE")
+        with self.assertRaises(ValueError):
+            BinaryDecoder().feed(binary[binary.index(b"\n") + 1 :])
+        with self.assertRaises(ValueError):
+            BinaryDecoder().feed(binary.replace(b"\n", b"\r"))
+
+    def test_main(self):
+        binary, text = self.log_both(
+            lambda logger: logger.info("cli"), keys=["message", "levelname"]
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "app.tidb")
+            with open(path, "wb") as f:
+                f.write(binary)
+            output = io.TextIOWrapper(io.BytesIO())
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(main([path]), 0)
+            output.flush()
+            self.assertEqual(output.buffer.getvalue(), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
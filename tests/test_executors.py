@@ -0,0 +1,79 @@
+import asyncio
+import concurrent.futures
+import pickle
+import unittest
+from uuid import uuid4
+
+from traceid import TraceId
+from traceid.executors import (
+    TracedCall,
+    TraceIdProcessPoolExecutor,
+    TraceIdThreadPoolExecutor,
+    dump_traceid,
+    load_traceid,
+    run_in_executor,
+    submit,
+)
+
+
+def get_traceid(_=None):
+    return TraceId.peek()
+
+
+class TestExecutors(unittest.TestCase):
+    def test_dump_load(self):
+        t_uuid = uuid4()
+        TraceId.set(t_uuid, coverage=True)
+        data = dump_traceid(TraceId.current())
+        self.assertEqual(data, t_uuid.bytes)
+        self.assertEqual(load_traceid(data).traceid, t_uuid)  # type: ignore
+        TraceId.set("test_id", coverage=True)
+        self.assertEqual(load_traceid(dump_traceid(TraceId.current())).traceid, "test_id")  # type: ignore
+        self.assertIsNone(dump_traceid(None))
+        self.assertIsNone(load_traceid(None))
+
+    def test_traced_call_restores_context(self):
+        TraceId.set("outer", coverage=True)
+        call = TracedCall(get_traceid, (), None, load_traceid("inner"))
+        self.assertEqual(call(), "inner")
+        self.assertEqual(TraceId.get(), "outer")
+        restored = pickle.loads(pickle.dumps(call))
+        self.assertEqual(restored(), "inner")
+
+    def test_thread_pool(self):
+        t_uuid = uuid4()
+        with TraceIdThreadPoolExecutor(max_workers=1) as executor:
+            TraceId.set(t_uuid, coverage=True)
+            self.assertEqual(executor.submit(get_traceid).result(), t_uuid)
+            self.assertEqual(list(executor.map(get_traceid, range(3))), [t_uuid] * 3)
+            TraceId.clear()
+            # The worker thread does not keep the previous task's trace ID
+            self.assertIsNone(executor.submit(get_traceid).result())
+
+    def test_submit_helper(self):
+        TraceId.set("test_id", coverage=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertIsNone(executor.submit(get_traceid).result())
+            self.assertEqual(submit(executor, get_traceid).result(), "test_id")
+
+    def test_process_pool(self):
+        t_uuid = uuid4()
+        TraceId.set(t_uuid, coverage=True)
+        with TraceIdProcessPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(executor.submit(get_traceid).result(), t_uuid)
+            self.assertEqual(
+                list(executor.map(get_traceid, range(4), chunksize=2)), [t_uuid] * 4
+            )
+
+
+class TestRunInExecutor(unittest.IsolatedAsyncioTestCase):
+    async def test_run_in_executor(self):
+        TraceId.set("async_id", coverage=True)
+        self.assertEqual(await run_in_executor(None, get_traceid), "async_id")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(
+                await run_in_executor(
+                    executor, get_traceid, loop=asyncio.get_running_loop()
+                ),
+                "async_id",
+            )
@@ -0,0 +1,98 @@
+import os
+import re
+import time
+import unittest
+import unittest.mock
+from uuid import UUID
+
+from traceid import TraceId
+from traceid.traceid import (
+    GENERATORS,
+    RandomPool,
+    gen_hex64,
+    gen_hex128,
+    gen_ulid,
+    gen_uuid7,
+    get_generator,
+    register_generator,
+)
+
+
+class TestGenerators(unittest.TestCase):
+    def test_uuid7(self):
+        before = time.time_ns() // 1_000_000
+        value = gen_uuid7()
+        after = time.time_ns() // 1_000_000
+        self.assertIsInstance(value, UUID)
+        self.assertEqual(value.version, 7)
+        self.assertEqual(value.variant, "specified in RFC 4122")
+        self.assertTrue(before <= value.int >> 80 <= after)
+        # Behaves like a UUID built through UUID.__init__
+        self.assertEqual(UUID(str(value)), value)
+        self.assertEqual(hash(UUID(int=value.int)), hash(value))
+
+    def test_hex(self):
+        self.assertRegex(gen_hex64(), r"^[0-9a-f]{16}$")
+        self.assertRegex(gen_hex128(), r"^[0-9a-f]{32}$")
+        self.assertEqual(len({gen_hex128() for _ in range(1000)}), 1000)
+
+    def test_ulid(self):
+        value = gen_ulid()
+        self.assertRegex(value, r"^[0-9A-HJKMNP-TV-Z]{26}$")
+        alphabet = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+        decoded = 0
+        for char in value:
+            decoded = decoded * 32 + alphabet.index(char)
+        self.assertAlmostEqual(decoded >> 80, time.time_ns() // 1_000_000, delta=1000)
+
+        with unittest.mock.patch("time.time_ns", return_value=1_000_000):
+            first = gen_ulid()
+        with unittest.mock.patch("time.time_ns", return_value=2_000_000):
+            second = gen_ulid()
+        self.assertLess(first, second)
+
+    def test_random_pool(self):
+        pool = RandomPool(size=32)
+        chunks = [pool.take(10) for _ in range(10)]
+        self.assertTrue(all(len(chunk) == 10 for chunk in chunks))
+        self.assertEqual(len(set(chunks)), 10)
+        self.assertEqual(len({pool.take(3) for _ in range(100)}), 100)
+        # Larger than the pool size
+        self.assertEqual(len(pool.take(100)), 100)
+        pool.reset()
+        self.assertEqual(len(pool.take(1)), 1)
+
+    def test_gen_with_scheme(self):
+        for scheme in GENERATORS:
+            with self.subTest(scheme=scheme):
+                TraceId.clear()
+                TraceId.gen(scheme)
+                self.assertTrue(TraceId.is_set())
+        TraceId.clear()
+        TraceId.gen(lambda: "custom")
+        self.assertEqual(TraceId.get(), "custom")
+
+        with self.assertRaises(ValueError):
+            TraceId.gen("unknown")
+
+    def test_default_scheme(self):
+        TraceId.clear()
+        old_scheme = TraceId.default_scheme
+        try:
+            TraceId.set_default_scheme("hex64")
+            TraceId.gen()
+            self.assertRegex(TraceId.get(), r"^[0-9a-f]{16}$")  # type: ignore
+            with self.assertRaises(ValueError):
+                TraceId.set_default_scheme("unknown")
+            self.assertEqual(TraceId.default_scheme, "hex64")
+        finally:
+            TraceId.default_scheme = old_scheme
+
+    def test_register_generator(self):
+        register_generator("test", lambda: "test_id")
+        try:
+            self.assertEqual(get_generator("test")(), "test_id")
+            with self.assertRaises(ValueError):
+                register_generator("test", "not callable")  # type: ignore
+        finally:
+            del GENERATORS["test"]
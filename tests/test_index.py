@@ -0,0 +1,134 @@
+import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from traceid.index import TraceIndex, main
+from traceid.logging import JSONFormatter
+from traceid.traceid import TraceId
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def write_lines(path: str, count: int, first: int = 0, traces: int = 5) -> list[bytes]:
+    """
+    Append JSONFormatter lines, one second apart, cycling through `traces` trace IDs.
+    """
+    formatter = JSONFormatter(
+        keys=["asctime", "trace_id", "message"], tzinfo=datetime.timezone.utc
+    )
+    lines = []
+    for i in range(first, first + count):
+        record = logging.LogRecord(
+            "test", logging.INFO, __file__, 1, "line %d", (i,), None
+        )
+        record.created = START.timestamp() + i
+        with TraceId.scope(f"trace-{i % traces}"):
+            lines.append(formatter.format(record).encode("utf-8"))
+    with open(path, "ab") as f:
+        f.write(b"".join(line + b"\n" for line in lines))
+    return lines
+
+
+class TestTraceIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "app.log")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookup_and_incremental_update(self):
+        lines = write_lines(self.path, 100)
+        index = TraceIndex(self.path, run_size=16, block_size=512)
+        self.assertEqual(list(index.lines_for("trace-1")), [])
+        self.assertEqual(index.update(), 100)
+        self.assertEqual(index.update(), 0)
+        self.assertGreater(len(index.runs()), 1)
+        self.assertEqual(list(index.lines_for("trace-1")), lines[1::5])
+        self.assertEqual(list(index.lines_for("missing")), [])
+
+        # Appended lines are indexed incrementally, an unterminated line waits for its newline
+        lines += write_lines(self.path, 20, first=100)
+        with open(self.path, "ab") as f:
+            f.write(b'{"trace_id": "trace-1", "message": "partial')
+        self.assertEqual(index.update(), 20)
+        self.assertEqual(list(index.lines_for("trace-1")), lines[1::5])
+        with open(self.path, "ab") as f:
+            f.write(b'"}\n')
+        self.assertEqual(index.update(), 1)
+        self.assertEqual(
+            list(index.lines_for("trace-1"))[-1],
+            b'{"trace_id": "trace-1", "message": "partial"}',
+        )
+
+        # Compaction keeps the results
+        expected = list(index.lines_for("trace-3"))
+        index.compact()
+        self.assertEqual(len(index.runs()), 1)
+        self.assertEqual(list(index.lines_for("trace-3")), expected)
+
+    def test_time_range(self):
+        lines = write_lines(self.path, 200)
+        with open(self.path, "ab") as f:
+            f.write(b'{"trace_id": "trace-0", "message": "no time"}\n')
+        index = TraceIndex(self.path, run_size=50, block_size=256)
+        index.update()
+        since = START + datetime.timedelta(seconds=42)
+        until = START + datetime.timedelta(seconds=57)
+        self.assertEqual(list(index.time_range(since, until)), lines[42:57])
+        self.assertEqual(list(index.time_range(end=since)), lines[:42])
+        self.assertEqual(list(index.time_range(start=until)), lines[57:])
+        self.assertEqual(
+            list(index.lines_for("trace-2", since, until)),
+            [line for line in lines[42:57] if b"trace-2" in line],
+        )
+        self.assertEqual(len(list(index.lines_for("trace-0"))), 41)
+
+    def test_rebuild_after_rotation(self):
+        write_lines(self.path, 50)
+        index = TraceIndex(self.path)
+        index.update()
+        os.remove(self.path)
+        lines = write_lines(self.path, 10, first=500)
+        self.assertEqual(index.update(), 10)
+        self.assertEqual(list(index.lines_for("trace-0")), lines[0::5])
+
+        # A crash while appending leaves a partial run, which is dropped
+        with open(index.index_path, "ab") as f:
+            f.write(b"TIR1" + b"\x00" * 10)
+        self.assertEqual(len(index.runs()), 1)
+        lines += write_lines(self.path, 5, first=510)
+        self.assertEqual(index.update(), 5)
+        self.assertEqual(list(index.lines_for("trace-0")), lines[0::5])
+
+    def test_cli(self):
+        lines = write_lines(self.path, 30)
+        output = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        with unittest.mock.patch("sys.stdout", new=output):
+            self.assertEqual(main([self.path, "--trace", "trace-4"]), 0)
+        self.assertEqual(
+            output.buffer.getvalue(), b"".join(line + b"\n" for line in lines[4::5])  # type: ignore
+        )
+        self.assertTrue(os.path.exists(self.path + ".tidx"))
+
+        output = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        with unittest.mock.patch("sys.stdout", new=output):
+            main(
+                [
+                    self.path,
+                    "--since",
+                    "2024-01-01T00:00:10+00:00",
+                    "--until",
+                    "2024-01-01T00:00:12+00:00",
+                ]
+            )
+        decoded = [json.loads(line) for line in output.buffer.getvalue().splitlines()]  # type: ignore
+        self.assertEqual([log["message"] for log in decoded], ["line 10", "line 11"])
+
+        with self.assertRaises(SystemExit):
+            main([self.path])
@@ -1,14 +1,28 @@
 import datetime
 import logging
+import logging.handlers
 import inspect
 import io
 import json
+import os
+import pickle
+import sys
+import threading
+import time
 import uuid
 import unittest
 import unittest.mock
 import zoneinfo
 
-from traceid.logging import JSONFormatter, TraceIdFilter
+from traceid.logging import (
+    LOGRECORD_ATTRIBUTES,
+    RESERVED,
+    JSONFormatter,
+    JSONFragment,
+    QueueJSONHandler,
+    SamplingFilter,
+    TraceIdFilter,
+)
 from traceid.traceid import TraceId
 
 
@@ -36,6 +50,43 @@ class TestLogging(unittest.TestCase):
             logger.info("test with trace id")
             self.assertEqual(fake_out.getvalue(), f"{t_uuid}-INFO-test with trace id\n")
 
+    def test_filter_span_fields(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(
+            logging.Formatter("%(trace_id)s %(span_id)s %(parent_span_id)s %(message)s")
+        )
+        handler.addFilter(TraceIdFilter())
+        logger = logging.getLogger("test_filter_span_fields")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        TraceId.clear()
+        logger.info("outside")
+        with TraceId.scope("trace"):
+            with TraceId.span() as span:
+                logger.info("inside")
+        self.assertEqual(
+            stream.getvalue(),
+            f"None None None outside\ntrace {span.span_id} None inside\n",
+        )
+
+    def test_filtered_record_pickles(self):
+        handler = logging.handlers.SocketHandler("localhost", None)
+        sampling = SamplingFilter(rate=1.0, rate_limit=1000)
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        with TraceId.scope("trace"):
+            with TraceId.span() as span:
+                # The sampling decision, holding the filter and its lock, lives in the trace state
+                self.assertTrue(sampling.filter(record))
+                TraceIdFilter().filter(record)
+        data = pickle.loads(handler.makePickle(record)[4:])
+        self.assertEqual(data["trace_id"], "trace")
+        self.assertEqual(data["span_id"], span.span_id)
+        self.assertIsNone(data["parent_span_id"])
+        handler.close()
+
     def test_formatter_normal(self):
         TraceId.clear()
         with unittest.mock.patch("sys.stdout", new=io.StringIO()) as fake_out:
@@ -217,3 +268,563 @@ class TestLogging(unittest.TestCase):
                     "stack_info": log["stack_info"],
                 },
             )
+
+    def test_formatter_extra_keys(self):
+        TraceId.clear()
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        record.user = "alice"
+        setattr(record, "user.id", 42)
+
+        formatter = JSONFormatter(keys=["message", "user"])
+        self.assertEqual(
+            json.loads(formatter.format(record)), {"message": "msg", "user": "alice"}
+        )
+        formatter = JSONFormatter(keys=["user"])
+        self.assertEqual(json.loads(formatter.format(record)), {"user": "alice"})
+        formatter = JSONFormatter(keys=["user", "user.id"])
+        self.assertEqual(
+            json.loads(formatter.format(record)), {"user": "alice", "user.id": 42}
+        )
+        formatter = JSONFormatter(keys=[])
+        self.assertEqual(json.loads(formatter.format(record)), {})
+
+        for keys in (["message", "missing"], ["missing"], ["message", "missing.key"]):
+            with self.subTest(keys=keys):
+                formatter = JSONFormatter(keys=keys)
+                with self.assertRaisesRegex(AttributeError, "Attribute missing"):
+                    formatter.format(record)
+
+        with self.assertRaises(TypeError):
+            JSONFormatter(keys=["message", 1])  # type: ignore
+
+        # Assigning keys recompiles the extraction plan
+        formatter = JSONFormatter(keys=["message"])
+        formatter.keys = ["message", "levelname", "asctime"]
+        self.assertTrue(formatter.usesTime())
+        self.assertEqual(
+            list(json.loads(formatter.format(record))),
+            ["message", "levelname", "asctime"],
+        )
+
+    def test_lazy_enrichment(self):
+        TraceId.clear()
+        TraceId.set("test_id")
+        message = unittest.mock.MagicMock()
+        message.__str__.return_value = "msg"
+        try:
+            raise RuntimeError("test")
+        except RuntimeError:
+            record = logging.LogRecord(
+                "test", logging.ERROR, __file__, 1, message, None, sys.exc_info()
+            )
+
+        # Fields that are not in keys are not computed
+        formatter = JSONFormatter(keys=["levelname"])
+        with unittest.mock.patch.object(formatter, "formatException") as format_exc:
+            self.assertEqual(
+                json.loads(formatter.format(record)), {"levelname": "ERROR"}
+            )
+        format_exc.assert_not_called()
+        message.__str__.assert_not_called()
+        for name in ("message", "asctime", "trace_id", "span_id"):
+            self.assertFalse(hasattr(record, name), name)
+        self.assertIsNone(record.exc_text)
+
+        formatter = JSONFormatter(keys=["trace_id", "message", "exc_text"])
+        log = json.loads(formatter.format(record))
+        self.assertEqual(log["trace_id"], "test_id")
+        self.assertEqual(log["message"], "msg")
+        self.assertTrue(log["exc_text"].endswith("RuntimeError: test"))
+        TraceId.clear()
+
+    def test_exc_text_cache(self):
+        formatter = JSONFormatter(keys=["exc_text"])
+
+        def record_for(exc_info) -> logging.LogRecord:
+            return logging.LogRecord(
+                "test", logging.ERROR, __file__, 1, "msg", None, exc_info
+            )
+
+        def inner():
+            try:
+                raise RuntimeError("test")
+            except RuntimeError:
+                formatter.format(record_for(sys.exc_info()))
+                raise
+
+        try:
+            inner()
+        except RuntimeError:
+            exc_info = sys.exc_info()
+        inner_text = getattr(exc_info[1], "_traceid_exc_text")[1]
+
+        # The traceback grew while the exception propagated, so it is formatted again
+        text = json.loads(formatter.format(record_for(exc_info)))["exc_text"]
+        self.assertNotEqual(text, inner_text)
+        self.assertIn("inner()", text)
+        # The same exception in another record is served from the cache
+        with unittest.mock.patch("traceback.print_exception") as print_exception:
+            again = json.loads(formatter.format(record_for(exc_info)))["exc_text"]
+        print_exception.assert_not_called()
+        self.assertEqual(again, text)
+
+        # A formatter overriding formatException() is not served from the cache
+        class CustomFormatter(JSONFormatter):
+            def formatException(self, ei) -> str:
+                return "custom"
+
+        record = record_for(exc_info)
+        self.assertEqual(
+            json.loads(CustomFormatter(keys=["exc_text"]).format(record)),
+            {"exc_text": "custom"},
+        )
+
+    def test_static_fields(self):
+        TraceId.clear()
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        static = {"service": "api", "version": "1.2.3", "labels": {"region": "eu"}}
+        for kwargs in (
+            {},
+            {"json_separators": (",", ":")},
+            {"json_ensure_ascii": True},
+            {"json_indent": 2},
+            {"json_backend": "orjson"},
+        ):
+            with self.subTest(kwargs=kwargs):
+                formatter = JSONFormatter(
+                    keys=["levelname", "message"], static_fields=static, **kwargs
+                )
+                text = formatter.format(record)
+                self.assertEqual(
+                    list(json.loads(text).items()),
+                    [*static.items(), ("levelname", "INFO"), ("message", "msg")],
+                )
+                self.assertEqual(formatter.format_bytes(record), text.encode())
+                if "json_indent" not in kwargs:
+                    self.assertEqual(text.count("\n"), 0)
+
+        formatter = JSONFormatter(keys=["message"], static_fields={"service": "é"})
+        self.assertEqual(formatter.format(record), '{"service": "é", "message": "msg"}')
+        formatter.json_ensure_ascii = True
+        self.assertEqual(
+            formatter.format(record), '{"service": "\\u00e9", "message": "msg"}'
+        )
+        formatter.static_fields = {}
+        self.assertEqual(formatter.format(record), '{"message": "msg"}')
+        self.assertEqual(
+            JSONFormatter(keys=[], static_fields={"a": 1}).format(record), '{"a": 1}'
+        )
+
+        with self.assertRaisesRegex(ValueError, "overlap keys: message"):
+            JSONFormatter(keys=["message"], static_fields={"message": "x"})
+        formatter.keys = ["service"]
+        with self.assertRaises(ValueError):
+            formatter.static_fields = {"service": "api"}
+        formatter.keys = ["message"]
+        with self.assertRaises(TypeError):
+            formatter.static_fields = {"service": object()}
+        self.assertEqual(formatter.static_fields, {})
+
+    def test_json_fragment(self):
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        context = {"user": {"id": 42, "roles": ["admin"]}}
+        record.context = JSONFragment(json.dumps(context))
+        record.request = "GET /"
+        for kwargs in ({}, {"json_indent": 2}, {"json_backend": "orjson"}):
+            with self.subTest(kwargs=kwargs):
+                formatter = JSONFormatter(
+                    keys=["context", "message", "request"],
+                    static_fields={"service": "api"},
+                    **kwargs,
+                )
+                expected = {
+                    "service": "api",
+                    "message": "msg",
+                    "request": "GET /",
+                    "context": context,
+                }
+                self.assertEqual(json.loads(formatter.format(record)), expected)
+                self.assertEqual(json.loads(formatter.format_bytes(record)), expected)
+        # Without a fragment the value is a plain string
+        record.context = json.dumps(context)
+        formatter = JSONFormatter(keys=["context"])
+        self.assertEqual(
+            json.loads(formatter.format(record)), {"context": json.dumps(context)}
+        )
+
+    def test_capture_extras(self):
+        TraceId.clear()
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        formatter = JSONFormatter(
+            keys=["levelname", "message"],
+            static_fields={"service": "api"},
+            capture_extras=True,
+        )
+        handler.setFormatter(formatter)
+        handler.addFilter(TraceIdFilter())
+        logger = logging.getLogger("test.capture_extras")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            logger.warning("no extras")
+            logger.warning(
+                "extras",
+                extra={
+                    "user": "alice",
+                    "context": JSONFragment('{"id": 42}'),
+                    "service": "ignored",
+                    "request": {"path": "/"},
+                },
+            )
+        finally:
+            logger.removeHandler(handler)
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(
+            first, {"service": "api", "levelname": "WARNING", "message": "no extras"}
+        )
+        self.assertEqual(
+            list(second.items()),
+            [
+                ("service", "api"),
+                ("levelname", "WARNING"),
+                ("message", "extras"),
+                ("user", "alice"),
+                ("request", {"path": "/"}),
+                ("context", {"id": 42}),
+            ],
+        )
+
+        formatter = JSONFormatter(keys=["message"])
+        record = logging.makeLogRecord({"msg": "msg", "user": "alice"})
+        self.assertEqual(json.loads(formatter.format(record)), {"message": "msg"})
+        formatter.capture_extras = True
+        self.assertTrue(formatter.capture_extras)
+        self.assertEqual(
+            json.loads(formatter.format(record)), {"message": "msg", "user": "alice"}
+        )
+
+    def test_logrecord_attributes(self):
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        self.assertTrue(set(record.__dict__) <= LOGRECORD_ATTRIBUTES)
+        self.assertIn("message", LOGRECORD_ATTRIBUTES)
+        self.assertIn("trace_id", RESERVED)
+        self.assertIsInstance(RESERVED, frozenset)
+        if sys.version_info >= (3, 12):
+            self.assertIn("taskName", LOGRECORD_ATTRIBUTES)
+
+    def test_format_time_cache(self):
+        def reference(formatter: JSONFormatter, created: float) -> str:
+            if formatter.tzinfo is None:
+                asctime = datetime.datetime.fromtimestamp(created).astimezone()
+            else:
+                asctime = datetime.datetime.fromtimestamp(created, formatter.tzinfo)
+            if formatter.datetimefmt:
+                return asctime.strftime(formatter.datetimefmt)
+            return asctime.isoformat()
+
+        timestamps = []
+        # New York DST transitions in 2021, spring forward and fall back
+        for transition in (1615705200, 1636264800):
+            for offset in range(-3, 4):
+                second = transition + offset
+                timestamps += [
+                    second,
+                    second + 0.5,
+                    second + 0.0000004,
+                    second + 0.9999995,
+                    second + 0.9999996,
+                    second + 0.123456,
+                ]
+        timestamps += [0.0, -1.5, 1234567890.000001]
+
+        old_tz = os.environ.get("TZ")
+        os.environ["TZ"] = "America/New_York"
+        time.tzset()
+        try:
+            for kwargs in (
+                {},
+                {"tzinfo": zoneinfo.ZoneInfo("America/New_York")},
+                {"tzinfo": datetime.timezone.utc},
+                {"datetimefmt": "%Y-%m-%d %H:%M:%S %z"},
+                {"datetimefmt": "%H:%M:%S.%f"},
+            ):
+                formatter = JSONFormatter(keys=["asctime"], **kwargs)
+                for created in timestamps:
+                    with self.subTest(kwargs=kwargs, created=created):
+                        record = logging.LogRecord(
+                            "test", logging.INFO, __file__, 1, "msg", None, None
+                        )
+                        record.created = created
+                        self.assertEqual(
+                            formatter.format_time(record),
+                            reference(formatter, created),
+                        )
+        finally:
+            if old_tz is None:
+                del os.environ["TZ"]
+            else:
+                os.environ["TZ"] = old_tz
+            time.tzset()
+
+
+class BlockingStream(io.BytesIO):
+    """A binary stream whose write() waits until it is released."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, data):  # type: ignore
+        self.released.wait()
+        return super().write(data)
+
+
+class TestQueueJSONHandler(unittest.TestCase):
+    def make_logger(self, handler: logging.Handler) -> logging.Logger:
+        logger = logging.getLogger(f"test_queue_{id(handler)}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        return logger
+
+    def test_emit(self):
+        TraceId.clear()
+        stream = io.BytesIO()
+        handler = QueueJSONHandler(stream)
+        handler.setFormatter(JSONFormatter(keys=["trace_id", "message"]))
+        logger = self.make_logger(handler)
+
+        t_uuid = uuid.uuid4()
+        TraceId.set(t_uuid)
+        logger.info("with trace id")
+        # The trace ID is captured at emit time, not when the worker formats the record
+        TraceId.clear()
+        logger.info("without trace id")
+        handler.flush()
+        handler.close()
+        handler.close()
+
+        self.assertEqual(
+            [json.loads(line) for line in stream.getvalue().splitlines()],
+            [
+                {"trace_id": str(t_uuid), "message": "with trace id"},
+                {"trace_id": None, "message": "without trace id"},
+            ],
+        )
+        self.assertEqual(
+            handler.stats(),
+            {"queued": 0, "enqueued": 2, "written": 2, "failed": 0, "dropped": 0},
+        )
+
+    def test_emit_after_close(self):
+        for overflow in QueueJSONHandler.OVERFLOW_POLICIES:
+            with self.subTest(overflow=overflow):
+                stream = io.BytesIO()
+                handler = QueueJSONHandler(stream, maxsize=2, overflow=overflow)
+                logger = self.make_logger(handler)
+                logger.info("before close")
+                handler.close()
+                for i in range(5):
+                    logger.info("after close %d", i)
+                self.assertEqual(
+                    handler.stats(),
+                    {
+                        "queued": 0,
+                        "enqueued": 1,
+                        "written": 1,
+                        "failed": 0,
+                        "dropped": 5,
+                    },
+                )
+                logger.removeHandler(handler)
+
+    def test_write_error(self):
+        class BrokenStream(io.BytesIO):
+            def write(self, data):  # type: ignore
+                raise OSError("broken")
+
+        handler = QueueJSONHandler(BrokenStream())
+        logger = self.make_logger(handler)
+        with unittest.mock.patch.object(handler, "handleError") as handle_error:
+            for i in range(3):
+                logger.info("record %d", i)
+            handler.close()
+        stats = handler.stats()
+        self.assertEqual(stats["enqueued"], 3)
+        self.assertEqual(stats["written"] + stats["failed"], 3)
+        self.assertEqual(stats["failed"], 3)
+        self.assertTrue(handle_error.called)
+
+    def test_trace_id_capture_marker(self):
+        class PrefixFormatter(JSONFormatter):
+            def formatTraceId(self):
+                return "prefix-" + str(TraceId.peek_text())
+
+        TraceId.clear()
+        TraceId.set("test_id")
+        formatter = PrefixFormatter(keys=["trace_id"])
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        # A trace ID set by TraceIdFilter is still overridden by formatTraceId()
+        TraceIdFilter().filter(record)
+        self.assertEqual(
+            json.loads(formatter.format(record)), {"trace_id": "prefix-test_id"}
+        )
+
+        # A trace ID captured by QueueJSONHandler is kept as is
+        stream = io.BytesIO()
+        handler = QueueJSONHandler(stream)
+        handler.setFormatter(formatter)
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        handler.handle(record)
+        TraceId.clear()
+        handler.close()
+        self.assertEqual(json.loads(stream.getvalue()), {"trace_id": "test_id"})
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_fork(self):
+        read_fd, write_fd = os.pipe()
+        handler = QueueJSONHandler(io.BytesIO())
+        handler.setFormatter(JSONFormatter(keys=["message"]))
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            stream = io.BytesIO()
+            handler.stream = stream
+            handler.handle(
+                logging.LogRecord(
+                    "test", logging.INFO, __file__, 1, "child", None, None
+                )
+            )
+            handler.close()
+            os.write(write_fd, stream.getvalue())
+            os._exit(0)
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_fd, "rb") as pipe:
+            self.assertEqual(pipe.read(), b'{"message": "child"}\n')
+        handler.close()
+
+    def test_text_stream(self):
+        stream = io.StringIO()
+        handler = QueueJSONHandler(stream, batch_size=2)
+        handler.setFormatter(JSONFormatter(keys=["message"]))
+        logger = self.make_logger(handler)
+        for i in range(5):
+            logger.info("héllo %d", i)
+        handler.close()
+        self.assertEqual(
+            stream.getvalue().splitlines(),
+            [f'{{"message": "héllo {i}"}}' for i in range(5)],
+        )
+
+    def test_drop(self):
+        stream = BlockingStream()
+        handler = QueueJSONHandler(stream, maxsize=2)
+        logger = self.make_logger(handler)
+        for i in range(10):
+            logger.info("record %d", i)
+        stream.released.set()
+        handler.close()
+        stats = handler.stats()
+        self.assertGreater(stats["dropped"], 0)
+        self.assertEqual(stats["enqueued"] + stats["dropped"], 10)
+        self.assertEqual(stats["written"], stats["enqueued"])
+        self.assertEqual(len(stream.getvalue().splitlines()), stats["written"])
+
+    def test_block_and_sample(self):
+        for overflow, expected_dropped in (("block", 0), ("sample", None)):
+            with self.subTest(overflow=overflow):
+                stream = BlockingStream()
+                handler = QueueJSONHandler(
+                    stream, maxsize=2, overflow=overflow, sample_rate=3
+                )
+                logger = self.make_logger(handler)
+                timer = threading.Timer(0.05, stream.released.set)
+                timer.start()
+                for i in range(20):
+                    logger.info("record %d", i)
+                handler.close()
+                timer.join()
+                stats = handler.stats()
+                self.assertEqual(stats["enqueued"] + stats["dropped"], 20)
+                self.assertEqual(stats["written"], stats["enqueued"])
+                if expected_dropped is not None:
+                    self.assertEqual(stats["dropped"], expected_dropped)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            QueueJSONHandler(io.BytesIO(), overflow="unknown")
+        with self.assertRaises(ValueError):
+            QueueJSONHandler(io.BytesIO(), sample_rate=0)
+        with self.assertRaises(ValueError):
+            QueueJSONHandler(io.BytesIO(), batch_size=0)
+
+
+class TestSamplingFilter(unittest.TestCase):
+    def make_record(self, level: int = logging.INFO) -> logging.LogRecord:
+        return logging.LogRecord("test", level, __file__, 1, "msg", None, None)
+
+    def test_rate(self):
+        sampling = SamplingFilter(rate=0.5)
+        kept = 0
+        for i in range(1000):
+            with TraceId.scope(f"trace-{i}"):
+                decision = sampling.filter(self.make_record())
+                # The decision is the same for every record of the trace
+                self.assertEqual(sampling.filter(self.make_record()), decision)
+                self.assertEqual(sampling.keep_trace(f"trace-{i}"), decision)
+                # Warnings are always kept
+                self.assertTrue(sampling.filter(self.make_record(logging.WARNING)))
+                kept += decision
+        self.assertTrue(400 < kept < 600, kept)
+
+        with TraceId.scope("trace"):
+            self.assertFalse(SamplingFilter(rate=0.0).filter(self.make_record()))
+            self.assertTrue(SamplingFilter(rate=1.0).filter(self.make_record()))
+        with self.assertRaises(ValueError):
+            SamplingFilter(rate=1.5)
+
+    def test_decision_cached_in_context(self):
+        sampling = SamplingFilter(rate=0.5, max_lines_per_trace=3)
+        with TraceId.span() as root:
+            with unittest.mock.patch.object(
+                sampling, "keep_trace", return_value=True
+            ) as keep_trace:
+                results = [sampling.filter(self.make_record()) for _ in range(2)]
+                # Child spans share the decision and the line budget of the trace
+                with TraceId.span():
+                    results += [sampling.filter(self.make_record()) for _ in range(2)]
+            self.assertEqual(keep_trace.call_count, 1)
+            self.assertEqual(results, [True, True, True, False])
+            self.assertEqual(root.state[sampling], [True, 0])
+            self.assertTrue(sampling.filter(self.make_record(logging.ERROR)))
+
+    def test_rate_limit(self):
+        now = [100.0]
+        with unittest.mock.patch("time.monotonic", new=lambda: now[0]):
+            sampling = SamplingFilter(rate_limit=2, burst=3)
+            TraceId.clear()
+            results = [sampling.filter(self.make_record()) for _ in range(5)]
+            self.assertEqual(results, [True, True, True, False, False])
+            self.assertTrue(sampling.filter(self.make_record(logging.WARNING)))
+            now[0] += 1.0
+            results = [sampling.filter(self.make_record()) for _ in range(3)]
+            self.assertEqual(results, [True, True, False])
+
+    def test_rate_limit_below_one_per_second(self):
+        now = [100.0]
+        with unittest.mock.patch("time.monotonic", new=lambda: now[0]):
+            sampling = SamplingFilter(rate_limit=0.5)
+            self.assertEqual(sampling.burst, 1.0)
+            TraceId.clear()
+            results = [sampling.filter(self.make_record()) for _ in range(2)]
+            self.assertEqual(results, [True, False])
+            now[0] += 1.0
+            self.assertFalse(sampling.filter(self.make_record()))
+            now[0] += 1.2
+            results = [sampling.filter(self.make_record()) for _ in range(2)]
+            self.assertEqual(results, [True, False])
+        with self.assertRaises(ValueError):
+            SamplingFilter(rate_limit=10, burst=0)
+        with self.assertRaises(ValueError):
+            SamplingFilter(rate_limit=10, burst=0.5)
@@ -0,0 +1,125 @@
+import asyncio
+import io
+import logging
+import unittest
+
+from traceid import metrics
+from traceid.logging import BinaryStreamHandler, JSONFormatter, QueueJSONHandler
+from traceid.middleware import TraceIdWSGIMiddleware
+from traceid.traceid import TraceId
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        TraceId.clear()
+
+    def tearDown(self):
+        metrics.disable()
+        TraceId.clear()
+
+    def test_disabled(self):
+        metrics.disable()
+        self.assertFalse(metrics.is_enabled())
+        TraceId.gen()
+        TraceId.clear()
+        self.assertIsNone(metrics.collector)
+
+    def test_traceid_counters(self):
+        collector = metrics.enable()
+        self.assertTrue(metrics.is_enabled())
+        TraceId.gen()
+        TraceId.gen()  # already set, nothing generated
+        TraceId.clear()
+        token = TraceId.set("test_id")
+        TraceId.clear(token)
+        with TraceId.scope():
+            with TraceId.span():
+                pass
+
+        async def main():
+            async with TraceId.scope("async_id"):
+                pass
+
+        asyncio.run(main())
+        self.assertEqual(collector.ids_generated, 2)
+        self.assertEqual(collector.traceid_sets, 5)
+        self.assertEqual(collector.traceid_clears, 5)
+
+    def test_middleware_counters(self):
+        collector = metrics.enable()
+
+        def app(environ, start_response):
+            start_response("200 OK", [])
+            return [b"ok"]
+
+        middleware = TraceIdWSGIMiddleware(app)
+        middleware({}, lambda *args: None).close()  # type: ignore
+        self.assertEqual(collector.ids_generated, 1)
+        self.assertEqual(collector.traceid_sets, 1)
+        self.assertEqual(collector.traceid_clears, 1)
+
+    def test_logging_metrics(self):
+        collector = metrics.enable(sample_every=2)
+        formatter = JSONFormatter(keys=["message"])
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "é", None, None)
+
+        stream = io.BytesIO()
+        handler = BinaryStreamHandler(stream)
+        handler.setFormatter(formatter)
+        for _ in range(4):
+            handler.handle(record)
+        formatter.format(record)
+
+        text_stream = io.StringIO()
+        queue_handler = QueueJSONHandler(text_stream)
+        queue_handler.setFormatter(formatter)
+        queue_handler.handle(record)
+        queue_handler.close()
+
+        self.assertEqual(collector.records_formatted, 6)
+        self.assertEqual(
+            collector.bytes_emitted,
+            len(stream.getvalue()) + len(text_stream.getvalue().encode("utf-8")),
+        )
+        data = metrics.snapshot()
+        self.assertEqual(data["records_formatted"], 6)
+        # The first call and then one of every 2 calls are timed: 6 formats and 5 writes
+        self.assertEqual(data["format_seconds"]["count"], 3)
+        self.assertEqual(data["write_seconds"]["count"], 3)
+        self.assertEqual(data["format_seconds"]["buckets"][float("inf")], 3)
+
+        # The values stay readable after disable()
+        metrics.disable()
+        formatter.format(record)
+        self.assertEqual(metrics.snapshot()["records_formatted"], 6)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram([0.001, 0.01])
+        for seconds in (0.0005, 0.001, 0.005, 1.0):
+            histogram.observe(seconds)
+        self.assertEqual(
+            histogram.snapshot(),
+            {
+                "buckets": {0.001: 2, 0.01: 3, float("inf"): 4},
+                "sum": 1.0065,
+                "count": 4,
+            },
+        )
+        with self.assertRaises(ValueError):
+            metrics.Metrics(sample_every=0)
+
+    def test_prometheus_text(self):
+        collector = metrics.enable()
+        collector.ids_generated = 3
+        collector.format_seconds.observe(0.00002)
+        text = metrics.prometheus_text()
+        lines = text.splitlines()
+        self.assertIn("# TYPE traceid_ids_generated_total counter", lines)
+        self.assertIn("traceid_ids_generated_total 3", lines)
+        self.assertIn("# TYPE traceid_format_seconds histogram", lines)
+        self.assertIn('traceid_format_seconds_bucket{le="1e-05"} 0', lines)
+        self.assertIn('traceid_format_seconds_bucket{le="2.5e-05"} 1', lines)
+        self.assertIn('traceid_format_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn("traceid_format_seconds_count 1", lines)
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn("app_bytes_emitted_total 0", metrics.prometheus_text("app_"))
@@ -0,0 +1,218 @@
+import asyncio
+import unittest
+from uuid import UUID
+
+from traceid import TraceId
+from traceid.traceid import TraceContext
+
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+from traceid.middleware import TraceIdASGIMiddleware, TraceIdWSGIMiddleware
+
+
+class TestASGIMiddleware(unittest.IsolatedAsyncioTestCase):
+    async def call(self, app, scope):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await app(scope, receive, send)
+        return messages
+
+    def make_app(self, seen: list):
+        async def app(scope, receive, send):
+            seen.append(TraceId.peek())
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-type", b"text/plain")],
+                }
+            )
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        return app
+
+    async def test_request_id(self):
+        TraceId.clear()
+        seen: list = []
+        app = TraceIdASGIMiddleware(self.make_app(seen))
+        messages = await self.call(
+            app,
+            {"type": "http", "headers": [(b"x-request-id", b"req-123")]},
+        )
+        self.assertEqual(seen, ["req-123"])
+        self.assertEqual(
+            messages[0]["headers"],
+            [(b"content-type", b"text/plain"), (b"x-request-id", b"req-123")],
+        )
+        self.assertEqual(messages[1], {"type": "http.response.body", "body": b"ok"})
+        # The context is reset after the request
+        self.assertFalse(TraceId.is_set())
+
+    async def test_generated_and_invalid(self):
+        for headers in (
+            [],
+            [(b"x-request-id", b"bad value\n")],
+            [(b"x-request-id", b"a" * 200)],
+        ):
+            with self.subTest(headers=headers):
+                seen: list = []
+                app = TraceIdASGIMiddleware(self.make_app(seen), scheme="uuid4")
+                messages = await self.call(app, {"type": "http", "headers": headers})
+                self.assertIsInstance(seen[0], UUID)
+                self.assertEqual(
+                    messages[0]["headers"][-1], (b"x-request-id", str(seen[0]).encode())
+                )
+
+    async def test_concurrent_requests(self):
+        async def app(scope, receive, send):
+            await asyncio.sleep(0.01)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": TraceId.peek_text().encode()})  # type: ignore
+
+        middleware = TraceIdASGIMiddleware(app, header_name="X-Trace")
+        results = await asyncio.gather(
+            *(
+                self.call(
+                    middleware,
+                    {"type": "http", "headers": [(b"x-trace", f"id-{i}".encode())]},
+                )
+                for i in range(5)
+            )
+        )
+        self.assertEqual(
+            [messages[1]["body"] for messages in results],
+            [f"id-{i}".encode() for i in range(5)],
+        )
+
+    async def test_traceparent(self):
+        seen: list = []
+
+        async def app(scope, receive, send):
+            seen.append((TraceId.current(), TraceId.traceparent()))
+
+        middleware = TraceIdASGIMiddleware(app)
+        await middleware(
+            {
+                "type": "http",
+                "headers": [
+                    (b"x-request-id", b"req-123"),
+                    (b"traceparent", TRACEPARENT.encode()),
+                ],
+            },
+            None,
+            None,
+        )
+        context, traceparent = seen[-1]
+        self.assertEqual(context.text, "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(context.parent_id, "00f067aa0ba902b7")
+        self.assertEqual(
+            traceparent, f"00-4bf92f3577b34da6a3ce929d0e0e4736-{context.span_id}-01"
+        )
+
+        # An invalid traceparent falls back to the request ID, in a root span
+        await middleware(
+            {
+                "type": "http",
+                "headers": [(b"traceparent", b"00-bad"), (b"x-request-id", b"req-1")],
+            },
+            None,
+            None,
+        )
+        context, traceparent = seen[-1]
+        self.assertEqual(context.text, "req-1")
+        self.assertIsNotNone(context.span_id)
+        self.assertIsNone(context.parent_id)
+        self.assertIsNone(traceparent)
+
+        # Generated uuid4 traceids can be propagated
+        await middleware({"type": "http", "headers": []}, None, None)
+        context, traceparent = seen[-1]
+        self.assertEqual(
+            traceparent, TraceContext(context.traceid, context.span_id).to_traceparent()
+        )
+
+        await TraceIdASGIMiddleware(app, traceparent=False)(
+            {"type": "http", "headers": [(b"traceparent", TRACEPARENT.encode())]},
+            None,
+            None,
+        )
+        self.assertNotEqual(seen[-1][0].text, "4bf92f3577b34da6a3ce929d0e0e4736")
+
+    async def test_other_scope(self):
+        seen: list = []
+
+        async def app(scope, receive, send):
+            seen.append(TraceId.peek())
+
+        TraceId.clear()
+        await TraceIdASGIMiddleware(app)({"type": "lifespan"}, None, None)
+        self.assertEqual(seen, [None])
+
+
+class TestWSGIMiddleware(unittest.TestCase):
+    def test_request_id(self):
+        TraceId.clear()
+        seen = []
+
+        def app(environ, start_response):
+            seen.append(TraceId.peek())
+            start_response("200 OK", [("Content-Type", "text/plain")])
+
+            def body():
+                # Lazily generated bodies still see the traceid
+                seen.append(TraceId.peek())
+                yield b"ok"
+
+            return body()
+
+        responses = []
+
+        def start_response(status, headers, exc_info=None):
+            responses.append((status, headers))
+
+        middleware = TraceIdWSGIMiddleware(app)
+        result = middleware({"HTTP_X_REQUEST_ID": "req-1"}, start_response)
+        self.assertEqual(list(result), [b"ok"])
+        result.close()  # type: ignore
+        self.assertEqual(seen, ["req-1", "req-1"])
+        self.assertEqual(
+            responses,
+            [("200 OK", [("Content-Type", "text/plain"), ("X-Request-ID", "req-1")])],
+        )
+        self.assertFalse(TraceId.is_set())
+
+        result = middleware({"HTTP_X_REQUEST_ID": "bad value"}, start_response)
+        result.close()  # type: ignore
+        self.assertIsInstance(seen[-1], UUID)
+
+    def test_traceparent(self):
+        seen = []
+
+        def app(environ, start_response):
+            seen.append(TraceId.current())
+            return []
+
+        TraceIdWSGIMiddleware(app)(
+            {"HTTP_X_REQUEST_ID": "req-1", "HTTP_TRACEPARENT": TRACEPARENT}, None
+        ).close()  # type: ignore
+        self.assertEqual(seen[0].text, "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(seen[0].parent_id, "00f067aa0ba902b7")
+        TraceIdWSGIMiddleware(app)({"HTTP_X_REQUEST_ID": "req-1"}, None).close()  # type: ignore
+        self.assertEqual(seen[1].text, "req-1")
+        self.assertIsNotNone(seen[1].span_id)
+        self.assertFalse(TraceId.is_set())
+
+    def test_app_error(self):
+        TraceId.clear()
+
+        def app(environ, start_response):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            TraceIdWSGIMiddleware(app)({}, None)
+        self.assertFalse(TraceId.is_set())
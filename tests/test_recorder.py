@@ -0,0 +1,184 @@
+import io
+import json
+import logging
+import unittest
+
+from traceid.logging import JSONFormatter
+from traceid.middleware import TraceIdWSGIMiddleware
+from traceid.recorder import FlightRecorderFilter, FlightRecorderHandler
+from traceid.traceid import TRACE_END_HOOKS, TraceId
+
+
+class TestFlightRecorder(unittest.TestCase):
+    def setUp(self):
+        TraceId.clear()
+        self.stream = io.StringIO()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(JSONFormatter(keys=("message", "trace_id")))
+        self.recorder = FlightRecorderHandler(self.target)
+        self.logger = logging.getLogger("test_recorder")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.logger.addHandler(self.recorder)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.recorder)
+        self.recorder.close()
+        TraceId.clear()
+
+    def lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_discard_at_scope_end(self):
+        with TraceId.scope("quiet"):
+            self.logger.debug("one")
+            self.logger.info("two")
+            self.assertEqual(self.recorder.stats()["buffered"], 1)
+        self.assertEqual(self.lines(), [{"message": "two", "trace_id": "quiet"}])
+        stats = self.recorder.stats()
+        self.assertEqual(stats["traces"], 0)
+        self.assertEqual(stats["buffered"], 0)
+        self.assertEqual(stats["discarded"], 1)
+
+    def test_flush_on_error(self):
+        with TraceId.scope("loud"):
+            self.logger.debug("one")
+            self.logger.debug("two")
+            self.assertEqual(self.stream.getvalue(), "")
+            self.logger.error("boom")
+            self.logger.debug("three")
+        self.assertEqual(
+            [line["message"] for line in self.lines()],
+            ["one", "two", "boom", "three"],
+        )
+        self.assertEqual({line["trace_id"] for line in self.lines()}, {"loud"})
+        self.assertEqual(self.recorder.stats()["flushed"], 2)
+        self.assertEqual(self.recorder.stats()["traces"], 0)
+
+    def test_discard_at_clear(self):
+        for _ in range(3):
+            TraceId.gen()
+            self.logger.debug("quiet")
+            with TraceId.span():
+                self.logger.debug("in span")
+            TraceId.clear()
+        token = TraceId.set("token")
+        self.logger.debug("quiet")
+        TraceId.clear(token)
+        # Clearing again ends nothing
+        TraceId.clear()
+        stats = self.recorder.stats()
+        self.assertEqual(stats["traces"], 0)
+        self.assertEqual(stats["buffered"], 0)
+        self.assertEqual(stats["discarded"], 7)
+        self.assertEqual(self.stream.getvalue(), "")
+
+    def test_clear_in_scope_does_not_end_trace(self):
+        with TraceId.scope("parent"):
+            self.logger.debug("before")
+            TraceId.clear()
+            self.assertEqual(self.recorder.stats()["traces"], 1)
+        self.assertEqual(self.recorder.stats()["traces"], 0)
+
+    def test_span_does_not_end_trace(self):
+        with TraceId.scope("parent"):
+            self.logger.debug("before")
+            with TraceId.span():
+                self.logger.debug("inside")
+            self.assertEqual(self.recorder.stats()["buffered"], 2)
+            self.logger.error("boom")
+        self.assertEqual(
+            [line["message"] for line in self.lines()], ["before", "inside", "boom"]
+        )
+
+    def test_mark(self):
+        with TraceId.scope("marked"):
+            self.logger.debug("one")
+            self.recorder.mark()
+            self.logger.debug("two")
+        self.assertEqual([line["message"] for line in self.lines()], ["one", "two"])
+
+    def test_mark_other_context(self):
+        with TraceId.scope("first"):
+            self.logger.debug("one")
+            TraceId.set("second", coverage=True)
+            self.recorder.mark("first")
+        self.assertEqual(self.lines(), [{"message": "one", "trace_id": "first"}])
+
+    def test_no_trace(self):
+        self.logger.debug("dropped")
+        self.logger.info("kept")
+        self.assertEqual(self.lines(), [{"message": "kept", "trace_id": None}])
+
+    def test_capacity(self):
+        self.recorder.capacity = 2
+        with TraceId.scope("ring"):
+            for i in range(5):
+                self.logger.debug(str(i))
+            self.logger.error("boom")
+        self.assertEqual([line["message"] for line in self.lines()], ["3", "4", "boom"])
+        self.assertEqual(self.recorder.stats()["evicted"], 3)
+
+    def test_lru_eviction(self):
+        self.recorder.max_records = 3
+        TraceId.set("a")
+        self.logger.debug("a1")
+        TraceId.set("b", coverage=True)
+        self.logger.debug("b1")
+        TraceId.set("a", coverage=True)
+        self.logger.debug("a2")
+        TraceId.set("c", coverage=True)
+        self.logger.debug("c1")  # evicts b, the least recently used trace
+        stats = self.recorder.stats()
+        self.assertEqual(stats["traces"], 2)
+        self.assertEqual(stats["buffered"], 3)
+        self.assertEqual(stats["evicted"], 1)
+        self.recorder.mark("b")
+        self.recorder.mark("a")
+        self.assertEqual([line["message"] for line in self.lines()], ["a1", "a2"])
+
+    def test_max_traces(self):
+        self.recorder.max_traces = 2
+        for traceid in ("a", "b", "c"):
+            TraceId.set(traceid, coverage=True)
+            self.logger.debug(traceid)
+        self.assertEqual(self.recorder.stats()["traces"], 2)
+
+    def test_filter(self):
+        other = logging.getLogger("test_recorder_other")
+        other.propagate = False
+        other.addHandler(logging.NullHandler())
+        other.addFilter(FlightRecorderFilter(self.recorder))
+        try:
+            with TraceId.scope("filtered"):
+                self.logger.debug("one")
+                other.warning("not yet")
+                self.assertEqual(self.stream.getvalue(), "")
+                other.error("boom")
+                self.assertEqual([line["message"] for line in self.lines()], ["one"])
+        finally:
+            other.handlers.clear()
+            other.filters.clear()
+
+    def test_middleware_discards(self):
+        def app(environ, start_response):
+            self.logger.debug("request")
+            start_response("200 OK", [])
+            return [b"ok"]
+
+        body = TraceIdWSGIMiddleware(app)(
+            {}, lambda status, headers, exc_info=None: None
+        )
+        self.assertEqual(self.recorder.stats()["buffered"], 1)
+        body.close()
+        self.assertEqual(self.recorder.stats()["discarded"], 1)
+        self.assertEqual(self.stream.getvalue(), "")
+
+    def test_close(self):
+        self.assertIn(self.recorder._discard, TRACE_END_HOOKS)
+        self.recorder.close()
+        self.assertNotIn(self.recorder._discard, TRACE_END_HOOKS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import asyncio
+import io
+import logging
+import threading
+import time
+import unittest
+
+from traceid import JSONFormatter, TraceId, registry
+from traceid.binary import BinaryFormatter
+from traceid.middleware import TraceIdWSGIMiddleware
+from traceid.registry import ActiveTraceRegistry, TraceStats
+
+
+class Context(object):
+    def __init__(self, text: str):
+        self.text = text
+
+
+class TestActiveTraceRegistry(unittest.TestCase):
+    def test_start_count_end(self):
+        store = ActiveTraceRegistry(capacity=4)
+        store.start(Context("a"))
+        store.count("a", logging.INFO, 100)
+        store.count("a", logging.ERROR, 50)
+        store.count("a", 100, 1)
+        store.count("b", logging.INFO, 100)
+        store.count(None, logging.INFO, 100)
+        (stats,) = store.traces()
+        self.assertEqual(stats.traceid, "a")
+        self.assertEqual(stats.records, 3)
+        self.assertEqual(stats.bytes, 151)
+        self.assertEqual(stats.levels, {"INFO": 1, "ERROR": 1, "CRITICAL": 1})
+        self.assertAlmostEqual(stats.started, time.time(), delta=5)
+        self.assertGreaterEqual(stats.duration, 0.0)
+        store.end(Context("a"))
+        store.end(Context("a"))
+        self.assertEqual(len(store), 0)
+        self.assertEqual(
+            store.stats(), {"active": 0, "started": 1, "ended": 1, "evicted": 0}
+        )
+
+    def test_nested_starts(self):
+        store = ActiveTraceRegistry()
+        store.start(Context("a"))
+        store.start(Context("a"))
+        store.end(Context("a"))
+        self.assertEqual(len(store), 1)
+        store.end(Context("a"))
+        self.assertEqual(len(store), 0)
+
+    def test_reused_slot_is_reset(self):
+        store = ActiveTraceRegistry(capacity=1)
+        store.start(Context("a"))
+        store.count("a", logging.INFO, 10)
+        store.end(Context("a"))
+        store.start(Context("b"))
+        (stats,) = store.traces()
+        self.assertEqual((stats.traceid, stats.records, stats.bytes), ("b", 0, 0))
+
+    def test_eviction_keeps_active_traces(self):
+        store = ActiveTraceRegistry(capacity=3)
+        for name in "abc":
+            store.start(Context(name))
+        # A full sweep clears every reference bit and evicts the first trace
+        store.start(Context("d"))
+        self.assertEqual({stats.traceid for stats in store.traces()}, set("bcd"))
+        # "b" logs, so the idle "c" is evicted next
+        store.count("b", logging.INFO, 1)
+        store.start(Context("e"))
+        self.assertEqual({stats.traceid for stats in store.traces()}, set("bde"))
+        self.assertEqual(store.stats()["evicted"], 2)
+        store.end(Context("a"))
+        self.assertEqual(store.stats()["ended"], 0)
+
+    def test_reports(self):
+        store = ActiveTraceRegistry()
+        for name in "abc":
+            store.start(Context(name))
+            time.sleep(0.001)
+        store.count("b", logging.INFO, 1000)
+        for _ in range(3):
+            store.count("c", logging.DEBUG, 10)
+        self.assertEqual(
+            [stats.traceid for stats in store.longest_running(2)], ["a", "b"]
+        )
+        self.assertEqual([stats.traceid for stats in store.chattiest(1)], ["b"])
+        self.assertEqual(
+            [stats.traceid for stats in store.chattiest(2, by="records")], ["c", "b"]
+        )
+        with self.assertRaises(ValueError):
+            store.chattiest(by="lines")
+        self.assertIsInstance(store.traces()[0], TraceStats)
+
+    def test_threads(self):
+        store = ActiveTraceRegistry(capacity=64)
+
+        def work(number: int):
+            for i in range(200):
+                context = Context(f"{number}-{i % 10}")
+                store.start(context)
+                store.count(context.text, logging.INFO, 1)
+                store.end(context)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(
+            store.stats(), {"active": 0, "started": 800, "ended": 800, "evicted": 0}
+        )
+
+    def test_invalid_capacity(self):
+        with self.assertRaises(ValueError):
+            ActiveTraceRegistry(capacity=0)
+
+
+class TestRegistryIntegration(unittest.TestCase):
+    def setUp(self):
+        TraceId.clear()
+        self.registry = registry.enable()
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        self.handler.setFormatter(JSONFormatter(keys=["message"]))
+        self.logger = logging.getLogger("test_registry")
+        self.logger.handlers = [self.handler]
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        registry.disable()
+        TraceId.clear()
+
+    def traceids(self) -> set[str]:
+        return {stats.traceid for stats in self.registry.traces()}
+
+    def test_disabled(self):
+        registry.disable()
+        self.assertFalse(registry.is_enabled())
+        with TraceId.scope("trace"):
+            self.logger.info("hello")
+        self.assertEqual(registry.longest_running(), [])
+        self.assertEqual(registry.chattiest(), [])
+
+    def test_scope(self):
+        self.assertTrue(registry.is_enabled())
+        with TraceId.scope("trace"):
+            self.logger.info("hello")
+            with TraceId.span():
+                self.logger.warning("héllo")
+            self.assertEqual(self.traceids(), {"trace"})
+            (stats,) = registry.chattiest()
+            self.assertEqual(stats.levels, {"INFO": 1, "WARNING": 1})
+            self.assertEqual(stats.bytes, len(self.stream.getvalue().encode()) - 2)
+            self.assertEqual(registry.longest_running()[0].traceid, "trace")
+        self.assertEqual(self.traceids(), set())
+        self.logger.info("outside")
+        self.assertEqual(self.registry.stats()["ended"], 1)
+
+    def test_set_gen_clear(self):
+        token = TraceId.set("first")
+        TraceId.clear(token)
+        TraceId.gen()
+        self.assertEqual(self.traceids(), {TraceId.peek_text()})
+        TraceId.clear()
+        TraceId.set_traceparent(
+            "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        )
+        self.assertEqual(self.traceids(), {"4bf92f3577b34da6a3ce929d0e0e4736"})
+        TraceId.clear()
+        self.assertEqual(self.traceids(), set())
+        self.assertEqual(self.registry.stats()["started"], 3)
+
+    def test_async_tasks(self):
+        async def request(number: int):
+            async with TraceId.scope(f"request-{number}"):
+                for _ in range(number):
+                    self.logger.debug("step")
+                    await asyncio.sleep(0)
+                return registry.chattiest(by="records")
+
+        async def main():
+            return await asyncio.gather(*(request(number) for number in range(1, 4)))
+
+        reports = asyncio.run(main())
+        # request-1 ends while the others are still running
+        self.assertEqual(len(reports[0]), 3)
+        self.assertEqual(reports[2][0].traceid, "request-3")
+        self.assertEqual(reports[2][0].levels, {"DEBUG": 3})
+        self.assertEqual(self.traceids(), set())
+
+    def test_bytes_formatters(self):
+        formatter = BinaryFormatter(keys=["message"])
+        record = self.logger.makeRecord("test", logging.INFO, "", 0, "hello", (), None)
+        with TraceId.scope("trace"):
+            size = len(formatter.format_bytes(record))
+            size += len(JSONFormatter().format_bytes(record))
+            (stats,) = registry.chattiest()
+        self.assertEqual(stats.records, 2)
+        self.assertEqual(stats.bytes, size)
+
+    def test_wsgi_middleware(self):
+        seen = []
+
+        def app(environ, start_response):
+            seen.append(self.traceids())
+            start_response("200 OK", [])
+            return [b"ok"]
+
+        middleware = TraceIdWSGIMiddleware(app)
+        middleware({"HTTP_X_REQUEST_ID": "request"}, lambda *args: None).close()  # type: ignore
+        self.assertEqual(seen, [{"request"}])
+        self.assertEqual(self.traceids(), set())
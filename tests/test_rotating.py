@@ -0,0 +1,211 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from traceid.logging import JSONFormatter
+from traceid.rotating import (
+    BloomFilter,
+    Manifest,
+    RotatingJSONFileHandler,
+    find_segments,
+    list_segments,
+)
+from traceid.traceid import TraceId
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return [json.loads(line) for line in f]
+
+
+class TestRotatingJSONFileHandler(unittest.TestCase):
+    def setUp(self):
+        TraceId.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, "logs", "app.log")
+        self.logger = logging.getLogger("test_rotating")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            handler.close()
+        self.logger.handlers.clear()
+        self.tmp.cleanup()
+        TraceId.clear()
+
+    def make_handler(self, **kwargs):
+        kwargs.setdefault("compression", "gzip")
+        handler = RotatingJSONFileHandler(self.filename, **kwargs)
+        handler.setFormatter(JSONFormatter(keys=["message", "trace_id"]))
+        self.logger.handlers = [handler]
+        self.handlers.append(handler)
+        return handler
+
+    def all_lines(self):
+        lines = []
+        for path in list_segments(self.filename) + [self.filename]:
+            if os.path.exists(path):
+                lines.extend(read_lines(path))
+        return lines
+
+    def test_buffering(self):
+        handler = self.make_handler(buffer_size=200, flush_interval=60)
+        self.logger.info("one")
+        self.assertEqual(os.path.getsize(self.filename), 0)
+        for i in range(10):
+            self.logger.info("line %d", i)
+        self.assertGreater(os.path.getsize(self.filename), 0)
+        handler.flush()
+        self.assertEqual(len(read_lines(self.filename)), 11)
+
+    def test_flush_interval(self):
+        self.make_handler(flush_interval=0.05)
+        self.logger.info("one")
+        deadline = time.monotonic() + 5
+        while os.path.getsize(self.filename) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(
+            read_lines(self.filename), [{"message": "one", "trace_id": None}]
+        )
+
+    def test_rotate_by_size(self):
+        handler = self.make_handler(max_bytes=300, buffer_size=100)
+        for i in range(50):
+            with TraceId.scope(f"trace-{i // 10}"):
+                self.logger.info("message %d", i)
+        handler.wait()
+        segments = list_segments(self.filename)
+        self.assertGreater(len(segments), 3)
+        self.assertEqual(handler.rotations, len(segments))
+        for segment in segments:
+            self.assertTrue(segment.endswith(".gz"))
+            self.assertLessEqual(
+                sum(len(json.dumps(line)) + 1 for line in read_lines(segment)), 300
+            )
+        handler.flush()
+        self.assertEqual(
+            [line["message"] for line in self.all_lines()],
+            [f"message {i}" for i in range(50)],
+        )
+
+    def test_rotate_by_time(self):
+        handler = self.make_handler(interval=60, compression=None)
+        with mock.patch("time.time", return_value=1000.0):
+            self.logger.info("one")
+        with mock.patch("time.time", return_value=1059.0):
+            self.logger.info("two")
+        with mock.patch("time.time", return_value=1061.0):
+            self.logger.info("three")
+        handler.wait()
+        segments = list_segments(self.filename)
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(
+            [line["message"] for line in read_lines(segments[0])], ["one", "two"]
+        )
+        manifest = Manifest.load(segments[0] + ".manifest.json")
+        self.assertEqual((manifest.start, manifest.end), (1000.0, 1059.0))
+        self.assertEqual(manifest.records, 2)
+
+    def test_find_segments(self):
+        handler = self.make_handler(max_bytes=1, compression=None)
+        for i in range(20):
+            with TraceId.scope(f"trace-{i}"):
+                self.logger.info("message %d", i)
+        handler.wait()
+        handler.flush()
+        segments = list_segments(self.filename)
+        self.assertEqual(len(segments), 19)
+        found = find_segments(self.filename, traceid="trace-5")
+        # The active file is a candidate until the handler is closed
+        self.assertEqual(found[-1], self.filename)
+        self.assertIn(segments[5], found)
+        self.assertLess(len(found), 4)
+        self.assertEqual(read_lines(segments[5])[0]["trace_id"], "trace-5")
+        self.assertEqual(
+            find_segments(self.filename, traceid="missing"), [self.filename]
+        )
+        manifest = Manifest.load(segments[3] + ".manifest.json")
+        self.assertEqual(
+            find_segments(self.filename, start=manifest.start, end=manifest.end + 1e-6)[
+                0
+            ],
+            segments[3],
+        )
+        # Without a manifest the segment is always returned.
+        os.unlink(segments[0] + ".manifest.json")
+        self.assertIn(segments[0], find_segments(self.filename, traceid="missing"))
+
+    def test_backup_count(self):
+        handler = self.make_handler(max_bytes=1, backup_count=3)
+        for i in range(10):
+            self.logger.info("message %d", i)
+        handler.wait()
+        segments = list_segments(self.filename)
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(read_lines(segments[0])[0]["message"], "message 6")
+        manifests = [
+            name
+            for name in os.listdir(os.path.dirname(self.filename))
+            if name.endswith(".manifest.json")
+        ]
+        self.assertEqual(len(manifests), 3)
+
+    def test_reopen(self):
+        handler = self.make_handler(compression=None)
+        with TraceId.scope("before"):
+            self.logger.info("one")
+        handler.close()
+        handler = self.make_handler(compression=None)
+        self.assertTrue(handler._manifest.complete)
+        with TraceId.scope("after"):
+            self.logger.info("two")
+        handler.rotate()
+        handler.wait()
+        segment = list_segments(self.filename)[0]
+        manifest = Manifest.load(segment + ".manifest.json")
+        self.assertTrue(manifest.complete)
+        self.assertEqual(manifest.records, 2)
+        self.assertTrue(manifest.may_contain("before"))
+        self.assertTrue(manifest.may_contain("after"))
+        self.assertEqual(find_segments(self.filename, traceid="missing"), [])
+
+    def test_reopen_without_manifest(self):
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, "w") as f:
+            f.write('{"message": "old"}\n')
+        handler = self.make_handler(compression=None)
+        self.logger.info("new")
+        handler.rotate()
+        handler.wait()
+        segment = list_segments(self.filename)[0]
+        self.assertFalse(Manifest.load(segment + ".manifest.json").complete)
+        self.assertEqual(find_segments(self.filename, traceid="missing"), [segment])
+        self.assertEqual(
+            [line["message"] for line in read_lines(segment)], ["old", "new"]
+        )
+
+    def test_compression_option(self):
+        with self.assertRaises(ValueError):
+            RotatingJSONFileHandler(self.filename, compression="lz4")
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(bits=1 << 16)
+        for i in range(1000):
+            bloom.add(f"trace-{i}")
+        self.assertTrue(all(f"trace-{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other-{i}" in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+        copy = Manifest.from_json(Manifest("x", traces=bloom).to_json()).traces
+        self.assertEqual(copy.data, bloom.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import importlib.util
+import io
+import json
+import logging
+import sys
+import unittest
+import uuid
+
+from traceid.logging import BinaryStreamHandler, JSONFormatter
+from traceid.serializers import (
+    MsgspecBackend,
+    OrjsonBackend,
+    StdlibBackend,
+    get_backend,
+)
+from traceid.traceid import TraceId
+
+HAS_ORJSON = importlib.util.find_spec("orjson") is not None
+HAS_MSGSPEC = importlib.util.find_spec("msgspec") is not None
+
+DATA = {"message": "héllo", "lineno": 42, "trace_id": None, "nested": [1, 2.5]}
+
+
+class TestSerializers(unittest.TestCase):
+    def test_stdlib(self):
+        for options in (
+            {},
+            {"ensure_ascii": True},
+            {"indent": 4},
+            {"separators": (",", ":")},
+            {"default": str},
+        ):
+            with self.subTest(options=options):
+                backend = get_backend("json", **options)
+                self.assertIsInstance(backend, StdlibBackend)
+                expected = json.dumps(DATA, **{"ensure_ascii": False, **options})
+                self.assertEqual(backend.dumps(DATA), expected)
+                self.assertEqual(backend.dumpb(DATA), expected.encode())
+
+    @unittest.skipUnless(HAS_ORJSON, "orjson is not installed")
+    def test_orjson(self):
+        backend = get_backend("orjson", default=str)
+        self.assertIsInstance(backend, OrjsonBackend)
+        self.assertEqual(json.loads(backend.dumps(DATA)), DATA)
+        self.assertEqual(backend.dumpb(DATA), backend.dumps(DATA).encode())
+        self.assertEqual(json.loads(backend.dumps({"v": {1}})), {"v": "{1}"})
+        self.assertIn(b"\n  ", get_backend("orjson", indent=2).dumpb(DATA))
+
+        for options in (
+            {"ensure_ascii": True},
+            {"indent": 4},
+            {"separators": (", ", ": ")},
+        ):
+            with self.subTest(options=options):
+                with self.assertRaises(ValueError):
+                    get_backend("orjson", **options)
+        get_backend("orjson", separators=(",", ":"))
+
+    @unittest.skipUnless(HAS_MSGSPEC, "msgspec is not installed")
+    def test_msgspec(self):  # pragma: no cover
+        backend = get_backend("msgspec", default=str)
+        self.assertIsInstance(backend, MsgspecBackend)
+        self.assertEqual(json.loads(backend.dumps(DATA)), DATA)
+        self.assertEqual(backend.dumpb(DATA), backend.dumps(DATA).encode())
+        with self.assertRaises(ValueError):
+            get_backend("msgspec", indent=2)
+
+    @unittest.skipIf(HAS_MSGSPEC, "msgspec is installed")
+    def test_not_installed(self):
+        with self.assertRaisesRegex(ImportError, "pip install msgspec"):
+            get_backend("msgspec")
+
+    def test_auto(self):
+        backend = get_backend("auto")
+        if HAS_ORJSON:
+            self.assertIsInstance(backend, OrjsonBackend)
+        # Falls back to the standard library when the fast backends can't honour the options
+        self.assertIsInstance(get_backend("auto", ensure_ascii=True), StdlibBackend)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_backend("unknown")
+
+    def test_formatter_bytes(self):
+        TraceId.clear()
+        t_uuid = uuid.uuid4()
+        TraceId.set(t_uuid)
+        record = logging.LogRecord(
+            "test", logging.INFO, __file__, 1, "héllo", None, None
+        )
+        for name in ("json", "auto"):
+            with self.subTest(backend=name):
+                formatter = JSONFormatter(
+                    keys=["trace_id", "message"], json_backend=name
+                )
+                self.assertEqual(
+                    formatter.format_bytes(record), formatter.format(record).encode()
+                )
+                self.assertEqual(
+                    json.loads(formatter.format_bytes(record)),
+                    {"trace_id": str(t_uuid), "message": "héllo"},
+                )
+
+    def test_binary_stream_handler(self):
+        TraceId.clear()
+        stream = io.BytesIO()
+        handler = BinaryStreamHandler(stream)
+        logger = logging.getLogger("test_binary_stream_handler")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+
+        logger.info("plain")
+        handler.setFormatter(JSONFormatter(keys=["trace_id", "message"]))
+        logger.info("héllo")
+        self.assertEqual(
+            stream.getvalue().decode().splitlines(),
+            ["plain", '{"trace_id": null, "message": "héllo"}'],
+        )
+        self.assertIs(BinaryStreamHandler().stream, sys.stdout.buffer)
+
+    def test_formatter_options_rebuild_backend(self):
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        formatter = JSONFormatter(keys=["message", "levelname"])
+        formatter.json_indent = 2
+        self.assertEqual(formatter.json_indent, 2)
+        self.assertEqual(
+            formatter.format(record),
+            json.dumps({"message": "msg", "levelname": "INFO"}, indent=2),
+        )
+        formatter.json_separators = (",", ":")
+        formatter.json_indent = None
+        self.assertEqual(
+            formatter.format(record), '{"message":"msg","levelname":"INFO"}'
+        )
+        formatter.json_ensure_ascii = True
+        formatter.json_default = str
+        self.assertTrue(formatter.json_backend.ensure_ascii)
+        self.assertIs(formatter.json_backend.default, str)
+
+    @unittest.skipUnless(HAS_ORJSON, "orjson is not installed")
+    def test_formatter_unsupported_option(self):
+        formatter = JSONFormatter(json_backend="orjson")
+        backend = formatter.json_backend
+        with self.assertRaises(ValueError):
+            formatter.json_indent = 4
+        # The previous configuration is kept
+        self.assertIsNone(formatter.json_indent)
+        self.assertIs(formatter.json_backend, backend)
@@ -0,0 +1,209 @@
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from traceid.logging import JSONFormatter
+from traceid import shm
+from traceid.shm import (
+    DATA_OFFSET,
+    RECORD,
+    Ring,
+    SharedRingCollector,
+    SharedRingHandler,
+)
+from traceid.traceid import TraceId
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def worker(directory: str, traceid: str, count: int) -> None:
+    handler = SharedRingHandler(directory, size=1 << 16, block_timeout=5)
+    handler.setFormatter(JSONFormatter(keys=("message", "trace_id")))
+    logger = make_logger("test_shm_worker", handler)
+    with TraceId.scope(traceid):
+        for i in range(count):
+            logger.info(str(i))
+    handler.close()
+
+
+class TestSharedRing(unittest.TestCase):
+    def setUp(self):
+        TraceId.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        self.output = io.BytesIO()
+        self.collector = SharedRingCollector(
+            self.directory, self.output, scan_interval=0
+        )
+        self.handler = SharedRingHandler(self.directory, size=256)
+        self.handler.setFormatter(JSONFormatter(keys=("message", "trace_id")))
+        self.logger = make_logger("test_shm", self.handler)
+
+    def tearDown(self):
+        self.handler.close()
+        self.collector.close()
+        self.tmp.cleanup()
+        TraceId.clear()
+
+    def lines(self):
+        return [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    def test_drain(self):
+        with TraceId.scope("shm"):
+            self.logger.info("one")
+            self.logger.info("two")
+        # 8 byte record header and a 38 byte line, padded to 48 bytes
+        self.assertEqual(self.handler.stats()["pending"], 2 * 48)
+        self.assertEqual(self.collector.drain(), len(self.output.getvalue()))
+        self.assertEqual(
+            self.lines(),
+            [
+                {"message": "one", "trace_id": "shm"},
+                {"message": "two", "trace_id": "shm"},
+            ],
+        )
+        stats = self.collector.stats()
+        self.assertEqual(stats["rings"], 1)
+        self.assertEqual(stats["records"], 2)
+        self.assertEqual(stats["writes"], 1)
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(self.collector.drain(), 0)
+
+    def test_wraparound(self):
+        for i in range(100):
+            self.logger.info("message %d", i)
+            if i % 3 == 2:
+                self.collector.drain()
+        self.collector.drain()
+        self.assertEqual(
+            [line["message"] for line in self.lines()],
+            [f"message {i}" for i in range(100)],
+        )
+        self.assertEqual(self.handler.stats()["dropped"], 0)
+
+    def test_drop_accounting(self):
+        for i in range(20):
+            self.logger.info("message %d", i)
+        self.logger.info("x" * 1000)  # larger than the ring
+        handler_stats = self.handler.stats()
+        self.assertEqual(handler_stats["written"] + handler_stats["dropped"], 21)
+        self.assertGreater(handler_stats["dropped"], 1)
+        self.collector.drain()
+        stats = self.collector.stats()
+        self.assertEqual(stats["records"], handler_stats["written"])
+        self.assertEqual(stats["dropped"], handler_stats["dropped"])
+        self.assertGreater(stats["dropped_bytes"], 1000)
+        # Room again after the drain
+        self.logger.info("after")
+        self.collector.drain()
+        self.assertEqual(self.lines()[-1]["message"], "after")
+
+    def test_block_timeout(self):
+        self.handler.block_timeout = 2
+        self.collector.interval = 0.001
+        self.collector.start()
+        try:
+            for i in range(200):
+                self.logger.info("message %d", i)
+        finally:
+            self.collector.stop()
+        self.assertEqual(self.handler.stats()["dropped"], 0)
+        self.assertEqual(len(self.lines()), 200)
+
+    def test_reopen(self):
+        self.logger.info("one")
+        path = os.path.join(self.directory, f"{os.getpid()}.ring")
+        ring = Ring(path)
+        self.assertEqual(ring.pid, os.getpid())
+        self.assertEqual(ring.pending(), 48)
+        ring.close()
+        with open(os.path.join(self.directory, "broken.ring"), "wb") as f:
+            f.write(b"garbage")
+        self.collector.drain()
+        self.assertEqual(self.collector.stats()["rings"], 1)
+        with self.assertRaises(ValueError):
+            Ring(os.path.join(self.directory, "broken.ring"))
+
+    def test_uncommitted_record(self):
+        ring = Ring(os.path.join(self.directory, "ring.ring"), 256)
+        self.addCleanup(ring.close)
+        self.assertTrue(ring.write(b"one\n"))
+        self.assertTrue(ring.write(b"two\n"))
+        # The tail is visible but the second record is not, as on a weakly ordered CPU
+        second = DATA_OFFSET + 16
+        committed = bytes(ring._buffer[second : second + 16])
+        ring._buffer[second : second + 16] = bytes(16)
+        out = bytearray()
+        self.assertEqual(ring.read_into(out), 1)
+        self.assertEqual(ring.read_into(out), 0)
+        self.assertEqual(ring.pending(), 16)
+        # A stale line under a fresh header does not match either
+        ring._buffer[second : second + RECORD.size] = committed[: RECORD.size]
+        self.assertEqual(ring.read_into(out), 0)
+        ring._buffer[second : second + 16] = committed
+        self.assertEqual(ring.read_into(out), 1)
+        self.assertEqual(out, b"one\ntwo\n")
+
+    def test_corrupted_record(self):
+        self.logger.info("one")
+        self.logger.info("two")
+        ring = self.handler._ring
+        ring._buffer[DATA_OFFSET + 4] ^= 0xFF  # type: ignore
+        self.collector.drain()
+        self.assertEqual(self.collector.stats()["corrupted"], 0)
+        self.assertEqual(self.collector.stats()["pending"], 96)
+        with mock.patch.object(shm, "COMMIT_TIMEOUT", 0.0):
+            self.collector.drain()
+        stats = self.collector.stats()
+        self.assertEqual(stats["corrupted"], 1)
+        self.assertEqual(stats["pending"], 0)
+        self.logger.info("three")
+        self.collector.drain()
+        self.assertEqual([line["message"] for line in self.lines()], ["three"])
+
+    @unittest.skipUnless(
+        "fork" in multiprocessing.get_all_start_methods(), "requires fork"
+    )
+    def test_processes(self):
+        context = multiprocessing.get_context("fork")
+        self.collector.interval = 0.001
+        # Rings created after the last scan are still drained by stop()
+        self.collector.scan_interval = 60
+        self.collector.start()
+        processes = [
+            context.Process(target=worker, args=(self.directory, f"trace-{n}", 300))
+            for n in range(3)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.collector.stop()
+        self.collector.scan()  # removes the drained rings of the exited workers
+        lines = self.lines()
+        self.assertEqual(len(lines), 900)
+        for n in range(3):
+            self.assertEqual(
+                [line["message"] for line in lines if line["trace_id"] == f"trace-{n}"],
+                [str(i) for i in range(300)],
+            )
+        stats = self.collector.stats()
+        self.assertEqual(stats["rings"], 0)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
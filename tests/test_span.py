@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import unittest
+from uuid import UUID
+
+from traceid import TraceId
+from traceid.executors import dump_traceid, load_traceid
+from traceid.logging import JSONFormatter, TraceIdFilter
+from traceid.traceid import InvalidTraceparentError, TraceContext
+
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+class TestSpan(unittest.TestCase):
+    def test_parse_serialize(self):
+        context = TraceContext.from_traceparent(TRACEPARENT)
+        self.assertEqual(context.traceid, "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(context.span_id, "00f067aa0ba902b7")
+        self.assertIsNone(context.parent_id)
+        self.assertEqual(context.flags, 1)
+        self.assertEqual(context.to_traceparent(), TRACEPARENT)
+        # Future versions may append fields
+        context = TraceContext.from_traceparent("01" + TRACEPARENT[2:] + "-extra")
+        self.assertEqual(context.span_id, "00f067aa0ba902b7")
+
+    def test_parse_invalid(self):
+        for header in (
+            "",
+            TRACEPARENT[:-1],
+            TRACEPARENT + "-extra",
+            TRACEPARENT.replace("-", "_"),
+            "ff" + TRACEPARENT[2:],
+            TRACEPARENT.upper(),
+            "00-00000000000000000000000000000000-00f067aa0ba902b7-01",
+            "00-4bf92f3577b34da6a3ce929d0e0e4736-0000000000000000-01",
+            "00-4bf92f3577b34da6a3ce929d0e0e473g-00f067aa0ba902b7-01",
+            "01" + TRACEPARENT[2:] + "extra",
+        ):
+            with self.subTest(header=header):
+                with self.assertRaises(InvalidTraceparentError):
+                    TraceContext.from_traceparent(header)
+        self.assertTrue(issubclass(InvalidTraceparentError, ValueError))
+
+    def test_w3c_trace_id(self):
+        t_uuid = UUID("12345678123456781234567812345678")
+        self.assertEqual(TraceContext(t_uuid).w3c_trace_id, t_uuid.hex)
+        self.assertEqual(TraceContext(str(t_uuid)).w3c_trace_id, t_uuid.hex)
+        self.assertEqual(
+            TraceContext("ABCDEF" * 5 + "12").w3c_trace_id, "abcdef" * 5 + "12"
+        )
+        with self.assertRaises(ValueError):
+            TraceContext("not-a-w3c-id").w3c_trace_id
+        with self.assertRaises(ValueError):
+            TraceContext(t_uuid).to_traceparent()
+
+    def test_child(self):
+        root = TraceContext(
+            UUID("12345678123456781234567812345678"), "1111111111111111"
+        )
+        child = root.child()
+        self.assertIs(child.traceid, root.traceid)
+        self.assertIs(child.text, root.text)
+        self.assertEqual(child.parent_id, "1111111111111111")
+        self.assertRegex(child.span_id, r"^[0-9a-f]{16}$")  # type: ignore
+        self.assertNotEqual(child.span_id, root.span_id)
+        self.assertEqual(root.child("2222222222222222").span_id, "2222222222222222")
+        self.assertIn("span_id", repr(child))
+
+    def test_span_scope(self):
+        TraceId.clear()
+        with TraceId.span() as root:
+            self.assertIsNone(root.parent_id)
+            self.assertIsNotNone(root.span_id)
+            with TraceId.span() as child:
+                self.assertEqual(child.parent_id, root.span_id)
+                self.assertEqual(child.traceid, root.traceid)
+                self.assertIs(TraceId.current(), child)
+            self.assertIs(TraceId.current(), root)
+        self.assertFalse(TraceId.is_set())
+
+        @TraceId.span()
+        def work():
+            return TraceId.current()
+
+        with TraceId.span() as root:
+            self.assertEqual(work().parent_id, root.span_id)  # type: ignore
+
+    def test_traceparent(self):
+        TraceId.clear()
+        self.assertIsNone(TraceId.traceparent())
+        token = TraceId.set_traceparent(TRACEPARENT)
+        context = TraceId.current()
+        self.assertEqual(TraceId.get(), "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(context.parent_id, "00f067aa0ba902b7")  # type: ignore
+        self.assertEqual(
+            TraceId.traceparent(),
+            f"00-4bf92f3577b34da6a3ce929d0e0e4736-{context.span_id}-01",  # type: ignore
+        )
+        with self.assertRaises(Exception):
+            TraceId.set_traceparent(TRACEPARENT)
+        TraceId.clear(token)
+        self.assertFalse(TraceId.is_set())
+
+    def test_traceparent_without_w3c_context(self):
+        TraceId.clear()
+        # A plain gen() has no span
+        TraceId.gen(scheme="uuid4")
+        self.assertIsNone(TraceId.traceparent())
+        with TraceId.span() as span:
+            self.assertEqual(
+                TraceId.traceparent(),
+                f"00-{TraceId.get().hex}-{span.span_id}-01",  # type: ignore
+            )
+        TraceId.clear()
+        for scheme in ("hex64", "ulid", lambda: "custom"):
+            with self.subTest(scheme=scheme):
+                with TraceId.scope(scheme=scheme), TraceId.span():
+                    self.assertIsNone(TraceId.traceparent())
+
+    def test_logging_fields(self):
+        TraceId.clear()
+        formatter = JSONFormatter(keys=["trace_id", "span_id", "parent_span_id"])
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        self.assertEqual(
+            json.loads(formatter.format(record)),
+            {"trace_id": None, "span_id": None, "parent_span_id": None},
+        )
+        TraceId.set_traceparent(TRACEPARENT)
+        context = TraceId.current()
+        expected = {
+            "trace_id": "4bf92f3577b34da6a3ce929d0e0e4736",
+            "span_id": context.span_id,  # type: ignore
+            "parent_span_id": "00f067aa0ba902b7",
+        }
+        self.assertEqual(json.loads(formatter.format(record)), expected)
+
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        TraceIdFilter().filter(record)
+        self.assertEqual(record.trace_id, expected["trace_id"])  # type: ignore
+        self.assertEqual(record.span_id, expected["span_id"])  # type: ignore
+        self.assertEqual(record.parent_span_id, expected["parent_span_id"])  # type: ignore
+        self.assertEqual(json.loads(formatter.format(record)), expected)
+        TraceId.clear()
+
+    def test_executor_roundtrip(self):
+        context = TraceContext(
+            UUID("12345678123456781234567812345678"), "1111111111111111"
+        ).child()
+        restored = load_traceid(dump_traceid(context))
+        for field in ("traceid", "text", "span_id", "parent_id", "flags"):
+            self.assertEqual(getattr(restored, field), getattr(context, field))
+
+
+class TestSpanAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_gather_children(self):
+        TraceId.clear()
+
+        async def child():
+            async with TraceId.span() as context:
+                await asyncio.sleep(0.001)
+                return context
+
+        async with TraceId.span() as root:
+            children = await asyncio.gather(child(), child(), child())
+        self.assertEqual({c.parent_id for c in children}, {root.span_id})
+        self.assertEqual(len({c.span_id for c in children}), 3)
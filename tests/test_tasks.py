@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import time
+import unittest
+
+from traceid import JSONFormatter, QueueJSONHandler, TraceId
+from traceid.tasks import (
+    TaskTimer,
+    TraceTaskFactory,
+    current_task_times,
+    install_task_factory,
+    task_timer,
+)
+
+
+async def current_context():
+    await asyncio.sleep(0)
+    return TraceId.current()
+
+
+def busy(seconds: float) -> None:
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+class TestTaskFactory(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        TraceId.clear()
+        self.factory = install_task_factory(timing=True)
+
+    async def test_child_spans(self):
+        async with TraceId.span() as parent:
+            children = await asyncio.gather(*(current_context() for _ in range(3)))
+            self.assertIs(TraceId.current(), parent)
+        self.assertEqual(len({child.span_id for child in children}), 3)
+        for child in children:
+            self.assertEqual(child.text, parent.text)
+            self.assertEqual(child.parent_id, parent.span_id)
+            self.assertIs(child.state, parent.state)
+
+    async def test_nested_tasks(self):
+        async def outer():
+            context = TraceId.current()
+            return context, await asyncio.create_task(current_context())
+
+        TraceId.set("trace", coverage=True)
+        context, inner = await asyncio.create_task(outer())
+        self.assertEqual(context.text, "trace")
+        self.assertIsNone(context.parent_id)
+        self.assertEqual(inner.parent_id, context.span_id)
+        self.assertEqual(TraceId.current().span_id, None)
+
+    async def test_outside_trace(self):
+        self.assertIsNone(await asyncio.create_task(current_context()))
+
+    async def test_explicit_context(self):
+        TraceId.set("trace", coverage=True)
+        context = contextvars.copy_context()
+        TraceId.clear()
+        child = await asyncio.get_running_loop().create_task(
+            current_context(), context=context
+        )
+        self.assertEqual(child.text, "trace")
+        self.assertIsNotNone(child.span_id)
+        # The context passed by the caller keeps its own value
+        self.assertIsNone(context[TraceId.traceid_var].span_id)
+
+    async def test_timing(self):
+        done = []
+        self.factory.on_done = done.append
+
+        async def work():
+            busy(0.02)
+            await asyncio.sleep(0.05)
+            return task_timer()
+
+        task = asyncio.create_task(work())
+        timer = await task
+        self.assertIs(task_timer(task), timer)
+        self.assertEqual(done, [timer])
+        self.assertEqual(timer.steps, 2)
+        self.assertIsNotNone(timer.ended)
+        self.assertGreaterEqual(timer.wall_time(), 0.07)
+        self.assertGreaterEqual(timer.cpu_time(), 0.02)
+        self.assertLess(timer.cpu_time(), 0.05)
+        self.assertEqual(timer.wall_time(), timer.wall_time())
+
+    async def test_cancelled_and_failed(self):
+        done = []
+        self.factory.on_done = done.append
+
+        async def fail():
+            raise KeyError("boom")
+
+        task = asyncio.create_task(asyncio.sleep(10))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        with self.assertRaises(KeyError):
+            await asyncio.create_task(fail())
+        self.assertEqual(len(done), 2)
+        self.assertTrue(all(timer.ended is not None for timer in done))
+
+    async def test_repr_and_stack(self):
+        task = asyncio.create_task(asyncio.sleep(10))
+        await asyncio.sleep(0)
+        self.assertIn("sleep()", repr(task))
+        self.assertEqual(len(task.get_stack()), 1)
+        self.assertIsInstance(task.get_coro(), TaskTimer)
+        self.assertEqual(task.get_coro().coro.__name__, "sleep")  # type: ignore
+        task.cancel()
+
+    async def test_formatter(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(
+            JSONFormatter(
+                keys=[
+                    "span_id",
+                    "parent_span_id",
+                    "task_wall_ms",
+                    "task_cpu_ms",
+                    "message",
+                ]
+            )
+        )
+        logger = logging.getLogger("test_tasks.formatter")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        async def work():
+            busy(0.01)
+            logger.info("in task")
+
+        async with TraceId.span() as parent:
+            # Callbacks run outside of any task
+            asyncio.get_running_loop().call_soon(logger.info, "in callback")
+            await asyncio.create_task(work())
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(lines[0]["span_id"], parent.span_id)
+        self.assertIsNone(lines[0]["task_wall_ms"])
+        self.assertIsNone(lines[0]["task_cpu_ms"])
+        self.assertEqual(lines[1]["parent_span_id"], parent.span_id)
+        self.assertGreaterEqual(lines[1]["task_cpu_ms"], 10.0)
+        self.assertGreaterEqual(lines[1]["task_wall_ms"], lines[1]["task_cpu_ms"])
+
+    async def test_queue_handler_captures_timing(self):
+        stream = io.StringIO()
+        handler = QueueJSONHandler(stream)
+        handler.setFormatter(JSONFormatter(keys=["task_cpu_ms", "message"]))
+        logger = logging.getLogger("test_tasks.queue")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        async def work():
+            busy(0.01)
+            logger.info("in task")
+
+        await asyncio.create_task(work())
+        asyncio.get_running_loop().call_soon(logger.info, "in callback")
+        await asyncio.sleep(0)
+        handler.close()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertGreaterEqual(lines[0]["task_cpu_ms"], 10.0)
+        self.assertIsNone(lines[1]["task_cpu_ms"])
+
+    async def test_inner_factory(self):
+        created = []
+
+        def inner(loop, coro, context=None, **kwargs):
+            created.append(coro)
+            return asyncio.Task(coro, loop=loop, context=context, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        loop.set_task_factory(inner)
+        factory = install_task_factory(timing=False)
+        self.assertIs(factory.inner, inner)
+        TraceId.set("trace", coverage=True)
+        task = asyncio.create_task(current_context())
+        child = await task
+        self.assertEqual(child.text, "trace")
+        self.assertEqual(len(created), 1)
+        self.assertNotIsInstance(created[0], TaskTimer)
+        self.assertIsNone(task_timer(task))
+
+
+class TestTaskTimer(unittest.TestCase):
+    def test_defaults(self):
+        factory = TraceTaskFactory()
+        self.assertTrue(factory.spans)
+        self.assertFalse(factory.timing)
+        with self.assertRaises(ValueError):
+            TraceTaskFactory(on_done=print)
+
+    def test_outside_loop(self):
+        TraceTaskFactory(timing=True)
+        self.assertIsNone(task_timer())
+        self.assertIsNone(current_task_times())
+
+    def test_drives_coroutine(self):
+        async def work():
+            await asyncio.sleep(0)
+            return 42
+
+        timer = TaskTimer(work(), clock=time.perf_counter)
+        self.assertEqual(asyncio.run(timer), 42)
+        self.assertEqual(timer.steps, 2)
+        self.assertGreater(timer.cpu, 0.0)
@@ -60,6 +60,28 @@ class TestTraceId(unittest.TestCase):
         TraceId.set(uuid4())
         self.assertTrue(TraceId.is_set())
 
+    def test_peek(self):
+        TraceId.clear()
+        self.assertIsNone(TraceId.peek())
+        t_uuid = uuid4()
+        TraceId.set(t_uuid)
+        self.assertIs(TraceId.peek(), t_uuid)
+
+    def test_peek_text(self):
+        TraceId.clear()
+        self.assertIsNone(TraceId.peek_text())
+        self.assertIsNone(TraceId.current())
+        t_uuid = uuid4()
+        TraceId.set(t_uuid)
+        # get() still returns the original object, the string form is cached
+        self.assertIs(TraceId.get(), t_uuid)
+        self.assertEqual(TraceId.peek_text(), str(t_uuid))
+        self.assertIs(TraceId.peek_text(), TraceId.peek_text())
+        self.assertIs(TraceId.current().traceid, t_uuid)  # type: ignore
+
+        TraceId.set("test_id", coverage=True)
+        self.assertIs(TraceId.peek_text(), "test_id")
+
     def test_gen(self):
         # Clear TraceId, ensure TraceId is not set. only in unittest.
         TraceId.clear()
@@ -75,3 +97,62 @@ class TestTraceId(unittest.TestCase):
         # Only first call of gen() should generate a new TraceId
         TraceId.gen()
         self.assertEqual(TraceId.get(), mock_uuid)
+
+    def test_tokens(self):
+        TraceId.clear()
+        outer = uuid4()
+        outer_token = TraceId.set(outer)
+        inner_token = TraceId.set("inner", coverage=True)
+        self.assertEqual(TraceId.get(), "inner")
+        TraceId.clear(inner_token)
+        self.assertEqual(TraceId.get(), outer)
+        TraceId.clear(outer_token)
+        self.assertFalse(TraceId.is_set())
+
+        token = TraceId.gen()
+        self.assertIsNotNone(token)
+        # gen() does nothing when a traceid is already set
+        self.assertIsNone(TraceId.gen())
+        TraceId.clear(token)
+        self.assertFalse(TraceId.is_set())
+
+    def test_scope(self):
+        TraceId.clear()
+        with TraceId.scope("outer") as outer:
+            self.assertEqual(outer, "outer")
+            with TraceId.scope(scheme="hex64") as inner:
+                self.assertEqual(TraceId.get(), inner)
+                self.assertEqual(len(inner), 16)  # type: ignore
+            self.assertEqual(TraceId.get(), "outer")
+        self.assertFalse(TraceId.is_set())
+
+        # Restored even when the block raises
+        with self.assertRaises(RuntimeError):
+            with TraceId.scope("failing"):
+                raise RuntimeError()
+        self.assertFalse(TraceId.is_set())
+
+        # A scope object can be re-entered
+        scope = TraceId.scope()
+        with scope as first:
+            with scope as second:
+                self.assertNotEqual(first, second)
+            self.assertEqual(TraceId.get(), first)
+        self.assertFalse(TraceId.is_set())
+
+        with self.assertRaises(ValueError):
+            TraceId.scope(scheme="unknown")
+
+    def test_scope_decorator(self):
+        TraceId.clear()
+
+        @TraceId.scope()
+        def handle(value):
+            return value, TraceId.get()
+
+        first = handle(1)
+        second = handle(2)
+        self.assertEqual([first[0], second[0]], [1, 2])
+        self.assertNotEqual(first[1], second[1])
+        self.assertEqual(handle.__name__, "handle")
+        self.assertFalse(TraceId.is_set())
@@ -60,3 +60,38 @@ class TestTraceIdAsync(unittest.IsolatedAsyncioTestCase):
             self.concurrent_get_method_with_father(2, 0.02),
             self.concurrent_get_method_with_father(3, 0.01),
         )
+
+    async def scoped_child(self, num: int, parent):
+        self.assertEqual(TraceId.get(), parent)
+        async with TraceId.scope(f"child-{num}") as traceid:
+            await asyncio.sleep(0.01 * (3 - num))
+            self.assertEqual(TraceId.get(), traceid)
+            async with TraceId.scope(f"grandchild-{num}"):
+                await asyncio.sleep(0.001)
+                self.assertEqual(TraceId.get(), f"grandchild-{num}")
+            self.assertEqual(TraceId.get(), traceid)
+        self.assertEqual(TraceId.get(), parent)
+        return traceid
+
+    async def test_nested_scopes_gather(self):
+        TraceId.clear()
+        async with TraceId.scope("parent"):
+            results = await asyncio.gather(
+                *(self.scoped_child(num, "parent") for num in range(3))
+            )
+            self.assertEqual(results, ["child-0", "child-1", "child-2"])
+            self.assertEqual(TraceId.get(), "parent")
+        self.assertFalse(TraceId.is_set())
+
+    async def test_scope_async_decorator(self):
+        TraceId.clear()
+
+        @TraceId.scope(scheme="uuid7")
+        async def handle():
+            await asyncio.sleep(0.001)
+            return TraceId.get()
+
+        results = await asyncio.gather(handle(), handle(), handle())
+        self.assertEqual(len(set(results)), 3)
+        self.assertTrue(all(isinstance(result, UUID) for result in results))
+        self.assertFalse(TraceId.is_set())
@@ -1,5 +1,10 @@
 from traceid.traceid import *
 from traceid.logging import *
+from traceid.executors import *
+from traceid.tasks import *
+from traceid.middleware import *
+from traceid.recorder import *
+from traceid.rotating import *
 
 
 VERSION = "0.1.0"
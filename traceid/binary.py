@@ -0,0 +1,574 @@
+import argparse
+import datetime
+import json
+import logging
+import re
+import struct
+import sys
+import typing
+
+from traceid import metrics, registry
+from traceid.logging import JSONFormatter, JSONFragment, _count_record
+
+# A binary log stream is a sequence of frames, each followed by b"\n" as written by the handlers:
+#   header: 0x00, MAGIC, varint length, JSON object with the formatter configuration
+#   record: varint length (> 0), body
+# A header starts a new stream: it resets the key and string dictionaries.
+# A record body holds the values of the configured keys in order, then the number of extra keys
+# and for each extra key a key reference followed by its value. A key reference is either 0
+# followed by the key, which adds it to the key dictionary, or the 1-based index in the dictionary.
+# Every value starts with a tag byte. Integers are varints, zigzag-encoded when they may be negative.
+MAGIC = b"TIDB"
+VERSION = 1
+NULL = 0
+TRUE = 1
+FALSE = 2
+INT = 3  # zigzag varint
+FLOAT = 4  # IEEE 754 double
+STR = 5  # varint length, UTF-8
+STR_DEF = 6  # varint length, UTF-8, added to the string dictionary
+STR_REF = 7  # varint index in the string dictionary
+UUID = 8  # 16 bytes of a canonical lowercase UUID string
+HEX = 9  # varint length, bytes of a lowercase hex string
+TIME = 10  # 8 byte signed microseconds since the epoch, then the UTC offset suffix as a string value
+JSON = 11  # varint length, JSON text of any other value
+FRAGMENT = 12  # varint length, UTF-8 text of a JSONFragment
+
+# String values of these keys are interned in the per-stream string dictionary.
+INTERNED_KEYS = frozenset(
+    (
+        "levelname",
+        "name",
+        "module",
+        "funcName",
+        "filename",
+        "pathname",
+        "processName",
+        "threadName",
+        "taskName",
+    )
+)
+# String values of these keys are stored as raw bytes when they are UUIDs or lowercase hex.
+ID_KEYS = frozenset(("trace_id", "span_id", "parent_span_id"))
+# Entries of each per-stream dictionary. Later keys and strings are written in full.
+MAX_DICTIONARY = 1 << 16
+
+_DOUBLE = struct.Struct("<d")
+_TIME = struct.Struct("<Bq")
+_SMALL = tuple(bytes((i,)) for i in range(128))
+_OFFSET = re.compile(r"([+-])(\d\d):(\d\d)(?::(\d\d))?")
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _varint(value: int) -> bytes:
+    if value < 128:
+        return _SMALL[value]
+    out = bytearray()
+    while value >= 128:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _uuid_bytes(text: str) -> bytes | None:
+    try:
+        raw = bytes.fromhex(text.replace("-", ""))
+    except ValueError:
+        return None
+    hexed = raw.hex()
+    if f"{hexed[:8]}-{hexed[8:12]}-{hexed[12:16]}-{hexed[16:20]}-{hexed[20:]}" != text:
+        return None
+    return raw
+
+
+def _hex_bytes(text: str) -> bytes | None:
+    if len(text) % 2 or len(text) > 128:
+        return None
+    try:
+        raw = bytes.fromhex(text)
+    except ValueError:
+        return None
+    return raw if raw.hex() == text else None
+
+
+class BinaryFormatter(JSONFormatter):
+    """
+    A compact binary encoding of the records JSONFormatter would write, configured the same way.
+
+    format_bytes() returns length-prefixed frames: keys are written once per stream and referenced by index,
+    low-cardinality strings such as levelname and name are interned, UUID and hex trace and span IDs are
+    stored as raw bytes and ISO 8601 asctime values as integer microseconds. The first frame of a stream
+    is a header with the formatter configuration, so decode() and the traceid-decode command convert the
+    stream back to the exact JSON lines of a JSONFormatter with the same arguments.
+    Values that json_default serializes are stored as their JSON text.
+
+    The frames of a stream depend on each other, so a formatter must write to a single stream,
+    through a handler that appends b"\\n" to every record: BinaryStreamHandler or QueueJSONHandler
+    with a binary stream. Call reset() when the handler starts a new stream, e.g. a new file.
+    format() still returns the JSON text.
+
+    Usage:
+        handler = BinaryStreamHandler(open("app.tidb", "ab"))
+        handler.setFormatter(BinaryFormatter())
+    """
+
+    def _build_template(self, backend) -> None:
+        super()._build_template(backend)
+        # Any change of the configuration starts a new stream.
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Start a new stream: the next frame is preceded by a header and the dictionaries are emptied.
+        """
+        self._header_pending = True
+        self._key_ids: dict[str, int] = {}
+        # Interned strings and the encoded reference to each
+        self._string_ids: dict[str, bytes] = {}
+        self._positional = tuple(dict.fromkeys(self._keys))
+        # Value encoder of each configured key, then of each extra key seen so far
+        self._encoders = tuple(self._encoder_for(key) for key in self._positional)
+        self._extra_encoders: dict[str, typing.Callable] = {}
+        # UTC offset suffixes of asctime that decode to a fixed offset
+        self._time_suffixes: dict[str, bool] = {}
+
+    def _encoder_for(self, key: str) -> typing.Callable[[bytearray, typing.Any], None]:
+        if key in INTERNED_KEYS:
+            return self._encode_interned
+        if key in ID_KEYS:
+            return self._encode_id
+        if key == "asctime":
+            return self._encode_time
+        return self._encode_value
+
+    def header(self) -> bytes:
+        """
+        Return the header frame that describes the configuration of this formatter.
+        """
+        options = self._json_options
+        config = {
+            "version": VERSION,
+            "keys": list(self._positional),
+            "capture_extras": self._capture_extras,
+            "backend": self._json_backend.name,
+            "ensure_ascii": options["ensure_ascii"],
+            "indent": options["indent"],
+            "separators": options["separators"],
+            "static_fields": self._json_backend.dumps(self._static_fields),
+        }
+        data = json.dumps(config).encode("utf-8")
+        return b"\0" + MAGIC + _varint(len(data)) + data + b"\n"
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """
+        Format a record as a binary frame, preceded by the header at the start of a stream.
+        """
+        if metrics.collector is None:
+            data = self._encode(self.format_dict(record))
+        else:
+            data = metrics.collector.format(self._encode, self.format_dict, record)
+        if registry.active is not None:
+            _count_record(record, len(data))
+        return data
+
+    def _encode(self, data: dict[str, typing.Any]) -> bytes:
+        key_ids, string_ids = self._key_ids, self._string_ids
+        known_keys, known_strings = len(key_ids), len(string_ids)
+        try:
+            body = self._encode_body(data)
+        except Exception:
+            # The record is not written, so the decoder never sees the entries it added.
+            for key in list(key_ids)[known_keys:]:
+                del key_ids[key]
+            for string in list(string_ids)[known_strings:]:
+                del string_ids[string]
+            raise
+        return self._frame(body)
+
+    def _encode_body(self, data: dict[str, typing.Any]) -> bytearray:
+        body = bytearray()
+        for encode, value in zip(self._encoders, data.values()):
+            encode(body, value)
+        extras = len(data) - len(self._positional)
+        body += _varint(extras)
+        if extras:
+            key_ids = self._key_ids
+            extra_encoders = self._extra_encoders
+            for key in list(data)[len(self._positional) :]:
+                index = key_ids.get(key)
+                if index is None:
+                    text = key.encode("utf-8")
+                    body.append(0)
+                    body += _varint(len(text))
+                    body += text
+                    if len(key_ids) < MAX_DICTIONARY:
+                        key_ids[key] = len(key_ids) + 1
+                else:
+                    body += _varint(index)
+                encode = extra_encoders.get(key)
+                if encode is None:
+                    encode = extra_encoders[key] = self._encoder_for(key)
+                encode(body, data[key])
+        return body
+
+    def _frame(self, body: bytearray) -> bytes:
+        frame = _varint(len(body)) + body
+        if self._header_pending:
+            self._header_pending = False
+            return self.header() + frame
+        return frame
+
+    def _encode_value(self, out: bytearray, value: typing.Any) -> None:
+        kind = type(value)
+        if kind is str:
+            text = value.encode("utf-8")
+            out.append(STR)
+            out += _varint(len(text))
+            out += text
+        elif value is None:
+            out.append(NULL)
+        elif kind is int and -(1 << 63) <= value < 1 << 64:
+            # Larger integers go through the backend, which may reject them.
+            out.append(INT)
+            out += _varint(value << 1 if value >= 0 else ((-value) << 1) - 1)
+        elif kind is bool:
+            out.append(TRUE if value else FALSE)
+        elif kind is float:
+            out.append(FLOAT)
+            out += _DOUBLE.pack(value)
+        elif kind is JSONFragment:
+            text = value.encode("utf-8")
+            out.append(FRAGMENT)
+            out += _varint(len(text))
+            out += text
+        else:
+            text = self._json_backend.dumpb(value)
+            out.append(JSON)
+            out += _varint(len(text))
+            out += text
+
+    def _encode_interned(self, out: bytearray, value: typing.Any) -> None:
+        reference = self._string_ids.get(value) if type(value) is str else None
+        if reference is not None:
+            out += reference
+        elif type(value) is str and len(self._string_ids) < MAX_DICTIONARY:
+            self._string_ids[value] = bytes((STR_REF,)) + _varint(len(self._string_ids))
+            text = value.encode("utf-8")
+            out.append(STR_DEF)
+            out += _varint(len(text))
+            out += text
+        else:
+            self._encode_value(out, value)
+
+    def _encode_id(self, out: bytearray, value: typing.Any) -> None:
+        if type(value) is str:
+            if len(value) == 36:
+                raw = _uuid_bytes(value)
+                if raw is not None:
+                    out.append(UUID)
+                    out += raw
+                    return
+            else:
+                raw = _hex_bytes(value)
+                if raw is not None:
+                    out.append(HEX)
+                    out += _SMALL[len(raw)]
+                    out += raw
+                    return
+        self._encode_value(out, value)
+
+    def _encode_time(self, out: bytearray, value: typing.Any) -> None:
+        # format_time() builds the text from the cached whole second, so it splits into integers.
+        cache = self._time_cache
+        if type(value) is str and cache is not None and not self.datetimefmt:
+            second, _, _, prefix, suffix = cache
+            fraction = len(value) - len(suffix)
+            if (
+                (fraction == 19 or fraction == 26 and value[19] == ".")
+                and value.startswith(prefix)
+                and value.endswith(suffix)
+            ):
+                decodable = self._time_suffixes.get(suffix)
+                if decodable is None:
+                    decodable = self._time_suffixes[suffix] = (
+                        _OFFSET.fullmatch(suffix) is not None
+                    )
+                if decodable:
+                    micros = second * 1000000
+                    if fraction == 26:
+                        micros += int(value[20:26])
+                    out += _TIME.pack(TIME, micros)
+                    self._encode_interned(out, suffix)
+                    return
+        self._encode_value(out, value)
+
+
+class BinaryDecoder(object):
+    """
+    Converts a binary log stream written with BinaryFormatter back into JSON lines.
+
+    Feed it the bytes of the stream in chunks of any size:
+        decoder = BinaryDecoder()
+        for chunk in chunks:
+            for line in decoder.feed(chunk):
+                ...
+        decoder.close()
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._formatter: JSONFormatter | None = None
+        self._keys: tuple[str, ...] = ()
+        self._key_list: list[str] = []
+        self._strings: list[str] = []
+        # UTC offset in seconds of each asctime suffix
+        self._offsets: dict[str, int] = {}
+        # (second, offset) and the text of the last decoded whole second
+        self._time_cache: tuple[tuple[int, int], str] | None = None
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Decode the complete frames of the stream so far and return their JSON lines, without b"\\n".
+        :raises ValueError: If the stream is not a binary log stream.
+        """
+        buffer = self._buffer
+        buffer += data
+        lines = []
+        position = 0
+        size = len(buffer)
+        while position < size:
+            if buffer[position] == 0:
+                start = position + 1 + len(MAGIC)
+                if size < start:
+                    break
+                if buffer[position + 1 : start] != MAGIC:
+                    raise ValueError("Not a binary log stream: bad header magic.")
+                parsed = self._read_length(buffer, start, size)
+                if parsed is None:
+                    break
+                length, start = parsed
+                end = start + length
+                if size <= end:
+                    break
+                self._check_terminator(buffer, end)
+                self._start_stream(bytes(buffer[start:end]))
+            else:
+                parsed = self._read_length(buffer, position, size)
+                if parsed is None:
+                    break
+                length, start = parsed
+                end = start + length
+                if size <= end:
+                    break
+                self._check_terminator(buffer, end)
+                lines.append(self._decode_record(memoryview(buffer)[start:end]))
+            position = end + 1
+        del buffer[:position]
+        return lines
+
+    def close(self) -> None:
+        """
+        :raises ValueError: If the stream ends in the middle of a frame.
+        """
+        if self._buffer:
+            raise ValueError(
+                f"Binary log stream is truncated, {len(self._buffer)} bytes left."
+            )
+
+    @staticmethod
+    def _read_length(
+        buffer: bytearray, position: int, size: int
+    ) -> tuple[int, int] | None:
+        value = 0
+        shift = 0
+        while position < size:
+            byte = buffer[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 128:
+                return value, position
+            shift += 7
+        return None
+
+    @staticmethod
+    def _check_terminator(buffer: bytearray, end: int) -> None:
+        if buffer[end] != 10:
+            raise ValueError(
+                "Binary log stream is corrupted: missing frame terminator."
+            )
+
+    def _start_stream(self, data: bytes) -> None:
+        config = json.loads(data)
+        if config.get("version") != VERSION:
+            raise ValueError(
+                f"Unsupported binary log stream version {config.get('version')!r}."
+            )
+        separators = config["separators"]
+        self._formatter = JSONFormatter(
+            keys=config["keys"],
+            json_ensure_ascii=config["ensure_ascii"],
+            json_indent=config["indent"],
+            json_separators=None if separators is None else tuple(separators),
+            json_backend=config["backend"],
+            static_fields=json.loads(config["static_fields"]),
+            capture_extras=config["capture_extras"],
+        )
+        self._keys = tuple(config["keys"])
+        self._key_list = []
+        self._strings = []
+
+    def _decode_record(self, body: memoryview) -> bytes:
+        if self._formatter is None:
+            raise ValueError("Binary log stream does not start with a header.")
+        data: dict[str, typing.Any] = {}
+        position = 0
+        read_value = self._read_value
+        for key in self._keys:
+            data[key], position = read_value(body, position)
+        extras, position = self._read_varint(body, position)
+        for _ in range(extras):
+            index, position = self._read_varint(body, position)
+            if index:
+                key = self._key_list[index - 1]
+            else:
+                key, position = self._read_text(body, position)
+                if len(self._key_list) < MAX_DICTIONARY:
+                    self._key_list.append(key)
+            data[key], position = read_value(body, position)
+        if position != len(body):
+            raise ValueError("Binary log stream is corrupted: bad record length.")
+        return self._formatter._serialize_bytes(data)
+
+    @staticmethod
+    def _read_varint(body: memoryview, position: int) -> tuple[int, int]:
+        value = 0
+        shift = 0
+        while True:
+            byte = body[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 128:
+                return value, position
+            shift += 7
+
+    def _read_zigzag(self, body: memoryview, position: int) -> tuple[int, int]:
+        value, position = self._read_varint(body, position)
+        return (value >> 1) ^ -(value & 1), position
+
+    def _read_text(self, body: memoryview, position: int) -> tuple[str, int]:
+        length, position = self._read_varint(body, position)
+        end = position + length
+        return str(body[position:end], "utf-8"), end
+
+    def _read_value(self, body: memoryview, position: int) -> tuple[typing.Any, int]:
+        tag = body[position]
+        position += 1
+        if tag == STR_REF:
+            index, position = self._read_varint(body, position)
+            return self._strings[index], position
+        if tag == STR:
+            return self._read_text(body, position)
+        if tag == UUID:
+            hexed = body[position : position + 16].hex()
+            return (
+                f"{hexed[:8]}-{hexed[8:12]}-{hexed[12:16]}-{hexed[16:20]}-{hexed[20:]}",
+                position + 16,
+            )
+        if tag == TIME:
+            micros = _TIME.unpack_from(body, position - 1)[1]
+            suffix, position = self._read_value(body, position + 8)
+            return self._format_time(micros, suffix), position
+        if tag == INT:
+            return self._read_zigzag(body, position)
+        if tag == NULL:
+            return None, position
+        if tag == STR_DEF:
+            text, position = self._read_text(body, position)
+            if len(self._strings) < MAX_DICTIONARY:
+                self._strings.append(text)
+            return text, position
+        if tag == HEX:
+            length = body[position]
+            position += 1
+            return body[position : position + length].hex(), position + length
+        if tag == TRUE:
+            return True, position
+        if tag == FALSE:
+            return False, position
+        if tag == FLOAT:
+            return _DOUBLE.unpack_from(body, position)[0], position + _DOUBLE.size
+        if tag == JSON:
+            text, position = self._read_text(body, position)
+            return json.loads(text), position
+        if tag == FRAGMENT:
+            text, position = self._read_text(body, position)
+            return JSONFragment(text), position
+        raise ValueError(f"Binary log stream is corrupted: unknown tag {tag}.")
+
+    def _format_time(self, micros: int, suffix: str) -> str:
+        offset = self._offsets.get(suffix)
+        if offset is None:
+            match = _OFFSET.fullmatch(suffix)
+            if match is None:
+                raise ValueError(f"Binary log stream has a bad UTC offset {suffix!r}.")
+            sign, hours, minutes, seconds = match.groups()
+            offset = int(hours) * 3600 + int(minutes) * 60 + int(seconds or 0)
+            offset = self._offsets[suffix] = -offset if sign == "-" else offset
+        second, microsecond = divmod(micros, 1000000)
+        cache = self._time_cache
+        if cache is None or cache[0] != (second, offset):
+            text = (_EPOCH + datetime.timedelta(seconds=second + offset)).isoformat()
+            cache = self._time_cache = ((second, offset), text)
+        if microsecond:
+            return f"{cache[1]}.{microsecond:06d}{suffix}"
+        return cache[1] + suffix
+
+
+def decode(
+    stream: typing.BinaryIO, chunk_size: int = 1 << 16
+) -> typing.Iterator[bytes]:
+    """
+    Yield the JSON lines, without b"\\n", of a binary log stream written with BinaryFormatter.
+    :raises ValueError: If the stream is not a binary log stream or is truncated.
+    """
+    decoder = BinaryDecoder()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield from decoder.feed(chunk)
+    decoder.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Entry point of the traceid-decode command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="traceid-decode",
+        description="Convert binary log streams written with BinaryFormatter to JSON lines.",
+    )
+    parser.add_argument(
+        "files", nargs="*", default=["-"], help="Binary log files, - for stdin."
+    )
+    args = parser.parse_args(argv)
+    output = sys.stdout.buffer
+    for path in args.files:
+        stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+        try:
+            for line in decode(stream):
+                output.write(line + b"\n")
+        except ValueError as e:
+            output.flush()
+            print(f"traceid-decode: {path}: {e}", file=sys.stderr)
+            return 1
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+    output.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import asyncio
+import concurrent.futures
+import typing
+import uuid
+
+
+from traceid.traceid import TraceContext, TraceId
+
+_T = typing.TypeVar("_T")
+
+
+def dump_traceid(context: TraceContext | None) -> typing.Any:
+    """
+    Return a compact picklable form of a TraceContext: 16 raw bytes for a UUID, the string itself for a str,
+    and a tuple with the span fields when the context has a span.
+    """
+    if context is None:
+        return None
+    traceid = context.traceid
+    if type(traceid) is uuid.UUID:
+        traceid = traceid.bytes  # type: ignore
+    if context.span_id is None:
+        return traceid
+    return (traceid, context.span_id, context.parent_id, context.flags)
+
+
+def load_traceid(data: typing.Any) -> TraceContext | None:
+    """
+    Rebuild a TraceContext from the output of dump_traceid().
+    """
+    if data is None:
+        return None
+    if type(data) is tuple:
+        traceid, span_id, parent_id, flags = data
+    else:
+        traceid, span_id, parent_id, flags = data, None, None, 1
+    if type(traceid) is bytes:
+        traceid = uuid.UUID(bytes=traceid)
+    return TraceContext(traceid, span_id, parent_id, flags)
+
+
+class TracedCall(object):
+    """
+    A callable that runs fn with the trace ID that was current when it was created,
+    and restores the worker's previous trace ID afterwards.
+
+    Pickling a TracedCall sends the trace ID in its compact form, so it can be used with process pools.
+    """
+
+    __slots__ = ("context", "fn", "args", "kwargs")
+
+    def __init__(
+        self,
+        fn: typing.Callable[..., typing.Any],
+        args: tuple = (),
+        kwargs: dict[str, typing.Any] | None = None,
+        context: TraceContext | None = None,
+    ):
+        self.context = context
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs or {}
+
+    @classmethod
+    def capture(cls, fn: typing.Callable[..., typing.Any], *args, **kwargs):
+        """
+        Create a TracedCall bound to the trace ID of the current context.
+        """
+        return cls(fn, args, kwargs, TraceId.current())
+
+    def __call__(self) -> typing.Any:
+        token = TraceId.traceid_var.set(self.context)
+        try:
+            return self.fn(*self.args, **self.kwargs)
+        finally:
+            TraceId.traceid_var.reset(token)
+
+    def __reduce__(self):
+        return (
+            _load_traced_call,
+            (dump_traceid(self.context), self.fn, self.args, self.kwargs),
+        )
+
+
+def _load_traced_call(
+    data: typing.Any,
+    fn: typing.Callable[..., typing.Any],
+    args: tuple,
+    kwargs: dict[str, typing.Any],
+) -> TracedCall:
+    return TracedCall(fn, args, kwargs, load_traceid(data))
+
+
+def submit(
+    executor: concurrent.futures.Executor,
+    fn: typing.Callable[..., _T],
+    /,
+    *args,
+    **kwargs,
+) -> "concurrent.futures.Future[_T]":
+    """
+    Submit fn to any executor so that it runs with the current trace ID.
+    """
+    return executor.submit(TracedCall.capture(fn, *args, **kwargs))
+
+
+def run_in_executor(
+    executor: concurrent.futures.Executor | None,
+    fn: typing.Callable[..., _T],
+    /,
+    *args,
+    loop: asyncio.AbstractEventLoop | None = None,
+) -> "asyncio.Future[_T]":
+    """
+    Like loop.run_in_executor(), but fn runs with the current trace ID.
+    :param executor: Executor to run fn in, or None for the loop's default executor.
+    :param loop: Event loop. Defaults to the running loop.
+    """
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, TracedCall.capture(fn, *args))
+
+
+class TraceIdThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    A ThreadPoolExecutor whose tasks run with the trace ID of the submitting context.
+    map() goes through submit() and is covered too.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(TracedCall.capture(fn, *args, **kwargs))
+
+
+class TraceIdProcessPoolExecutor(concurrent.futures.ProcessPoolExecutor):
+    """
+    A ProcessPoolExecutor whose tasks run with the trace ID of the submitting context.
+    The trace ID is sent as 16 raw bytes for UUIDs and as the string otherwise.
+    map() submits its chunks through submit() and is covered too.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(TracedCall.capture(fn, *args, **kwargs))
@@ -0,0 +1,480 @@
+import argparse
+import contextlib
+import datetime
+import hashlib
+import heapq
+import mmap
+import os
+import re
+import struct
+import sys
+import typing
+import zlib
+
+# An index file is a sequence of runs appended by TraceIndex.update(). Each run covers the log bytes
+# [start, end) and holds a run header, its entries sorted by (trace ID digest, offset) and a sparse
+# time table with one block per `block_size` bytes of log. All integers are big-endian, so sorting
+# the packed entries as bytes sorts them by digest and offset.
+RUN_MAGIC = b"TIR1"
+# magic, start, end, length of the log head, crc32 of the log head, number of entries, number of blocks
+RUN_HEADER = struct.Struct(">4sQQHIQQ")
+# 8 byte digest of the trace ID, followed by the line offset and the timestamp in microseconds
+DIGEST_SIZE = 8
+ENTRY_TAIL = struct.Struct(">Qq")
+ENTRY_SIZE = DIGEST_SIZE + ENTRY_TAIL.size
+# offset, end, lowest timestamp, highest timestamp of a block of lines
+BLOCK = struct.Struct(">QQqq")
+# Timestamp of lines without a parsable time field
+NO_TIME = -(2**63)
+# Bytes of the log start that identify the file, to detect rotation or replacement
+HEAD_SIZE = 4096
+
+
+class Run(typing.NamedTuple):
+    start: int
+    end: int
+    head_length: int
+    head_crc: int
+    entries_offset: int
+    entries: int
+    blocks_offset: int
+    blocks: int
+
+
+def digest(traceid: bytes) -> bytes:
+    return hashlib.blake2b(traceid, digest_size=DIGEST_SIZE).digest()
+
+
+def _field_pattern(key: str) -> re.Pattern[bytes]:
+    # The first string value of the key in a JSON object written on one line.
+    return re.compile(
+        b'"' + re.escape(key.encode("utf-8")) + b'"\\s*:\\s*"([^"\\\\]*)"'
+    )
+
+
+def _parse_time(value: bytes) -> int:
+    try:
+        moment = datetime.datetime.fromisoformat(value.decode("ascii"))
+    except (UnicodeDecodeError, ValueError):
+        return NO_TIME
+    return _to_micros(moment)
+
+
+def _to_micros(moment: datetime.datetime) -> int:
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    delta = moment - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class TraceIndex(object):
+    """
+    A sidecar index of the trace IDs and timestamps of a JSON-lines log file, as written by JSONFormatter.
+
+    update() indexes the lines appended since the last update, reading the log through mmap and keeping
+    at most `run_size` entries in memory at a time. lines_for() returns all lines of a trace with a binary
+    search per run, time_range() only reads the blocks of the log whose timestamps overlap the range.
+    Lines after the last indexed newline are not visible until the next update().
+
+    The index is rebuilt from scratch when the log shrinks or its first bytes change, e.g. after rotation.
+
+    Usage:
+        index = TraceIndex("app.log")
+        index.update()
+        for line in index.lines_for("4bf92f3577b34da6a3ce929d0e0e4736"):
+            print(line.decode())
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index_path: str | None = None,
+        key: str = "trace_id",
+        time_key: str = "asctime",
+        run_size: int = 262144,
+        block_size: int = 1 << 20,
+    ):
+        """
+        :param path: The JSON-lines log file.
+        :param index_path: The index file. Defaults to path + ".tidx".
+        :param key: JSON key of the trace ID.
+        :param time_key: JSON key of the ISO 8601 timestamp. Lines without it are left out of time ranges.
+        :param run_size: Maximum number of entries held in memory while indexing.
+        :param block_size: Bytes of log per block of the time table.
+        """
+        if run_size < 1:
+            raise ValueError("run_size must be at least 1.")
+        self.path = path
+        self.index_path = path + ".tidx" if index_path is None else index_path
+        self.key = key
+        self.time_key = time_key
+        self.run_size = run_size
+        self.block_size = block_size
+        self._key_pattern = _field_pattern(key)
+        self._time_pattern = _field_pattern(time_key)
+
+    def runs(self) -> list[Run]:
+        """
+        Return the complete runs of the index file. A run cut short by a crash is ignored.
+        """
+        runs = []
+        with _open_mmap(self.index_path) as buffer:
+            position = 0
+            size = len(buffer)
+            while position + RUN_HEADER.size <= size:
+                magic, start, end, head_length, head_crc, entries, blocks = (
+                    RUN_HEADER.unpack_from(buffer, position)
+                )
+                entries_offset = position + RUN_HEADER.size
+                blocks_offset = entries_offset + entries * ENTRY_SIZE
+                run_end = blocks_offset + blocks * BLOCK.size
+                if magic != RUN_MAGIC or run_end > size:
+                    break
+                runs.append(
+                    Run(
+                        start,
+                        end,
+                        head_length,
+                        head_crc,
+                        entries_offset,
+                        entries,
+                        blocks_offset,
+                        blocks,
+                    )
+                )
+                position = run_end
+        return runs
+
+    def update(self) -> int:
+        """
+        Index the complete lines appended to the log since the last update.
+        Returns the number of lines indexed.
+        """
+        runs = self.runs()
+        indexed_size = _run_bytes(runs)
+        with open(self.path, "rb") as log:
+            size = os.fstat(log.fileno()).st_size
+            start = runs[-1].end if runs else 0
+            if runs and (start > size or not self._same_log(log, runs[-1])):
+                runs, indexed_size, start = [], 0, 0
+            if os.path.exists(self.index_path):
+                # Drop a run cut short by a crash, or the whole index of a replaced log.
+                with open(self.index_path, "r+b") as index:
+                    index.truncate(indexed_size)
+            if start >= size:
+                return 0
+            log.seek(0)
+            head = log.read(HEAD_SIZE)
+            head_length, head_crc = len(head), zlib.crc32(head)
+            with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return self._index(buffer, start, size, head_length, head_crc)
+
+    def _same_log(self, log: typing.BinaryIO, run: Run) -> bool:
+        log.seek(0)
+        head = log.read(run.head_length)
+        return len(head) == run.head_length and zlib.crc32(head) == run.head_crc
+
+    def _index(
+        self, buffer: mmap.mmap, start: int, size: int, head_length: int, head_crc: int
+    ) -> int:
+        key_search = self._key_pattern.search
+        time_search = self._time_pattern.search
+        pack_tail = ENTRY_TAIL.pack
+        entries: list[bytes] = []
+        blocks: list[bytes] = []
+        run_start = block_start = position = start
+        block_min, block_max = None, None
+        lines = 0
+        with open(self.index_path, "ab") as index:
+            while position < size:
+                end = buffer.find(b"\n", position, size)
+                if end < 0:
+                    # An incomplete last line is indexed once it is terminated.
+                    break
+                match = time_search(buffer, position, end)
+                timestamp = NO_TIME if match is None else _parse_time(match.group(1))
+                if timestamp != NO_TIME:
+                    if block_min is None or timestamp < block_min:
+                        block_min = timestamp
+                    if block_max is None or timestamp > block_max:
+                        block_max = timestamp
+                match = key_search(buffer, position, end)
+                if match is not None:
+                    entries.append(
+                        digest(match.group(1)) + pack_tail(position, timestamp)
+                    )
+                position = end + 1
+                lines += 1
+                if position - block_start >= self.block_size:
+                    blocks.append(
+                        _pack_block(block_start, position, block_min, block_max)
+                    )
+                    block_start, block_min, block_max = position, None, None
+                if len(entries) >= self.run_size:
+                    if block_start < position:
+                        blocks.append(
+                            _pack_block(block_start, position, block_min, block_max)
+                        )
+                        block_start, block_min, block_max = position, None, None
+                    _write_run(
+                        index,
+                        run_start,
+                        position,
+                        head_length,
+                        head_crc,
+                        entries,
+                        blocks,
+                    )
+                    run_start = position
+                    entries, blocks = [], []
+            if block_start < position:
+                blocks.append(_pack_block(block_start, position, block_min, block_max))
+            if run_start < position:
+                _write_run(
+                    index, run_start, position, head_length, head_crc, entries, blocks
+                )
+        return lines
+
+    def lines_for(
+        self,
+        traceid: str,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> typing.Iterator[bytes]:
+        """
+        Yield the indexed lines of a trace in file order, without their newline.
+        :param start: Only lines logged at or after this time.
+        :param end: Only lines logged before this time.
+        """
+        target = traceid.encode("utf-8")
+        key = digest(target)
+        low, high = _time_bounds(start, end)
+        key_search = self._key_pattern.search
+        with _open_mmap(self.index_path) as index, _open_mmap(self.path) as log:
+            for run in self.runs():
+                position = _lower_bound(index, run, key)
+                stop = run.entries_offset + run.entries * ENTRY_SIZE
+                while (
+                    position < stop and index[position : position + DIGEST_SIZE] == key
+                ):
+                    offset, timestamp = ENTRY_TAIL.unpack_from(
+                        index, position + DIGEST_SIZE
+                    )
+                    position += ENTRY_SIZE
+                    if not low <= timestamp < high:
+                        continue
+                    line_end = log.find(b"\n", offset)
+                    match = key_search(log, offset, line_end)
+                    # Digests may collide, the trace ID of the line is checked.
+                    if match is not None and match.group(1) == target:
+                        yield log[offset:line_end]
+
+    def time_range(
+        self,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> typing.Iterator[bytes]:
+        """
+        Yield the indexed lines logged in [start, end) in file order, without their newline.
+        Only the blocks of the log whose time span overlaps the range are read.
+        """
+        low, high = _time_bounds(start, end)
+        time_search = self._time_pattern.search
+        with _open_mmap(self.index_path) as index, _open_mmap(self.path) as log:
+            for run in self.runs():
+                for i in range(run.blocks):
+                    offset, block_end, block_min, block_max = BLOCK.unpack_from(
+                        index, run.blocks_offset + i * BLOCK.size
+                    )
+                    if block_min == NO_TIME or block_max < low or block_min >= high:
+                        continue
+                    while offset < block_end:
+                        line_end = log.find(b"\n", offset, block_end)
+                        match = time_search(log, offset, line_end)
+                        if (
+                            match is not None
+                            and low <= _parse_time(match.group(1)) < high
+                        ):
+                            yield log[offset:line_end]
+                        offset = line_end + 1
+
+    def compact(self) -> None:
+        """
+        Merge all runs into a single one. The entries are merged as sorted streams, in bounded memory.
+        """
+        runs = self.runs()
+        if len(runs) < 2:
+            return
+        temporary = self.index_path + ".tmp"
+        with _open_mmap(self.index_path) as index, open(temporary, "wb") as output:
+            entries = sum(run.entries for run in runs)
+            blocks = sum(run.blocks for run in runs)
+            output.write(
+                RUN_HEADER.pack(
+                    RUN_MAGIC,
+                    runs[0].start,
+                    runs[-1].end,
+                    runs[-1].head_length,
+                    runs[-1].head_crc,
+                    entries,
+                    blocks,
+                )
+            )
+            streams = [_iter_entries(index, run) for run in runs]
+            for entry in heapq.merge(*streams):
+                output.write(entry)
+            for run in runs:
+                output.write(
+                    index[
+                        run.blocks_offset : run.blocks_offset + run.blocks * BLOCK.size
+                    ]
+                )
+        os.replace(temporary, self.index_path)
+
+
+def _pack_block(start: int, end: int, low: int | None, high: int | None) -> bytes:
+    if low is None or high is None:
+        return BLOCK.pack(start, end, NO_TIME, NO_TIME)
+    return BLOCK.pack(start, end, low, high)
+
+
+def _write_run(
+    index: typing.BinaryIO,
+    start: int,
+    end: int,
+    head_length: int,
+    head_crc: int,
+    entries: list[bytes],
+    blocks: list[bytes],
+) -> None:
+    entries.sort()
+    index.write(
+        RUN_HEADER.pack(
+            RUN_MAGIC, start, end, head_length, head_crc, len(entries), len(blocks)
+        )
+    )
+    index.write(b"".join(entries))
+    index.write(b"".join(blocks))
+    index.flush()
+
+
+def _run_bytes(runs: list[Run]) -> int:
+    if not runs:
+        return 0
+    last = runs[-1]
+    return last.blocks_offset + last.blocks * BLOCK.size
+
+
+def _lower_bound(index: mmap.mmap, run: Run, key: bytes) -> int:
+    low, high = 0, run.entries
+    base = run.entries_offset
+    while low < high:
+        middle = (low + high) // 2
+        position = base + middle * ENTRY_SIZE
+        if index[position : position + DIGEST_SIZE] < key:
+            low = middle + 1
+        else:
+            high = middle
+    return base + low * ENTRY_SIZE
+
+
+def _iter_entries(index: mmap.mmap, run: Run) -> typing.Iterator[bytes]:
+    for position in range(
+        run.entries_offset, run.entries_offset + run.entries * ENTRY_SIZE, ENTRY_SIZE
+    ):
+        yield index[position : position + ENTRY_SIZE]
+
+
+def _time_bounds(
+    start: datetime.datetime | None, end: datetime.datetime | None
+) -> tuple[int, int]:
+    # Lines without a timestamp only match when there are no bounds at all.
+    if start is None and end is None:
+        return NO_TIME, 2**63 - 1
+    low = NO_TIME + 1 if start is None else _to_micros(start)
+    high = 2**63 - 1 if end is None else _to_micros(end)
+    return low, high
+
+
+@contextlib.contextmanager
+def _open_mmap(path: str) -> typing.Iterator[typing.Any]:
+    """
+    Open a read-only mmap of a file. Missing and empty files give an empty buffer.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        yield b""
+        return
+    with f:
+        if not os.fstat(f.fileno()).st_size:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Entry point of the traceid-grep command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="traceid-grep",
+        description="Print the lines of a trace or a time range from JSON-lines log files, using a sidecar index.",
+    )
+    parser.add_argument("files", nargs="+", help="JSON-lines log files.")
+    parser.add_argument("-t", "--trace", help="Trace ID to print.")
+    parser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        help="ISO 8601 start time, inclusive.",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.datetime.fromisoformat,
+        help="ISO 8601 end time, exclusive.",
+    )
+    parser.add_argument("--key", default="trace_id", help="JSON key of the trace ID.")
+    parser.add_argument(
+        "--time-key", default="asctime", help="JSON key of the timestamp."
+    )
+    parser.add_argument(
+        "--no-update",
+        action="store_true",
+        help="Query the index without indexing new lines.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Merge the runs of the index after updating it.",
+    )
+    args = parser.parse_args(argv)
+    if (
+        args.trace is None
+        and args.since is None
+        and args.until is None
+        and not args.compact
+    ):
+        parser.error("one of --trace, --since, --until or --compact is required")
+
+    output = sys.stdout.buffer
+    for path in args.files:
+        index = TraceIndex(path, key=args.key, time_key=args.time_key)
+        if not args.no_update:
+            index.update()
+        if args.compact:
+            index.compact()
+        if args.trace is not None:
+            lines = index.lines_for(args.trace, args.since, args.until)
+        elif args.since is not None or args.until is not None:
+            lines = index.time_range(args.since, args.until)
+        else:
+            continue
+        for line in lines:
+            output.write(line + b"\n")
+    output.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
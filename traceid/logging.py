@@ -1,47 +1,233 @@
 import datetime
+import io
 import json
 import logging
+import math
+import operator
+import os
+import queue
+import sys
+import threading
+import time
 import typing
-import uuid
+import weakref
+import zlib
 
 
+from traceid import metrics, registry, tasks
+from traceid.serializers import JSONBackend, get_backend
 from traceid.traceid import TraceId
 
 
 class TraceIdFilter(logging.Filter):
+    """
+    Adds trace_id, span_id and parent_span_id of the current context to every record.
+
+    The capture is a single ContextVar lookup, and the record only holds plain strings,
+    so it can still be pickled by SocketHandler, DatagramHandler or a multiprocessing QueueHandler.
+    """
+
     def filter(self, record: logging.LogRecord) -> bool:
-        if TraceId.is_set():
-            record.trace_id = TraceId.get()
-        else:
-            record.trace_id = None
+        _capture_trace(record)
         return True
 
 
-RESERVED: typing.Tuple[str, ...] = (
-    "args",
-    "asctime",
-    "created",
-    "exc_info",
-    "exc_text",
-    "filename",
-    "funcName",
-    "levelname",
-    "levelno",
-    "lineno",
-    "module",
-    "msecs",
-    "message",
-    "msg",
-    "name",
-    "pathname",
-    "process",
-    "processName",
-    "relativeCreated",
-    "stack_info",
-    "thread",
-    "threadName",
+class SamplingFilter(logging.Filter):
+    """
+    Trace-aware log sampling.
+
+    Whether a trace is kept is decided once per trace ID from a deterministic hash (CRC32) of the ID,
+    so every process keeps or drops the same traces and a kept trace is logged in full. The decision
+    and the per-trace line count are cached in the trace context, later records of the trace cost a
+    single ContextVar lookup and a dict lookup.
+
+    Records at or above always_level (WARNING by default) are always kept.
+    Records without a trace ID are only subject to the global rate limit.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        max_lines_per_trace: int | None = None,
+        rate_limit: float | None = None,
+        burst: float | None = None,
+        always_level: int = logging.WARNING,
+        name: str = "",
+    ):
+        """
+        :param rate: Fraction of traces to keep, from 0.0 to 1.0.
+        :param max_lines_per_trace: Maximum number of records kept per trace, below always_level.
+        :param rate_limit: Maximum number of records per second across all traces, below always_level.
+        :param burst: Token bucket size of the rate limit, at least 1. Defaults to rate_limit, or 1 below 1/s.
+        :param always_level: Records at or above this level are always kept.
+        """
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError("rate must be between 0.0 and 1.0.")
+        if burst is None and rate_limit is not None:
+            # A record takes a whole token, the bucket must be able to hold one.
+            burst = max(1.0, rate_limit)
+        if burst is not None and burst < 1:
+            raise ValueError("burst must be at least 1.")
+        super().__init__(name)
+        self.rate = rate
+        self.threshold = int(rate * 2**32)
+        self.max_lines_per_trace = max_lines_per_trace
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.always_level = always_level
+        self._tokens = self.burst or 0.0
+        self._last_refill = time.monotonic()
+        self._bucket_lock = threading.Lock()
+
+    def keep_trace(self, traceid: str) -> bool:
+        """
+        Return True if the trace with this (string) trace ID is sampled.
+        """
+        return zlib.crc32(traceid.encode("utf-8")) < self.threshold
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.always_level:
+            return True
+        context = TraceId.current()
+        if context is not None:
+            # [keep, remaining lines] of the trace for this filter
+            decision = context.state.get(self)
+            if decision is None:
+                decision = context.state[self] = [
+                    self.keep_trace(context.text),
+                    self.max_lines_per_trace,
+                ]
+            if not decision[0]:
+                return False
+            if decision[1] is not None:
+                if decision[1] <= 0:
+                    return False
+                decision[1] -= 1
+        if self.rate_limit is not None:
+            return self._take_token()
+        return True
+
+    def _take_token(self) -> bool:
+        with self._bucket_lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last_refill) * self.rate_limit  # type: ignore
+            )
+            self._last_refill = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+def _capture_trace(record: logging.LogRecord) -> None:
+    # One ContextVar lookup. The context itself is not kept on the record: its state dict is
+    # process-local and may hold locks, which would make the record unpicklable.
+    context = TraceId.current()
+    if context is None:
+        record.trace_id = record.span_id = record.parent_span_id = None
+    else:
+        record.trace_id = context.text
+        record.span_id = context.span_id
+        record.parent_span_id = context.parent_id
+    if tasks._timing_used:
+        _capture_task_times(record)
+
+
+def _capture_task_times(record: logging.LogRecord) -> None:
+    times = tasks.current_task_times()
+    if times is None:
+        record.task_wall_ms = record.task_cpu_ms = None
+    else:
+        record.task_wall_ms, record.task_cpu_ms = times
+
+
+# Attribute of an exception holding (id of the traceback, formatted text) of its last formatting.
+_EXC_TEXT_CACHE = "_traceid_exc_text"
+
+
+# Attributes of every LogRecord, taken from a record of the running Python version (e.g. taskName since 3.12),
+# plus the attributes set by logging.Formatter.
+LOGRECORD_ATTRIBUTES: typing.FrozenSet[str] = frozenset(
+    logging.LogRecord("", logging.NOTSET, "", 0, "", (), None).__dict__
+) | {"message", "asctime"}
+
+# Record attributes known to JSONFormatter: the LogRecord attributes and the ones set by traceid.
+RESERVED: typing.FrozenSet[str] = LOGRECORD_ATTRIBUTES | {
     "trace_id",
-)
+    "span_id",
+    "parent_span_id",
+    "task_wall_ms",
+    "task_cpu_ms",
+    "_traceid_captured",
+}
+
+
+def compile_extractor(
+    keys: typing.Sequence[str],
+) -> typing.Callable[[logging.LogRecord], dict[str, typing.Any]]:
+    """
+    Compile the keys of a JSONFormatter into a function that extracts them from a record.
+    All attributes are fetched by a single operator.attrgetter call, so formatting a record
+    does no per-key membership test.
+    """
+    keys = tuple(keys)
+    for key in keys:
+        if not isinstance(key, str):
+            raise TypeError(f"JSONFormatter keys must be strings, got {key!r}.")
+    if not keys:
+        return lambda record: {}
+    if not all(key.isidentifier() for key in keys):
+        # attrgetter treats dots as nested lookups, so keys such as "user.id" added
+        # through setattr() are fetched one by one.
+        def extract_each(record: logging.LogRecord) -> dict[str, typing.Any]:
+            data = {}
+            for key in keys:
+                try:
+                    data[key] = getattr(record, key)
+                except AttributeError:
+                    raise AttributeError(
+                        f"Attribute {key} not found in log record."
+                    ) from None
+            return data
+
+        return extract_each
+
+    getter = operator.attrgetter(*keys)
+    if len(keys) == 1:
+        key = keys[0]
+
+        def extract_one(record: logging.LogRecord) -> dict[str, typing.Any]:
+            try:
+                return {key: getter(record)}
+            except AttributeError:
+                raise AttributeError(
+                    f"Attribute {key} not found in log record."
+                ) from None
+
+        return extract_one
+
+    def extract(record: logging.LogRecord) -> dict[str, typing.Any]:
+        try:
+            return dict(zip(keys, getter(record)))
+        except AttributeError:
+            missing = next(key for key in keys if not hasattr(record, key))
+            raise AttributeError(
+                f"Attribute {missing} not found in log record."
+            ) from None
+
+    return extract
+
+
+class JSONFragment(str):
+    """
+    A pre-serialized JSON value. JSONFormatter splices it verbatim into the output instead of
+    serializing it as a string, e.g. a request context dict serialized once and logged with every record:
+        context = JSONFragment(json.dumps({"user": {"id": 42, "roles": ["admin"]}}))
+        logger.info("hello", extra={"context": context})
+    """
+
+    __slots__ = ()
 
 
 class JSONFormatter(logging.Formatter):
@@ -53,6 +239,18 @@ class JSONFormatter(logging.Formatter):
     and the following format:
         {"asctime": "2021-01-01T00:00:00.000000+00:00", "levelname": "INFO", "name": "myapp", "module": "myapp", "lineno": 42, "trace_id": "12345678-1234-1234-1234-123456789012", "exc_text": null, "message": "Hello World!"}
     The JSON output can be customized by passing a list of keys to the constructor.
+
+    Only the fields in keys are computed: the message, the exception text, the stack and the trace fields
+    are skipped when they are not part of the output. The exception text is cached on the exception object,
+    so an exception formatted by several handlers or records is only formatted once.
+
+    Constant fields such as the service name or version can be passed as static_fields. They are serialized
+    once into a template, and each record only serializes its own keys and is spliced into it. Extra keys
+    holding a JSONFragment are spliced in the same way. Static fields come first, then the keys, then the
+    keys holding fragments.
+
+    The keys span_id and parent_span_id output the span of the current TraceContext, and the keys
+    task_wall_ms and task_cpu_ms the timing of the current task when tasks are timed by a TraceTaskFactory.
     """
 
     def __init__(
@@ -73,6 +271,9 @@ class JSONFormatter(logging.Formatter):
         json_indent: int | None = None,
         json_separators: tuple[str, str] | None = None,
         json_default: typing.Callable[[typing.Any], typing.Any] | None = None,
+        json_backend: str = "json",
+        static_fields: typing.Mapping[str, typing.Any] | None = None,
+        capture_extras: bool = False,
     ):
         """
         :param keys: List of keys to include in the JSON output.
@@ -82,64 +283,654 @@ class JSONFormatter(logging.Formatter):
         :param json_indent: If a non-negative integer, then JSON array elements and object members will be pretty-printed
         :param json_separators: If specified, then it should be an (item_separator, key_separator) tuple.
         :param json_default: If specified, then it should be a function that gets called for objects that can’t otherwise be serialized.
+        :param json_backend: JSON serializer: "json" (default), "orjson", "msgspec" or "auto" to pick the fastest installed one.
+            orjson and msgspec write compact JSON and raise ValueError for json_* options they cannot honour.
+        :param static_fields: Constant fields added to every record, serialized once. Must not overlap keys.
+        :param capture_extras: If True, every attribute added to a record through `extra=` is output after keys,
+            without listing it in keys.
         """
+        self._static_fields: dict[str, typing.Any] = dict(static_fields or {})
+        self._capture_extras = capture_extras
         self.keys = keys
         self.datetimefmt = datetimefmt
         self.tzinfo = tzinfo
+        # (second, tzinfo, datetimefmt, prefix, suffix) of the last formatted timestamp
+        self._time_cache: tuple | None = None
+
+        self._json_backend_name = json_backend
+        self._json_options: dict[str, typing.Any] = dict(
+            ensure_ascii=json_ensure_ascii,
+            indent=json_indent,
+            separators=json_separators,
+            default=json_default,
+        )
+        self._build_json_backend()
+
+    def _build_json_backend(self) -> None:
+        backend = get_backend(self._json_backend_name, **self._json_options)
+        self._build_template(backend)
+        self._json_backend = backend
+
+    def _build_template(self, backend: JSONBackend) -> None:
+        """
+        Choose the serializers of format() and format_bytes(). Without static fields and extra keys
+        they are the backend's own, otherwise the static fields are serialized once for _splice().
+        """
+        # Attributes that are never captured as extras
+        self._not_extra = (
+            RESERVED | frozenset(self._keys) | frozenset(self._static_fields)
+        )
+        if (
+            not self._static_fields
+            and not self._extra_keys
+            and not self._capture_extras
+        ):
+            self._template = None
+            self._serialize, self._serialize_bytes = backend.dumps, backend.dumpb
+            return
+        if self._json_options["indent"] is not None:
+            # Pretty-printed output cannot be spliced, the fields are merged before serializing.
+            self._template = None
+            self._serialize = lambda data: backend.dumps(self._merge(data))
+            self._serialize_bytes = lambda data: backend.dumpb(self._merge(data))
+            return
+        # Read the separators of the backend from a sample object.
+        sample = backend.dumps({"a": 0, "b": 0})
+        item_separator = sample[sample.index("0") + 1 : sample.index('"b"')]
+        key_separator = sample[sample.index('"a"') + 3 : sample.index("0")]
+        prefix = backend.dumps(self._static_fields)[1:-1]
+        # (static fields, item separator, key separator, dumps, fragment conversion, braces) for str and bytes
+        self._template = (
+            (prefix, item_separator, key_separator, backend.dumps, str, "{", "}"),
+            (
+                prefix.encode("utf-8"),
+                item_separator.encode("utf-8"),
+                key_separator.encode("utf-8"),
+                backend.dumpb,
+                _encode_utf8,
+                b"{",
+                b"}",
+            ),
+        )
+        self._serialize = lambda data: self._splice(data, self._template[0])  # type: ignore
+        self._serialize_bytes = lambda data: self._splice(data, self._template[1])  # type: ignore
+
+    def _splice(self, data: dict[str, typing.Any], template: tuple) -> typing.Any:
+        (
+            prefix,
+            item_separator,
+            key_separator,
+            dumps,
+            convert,
+            open_brace,
+            close_brace,
+        ) = template
+        fragments = None
+        for key in list(data) if self._capture_extras else self._extra_keys:
+            if type(data[key]) is JSONFragment:
+                if fragments is None:
+                    fragments = []
+                fragments.append((key, data.pop(key)))
+        parts = [prefix] if prefix else []
+        if data:
+            parts.append(dumps(data)[1:-1])
+        if fragments is not None:
+            for key, fragment in fragments:
+                parts.append(dumps(key) + key_separator + convert(fragment))
+        return open_brace + item_separator.join(parts) + close_brace
+
+    def _merge(self, data: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        merged = dict(self._static_fields)
+        for key, value in data.items():
+            merged[key] = json.loads(value) if type(value) is JSONFragment else value
+        return merged
+
+    @property
+    def capture_extras(self) -> bool:
+        """
+        Whether the attributes added to a record through `extra=` are output after keys.
+        """
+        return self._capture_extras
+
+    @capture_extras.setter
+    def capture_extras(self, capture_extras: bool) -> None:
+        self._capture_extras = capture_extras
+        self._build_template(self._json_backend)
+
+    @property
+    def static_fields(self) -> typing.Mapping[str, typing.Any]:
+        """
+        Constant fields added to every record. Assigning new fields re-serializes the template.
+        """
+        return self._static_fields
+
+    @static_fields.setter
+    def static_fields(self, static_fields: typing.Mapping[str, typing.Any]) -> None:
+        static_fields = dict(static_fields)
+        _check_static_fields(self._keys, static_fields)
+        old_fields = self._static_fields
+        self._static_fields = static_fields
+        try:
+            self._build_template(self._json_backend)
+        except Exception:
+            self._static_fields = old_fields
+            raise
+
+    def _set_json_option(self, name: str, value: typing.Any) -> None:
+        old_value = self._json_options[name]
+        self._json_options[name] = value
+        try:
+            self._build_json_backend()
+        except Exception:
+            self._json_options[name] = old_value
+            raise
+
+    @property
+    def json_backend(self) -> JSONBackend:
+        """
+        The JSON backend built from the json_* options. Assigning one of the options rebuilds it.
+        """
+        return self._json_backend
+
+    @property
+    def json_ensure_ascii(self) -> bool:
+        return self._json_options["ensure_ascii"]
+
+    @json_ensure_ascii.setter
+    def json_ensure_ascii(self, value: bool) -> None:
+        self._set_json_option("ensure_ascii", value)
+
+    @property
+    def json_indent(self) -> int | None:
+        return self._json_options["indent"]
+
+    @json_indent.setter
+    def json_indent(self, value: int | None) -> None:
+        self._set_json_option("indent", value)
+
+    @property
+    def json_separators(self) -> tuple[str, str] | None:
+        return self._json_options["separators"]
+
+    @json_separators.setter
+    def json_separators(self, value: tuple[str, str] | None) -> None:
+        self._set_json_option("separators", value)
+
+    @property
+    def json_default(self) -> typing.Callable[[typing.Any], typing.Any] | None:
+        return self._json_options["default"]
+
+    @json_default.setter
+    def json_default(
+        self, value: typing.Callable[[typing.Any], typing.Any] | None
+    ) -> None:
+        self._set_json_option("default", value)
+
+    @property
+    def keys(self) -> typing.Sequence[str]:
+        """
+        Keys included in the JSON output. Assigning new keys recompiles the extraction plan.
+        """
+        return self._keys
 
-        self.json_ensure_ascii = json_ensure_ascii
-        self.json_indent = json_indent
-        self.json_separators = json_separators
-        self.json_default = json_default
+    @keys.setter
+    def keys(self, keys: typing.Sequence[str]) -> None:
+        _check_static_fields(keys, self._static_fields)
+        self._extract = compile_extractor(keys)
+        self._uses_time = "asctime" in keys
+        self._uses_message = "message" in keys
+        self._uses_exc_text = "exc_text" in keys
+        self._uses_stack = "stack_info" in keys
+        self._uses_span = "span_id" in keys or "parent_span_id" in keys
+        self._uses_trace = "trace_id" in keys or self._uses_span
+        self._uses_task = "task_wall_ms" in keys or "task_cpu_ms" in keys
+        # Keys that are not LogRecord attributes may hold a JSONFragment.
+        self._extra_keys = tuple(key for key in keys if key not in RESERVED)
+        self._keys = keys
+        if hasattr(self, "_json_backend"):
+            self._build_template(self._json_backend)
 
     def usesTime(self) -> bool:
-        return "asctime" in self.keys
+        return self._uses_time
 
     def format_time(self, record: logging.LogRecord) -> str:
         """
         Return the creation time of the specified LogRecord as formatted text.
+
+        The text of the whole second is cached, so records created within the same second
+        only format their sub-second part. The result is identical to formatting
+        datetime.datetime.fromtimestamp(record.created) directly.
         """
+        datetimefmt = self.datetimefmt
+        if datetimefmt and "%f" in datetimefmt:
+            return self._format_datetime(record.created)
+
+        # Split the timestamp the same way datetime.fromtimestamp() does (round half to even).
+        fraction, whole = math.modf(record.created)
+        microsecond = round(fraction * 1e6)
+        if microsecond >= 1000000:
+            whole += 1
+            microsecond -= 1000000
+        elif microsecond < 0:
+            whole -= 1
+            microsecond += 1000000
+        second = int(whole)
+
+        cache = self._time_cache
+        if (
+            cache is None
+            or cache[0] != second
+            or cache[1] is not self.tzinfo
+            or cache[2] is not datetimefmt
+        ):
+            text = self._format_datetime(second)
+            if datetimefmt:
+                cache = (second, self.tzinfo, datetimefmt, text, None)
+            else:
+                # isoformat() is "YYYY-MM-DDTHH:MM:SS" followed by the optional ".ffffff" and the utc offset.
+                cache = (second, self.tzinfo, datetimefmt, text[:19], text[19:])
+            self._time_cache = cache
+
+        if cache[4] is None:
+            return cache[3]
+        if microsecond:
+            return f"{cache[3]}.{microsecond:06d}{cache[4]}"
+        return cache[3] + cache[4]
+
+    def _format_datetime(self, timestamp: float) -> str:
         if self.tzinfo is None:
-            asctime = datetime.datetime.fromtimestamp(record.created).astimezone()
+            asctime = datetime.datetime.fromtimestamp(timestamp).astimezone()
         else:
-            asctime = datetime.datetime.fromtimestamp(record.created, self.tzinfo)
+            asctime = datetime.datetime.fromtimestamp(timestamp, self.tzinfo)
         if self.datetimefmt:
             return asctime.strftime(self.datetimefmt)
         else:
             return asctime.isoformat()
 
+    def format_exception(self, exc_info) -> str:
+        """
+        Return formatException(exc_info), cached on the exception object.
+
+        The cache is keyed by the traceback, so an exception logged again after it propagated
+        to an outer frame is formatted with its longer traceback. Subclasses overriding
+        formatException() are not cached.
+        """
+        exc = exc_info[1]
+        tb = exc_info[2]
+        if (
+            exc is None
+            or type(self).formatException is not logging.Formatter.formatException
+        ):
+            return self.formatException(exc_info)
+        cached = exc.__dict__.get(_EXC_TEXT_CACHE)
+        if cached is not None and cached[0] == id(tb):
+            return cached[1]
+        text = self.formatException(exc_info)
+        # The traceback stays reachable from exc.__traceback__, so its id is not reused while exc lives.
+        setattr(exc, _EXC_TEXT_CACHE, (id(tb), text))
+        return text
+
     def formatTraceId(self) -> str | None:
-        if TraceId.is_set():
-            if isinstance(TraceId.get(), uuid.UUID):
-                return str(TraceId.get())
-            return TraceId.get()  # type: ignore
-        else:
-            return None
+        return TraceId.peek_text()
 
     def format(self, record: logging.LogRecord) -> str:
         """
         Format a record as a JSON string.
         """
-        record.trace_id = self.formatTraceId()
-        record.message = record.getMessage()
-        if self.usesTime():
+        if metrics.collector is None:
+            text = self._serialize(self.format_dict(record))
+        else:
+            text = metrics.collector.format(self._serialize, self.format_dict, record)
+        if registry.active is not None:
+            _count_record(
+                record, len(text) if text.isascii() else len(text.encode("utf-8"))
+            )
+        return text
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """
+        Format a record as UTF-8 encoded JSON bytes, without an intermediate str when the backend supports it.
+        """
+        if metrics.collector is None:
+            data = self._serialize_bytes(self.format_dict(record))
+        else:
+            data = metrics.collector.format(
+                self._serialize_bytes, self.format_dict, record
+            )
+        if registry.active is not None:
+            _count_record(record, len(data))
+        return data
+
+    def format_dict(self, record: logging.LogRecord) -> dict[str, typing.Any]:
+        """
+        Prepare a record and return the dict of configured keys that is serialized to JSON.
+        The static fields are not part of it.
+        """
+        # QueueJSONHandler captures the trace fields in the logging context,
+        # every other record is read from the current context.
+        if self._uses_trace and not getattr(record, "_traceid_captured", False):
+            record.trace_id = self.formatTraceId()
+            if self._uses_span:
+                context = TraceId.current()
+                record.span_id = None if context is None else context.span_id
+                record.parent_span_id = None if context is None else context.parent_id
+        if self._uses_task and not (
+            # Captured records carry the timing of the task that logged them.
+            getattr(record, "_traceid_captured", False)
+            and hasattr(record, "task_wall_ms")
+        ):
+            _capture_task_times(record)
+        if self._uses_message:
+            record.message = record.getMessage()
+        if self._uses_time:
             record.asctime = self.format_time(record)
-        if record.exc_info and not record.exc_text:
-            record.exc_text = self.formatException(record.exc_info)
-        if record.stack_info:
+        if self._uses_exc_text and record.exc_info and not record.exc_text:
+            record.exc_text = self.format_exception(record.exc_info)
+        if self._uses_stack and record.stack_info:
             record.stack_info = self.formatStack(record.stack_info)
 
-        data = {}
-        for key in self.keys:
-            if key in RESERVED or hasattr(record, key):
-                data[key] = getattr(record, key)
-            else:  # pragma: no cover
-                raise AttributeError(f"Attribute {key} not found in log record.")
-
-        return json.dumps(
-            data,
-            ensure_ascii=self.json_ensure_ascii,
-            indent=self.json_indent,
-            separators=self.json_separators,
-            default=self.json_default,
+        data = self._extract(record)
+        if self._capture_extras:
+            attributes = record.__dict__
+            # A set difference in C, usually empty. The record's order is kept for the extras.
+            extras = attributes.keys() - self._not_extra
+            if extras:
+                for key in attributes:
+                    if key in extras:
+                        data[key] = attributes[key]
+        return data
+
+
+def _count_record(record: logging.LogRecord, size: int) -> None:
+    """
+    Count a formatted record in the active trace registry, under the trace it was captured in
+    or, like format_dict(), the trace of the current context.
+    """
+    active = registry.active
+    if active is None:
+        return
+    if getattr(record, "_traceid_captured", False):
+        traceid = record.trace_id
+    else:
+        traceid = TraceId.peek_text()
+    active.count(traceid, record.levelno, size)
+
+
+def _encode_utf8(text: str) -> bytes:
+    return text.encode("utf-8")
+
+
+def _check_static_fields(
+    keys: typing.Sequence[str], static_fields: typing.Mapping[str, typing.Any]
+) -> None:
+    overlap = [key for key in keys if key in static_fields]
+    if overlap:
+        raise ValueError(
+            f"JSONFormatter static fields must not overlap keys: {', '.join(overlap)}."
         )
+
+
+def _format_bytes(handler: logging.Handler, record: logging.LogRecord) -> bytes:
+    """
+    Format a record with the formatter of a handler as UTF-8 bytes.
+    Formatters with a format_bytes() method, such as JSONFormatter, encode directly to bytes.
+    """
+    formatter = handler.formatter or logging._defaultFormatter  # type: ignore
+    format_record_bytes = getattr(formatter, "format_bytes", None)
+    if format_record_bytes is not None:
+        return format_record_bytes(record)
+    return formatter.format(record).encode("utf-8")
+
+
+class BinaryStreamHandler(logging.StreamHandler):
+    """
+    A StreamHandler that writes UTF-8 bytes to a binary stream, such as sys.stdout.buffer or a file opened in "ab" mode.
+    Together with JSONFormatter.format_bytes() it skips the str round trip of a text stream.
+    """
+
+    terminator = b"\n"  # type: ignore
+
+    def __init__(self, stream: typing.BinaryIO | None = None):
+        """
+        :param stream: Binary stream to write to. Defaults to sys.stdout.buffer.
+        """
+        if stream is None:
+            stream = sys.stdout.buffer
+        super().__init__(stream)  # type: ignore
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = _format_bytes(self, record) + self.terminator
+            if metrics.collector is None:
+                self.stream.write(data)
+            else:
+                metrics.collector.write(self.stream.write, data)
+            self.flush()
+        except RecursionError:  # pragma: no cover
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class QueueJSONHandler(logging.Handler):
+    """
+    A non-blocking handler that formats and writes records on a background thread.
+
+    emit() only captures the trace ID of the calling context and puts the record on a bounded queue.
+    The worker thread drains the queue, formats the records with the handler's formatter and writes
+    each batch with a single write() call. Message arguments are formatted on the worker thread,
+    so they should not be mutated after the log call.
+
+    Overflow policies, applied when the queue is full:
+        drop: discard the record.
+        block: wait until the worker makes room.
+        sample: keep one of every `sample_rate` overflowing records (waiting for room) and discard the rest.
+
+    Records emitted after close() are dropped. A forked child starts its own worker thread.
+    """
+
+    OVERFLOW_POLICIES = ("drop", "block", "sample")
+
+    def __init__(
+        self,
+        stream: typing.BinaryIO | typing.TextIO | None = None,
+        maxsize: int = 10000,
+        overflow: str = "drop",
+        sample_rate: int = 10,
+        batch_size: int = 1000,
+        level: int = logging.NOTSET,
+    ):
+        """
+        :param stream: Stream to write to. Binary streams receive bytes, text streams str. Defaults to sys.stdout.buffer.
+        :param maxsize: Maximum number of records waiting in the queue.
+        :param overflow: What to do when the queue is full: "drop", "block" or "sample".
+        :param sample_rate: With overflow="sample", keep one of every sample_rate overflowing records.
+        :param batch_size: Maximum number of records written by a single write() call.
+        :param level: Handler level.
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow!r}. Available policies: {', '.join(self.OVERFLOW_POLICIES)}."
+            )
+        if sample_rate < 1:
+            raise ValueError("sample_rate must be at least 1.")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        super().__init__(level)
+        if stream is None:
+            stream = sys.stdout.buffer
+        self.stream = stream
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.closed = False
+        self._overflowed = 0
+        self._text = isinstance(stream, io.TextIOBase)
+        self._start()
+        _queue_handlers.add(self)
+
+    def _start(self) -> None:
+        self._counter_lock = threading.Lock()
+        self._queue: queue.Queue[logging.LogRecord | None] = queue.Queue(self.maxsize)
+        self._thread = threading.Thread(
+            target=self._run, name="traceid-QueueJSONHandler", daemon=True
+        )
+        self._thread.start()
+
+    def _after_fork_in_child(self) -> None:
+        # The worker thread does not survive fork() and the queue may be in an inconsistent state.
+        # Records queued before the fork belong to the parent and are written there.
+        if not self.closed:
+            self._start()
+
+    @property
+    def queued(self) -> int:
+        """
+        Number of records waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the counters of the handler.
+        Every enqueued record ends up either written or failed (formatting or writing raised).
+        """
+        return {
+            "queued": self.queued,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.closed:
+            self._count_dropped()
+            return
+        _capture_trace(record)
+        record._traceid_captured = True
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if not self._overflow(record):
+                self._count_dropped()
+                return
+        with self._counter_lock:
+            self.enqueued += 1
+
+    def _count_dropped(self) -> None:
+        with self._counter_lock:
+            self.dropped += 1
+
+    def _overflow(self, record: logging.LogRecord) -> bool:
+        if self.overflow == "drop":
+            return False
+        if self.overflow == "sample":
+            with self._counter_lock:
+                self._overflowed += 1
+                if self._overflowed % self.sample_rate:
+                    return False
+        # Wait for room, but give up once the handler is closed.
+        while not self.closed:
+            try:
+                self._queue.put(record, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        get = self._queue.get
+        get_nowait = self._queue.get_nowait
+        while True:
+            batch = [get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            stop = False
+            if None in batch:
+                stop = True
+                batch = [record for record in batch if record is not None]
+            self._write(batch)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch: list[logging.LogRecord]) -> None:
+        chunks = []
+        for record in batch:
+            try:
+                chunks.append(_format_bytes(self, record) + b"\n")
+            except Exception:
+                with self._counter_lock:
+                    self.failed += 1
+                self.handleError(record)
+        if not chunks:
+            return
+        data = b"".join(chunks)
+        try:
+            # Only the worker thread writes to the stream. The handler lock is not taken here
+            # because Handler.handle() holds it while emit() waits for room in the queue.
+            payload = data.decode("utf-8") if self._text else data
+            if metrics.collector is None:
+                self.stream.write(payload)  # type: ignore
+            else:
+                metrics.collector.write(self.stream.write, payload, len(data))  # type: ignore
+            self.stream.flush()
+        except Exception:
+            with self._counter_lock:
+                self.failed += len(chunks)
+            self.handleError(batch[-1])
+            return
+        with self._counter_lock:
+            self.written += len(chunks)
+
+    def flush(self) -> None:
+        """
+        Wait until every queued record has been written.
+        """
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._queue.join()
+
+    def close(self) -> None:
+        """
+        Write the remaining records, stop the worker thread and close the handler.
+        The stream itself is left open.
+        """
+        if not self.closed:
+            self.closed = True
+            if self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            # Records that raced with close() and landed behind the stop marker.
+            leftover = []
+            try:
+                while True:
+                    record = self._queue.get_nowait()
+                    if record is not None:
+                        leftover.append(record)
+            except queue.Empty:
+                pass
+            if leftover:
+                self._write(leftover)
+        super().close()
+
+
+_queue_handlers: "weakref.WeakSet[QueueJSONHandler]" = weakref.WeakSet()
+
+
+def _restart_queue_handlers() -> None:
+    for handler in list(_queue_handlers):
+        handler._after_fork_in_child()
+
+
+os.register_at_fork(after_in_child=_restart_queue_handlers)
@@ -0,0 +1,258 @@
+import bisect
+import threading
+import time
+import typing
+
+# Upper bounds, in seconds, of the timing histogram buckets.
+DEFAULT_BUCKETS: typing.Tuple[float, ...] = (
+    0.000001,
+    0.0000025,
+    0.000005,
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.1,
+)
+
+COUNTERS: typing.Tuple[typing.Tuple[str, str], ...] = (
+    (
+        "ids_generated",
+        "Trace IDs generated by TraceId.gen(), scopes and the middleware.",
+    ),
+    (
+        "traceid_sets",
+        "Trace IDs set by TraceId.set(), gen(), set_traceparent(), scopes and the middleware.",
+    ),
+    (
+        "traceid_clears",
+        "Trace IDs cleared by TraceId.clear(), scope exits and the middleware.",
+    ),
+    ("records_formatted", "Records formatted by JSONFormatter."),
+    (
+        "bytes_emitted",
+        "Bytes written by BinaryStreamHandler, QueueJSONHandler and RotatingJSONFileHandler.",
+    ),
+)
+
+HISTOGRAMS: typing.Tuple[typing.Tuple[str, str], ...] = (
+    (
+        "format_seconds",
+        "Sampled duration of JSONFormatter.format() and format_bytes().",
+    ),
+    (
+        "write_seconds",
+        "Sampled duration of BinaryStreamHandler, QueueJSONHandler and RotatingJSONFileHandler writes.",
+    ),
+)
+
+
+class Histogram(object):
+    """
+    A fixed-bucket histogram of durations in seconds.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self) -> dict[str, typing.Any]:
+        """
+        Return {"buckets": {upper bound: cumulative count}, "sum": seconds, "count": observations}.
+        The last bucket has the upper bound float("inf").
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            cumulative += bucket_count
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+
+class Metrics(object):
+    """
+    Counters and sampled timing histograms of the trace and logging hot paths.
+
+    Metrics are opt-in. While disabled every instrumented call site costs a module attribute lookup
+    and an `is None` test. Enable them at startup and read them from anywhere:
+        from traceid import metrics
+
+        metrics.enable(sample_every=100)
+        metrics.snapshot()         # dict of counters and histograms
+        metrics.prometheus_text()  # Prometheus text exposition format
+
+    Counters are plain integer increments without a lock, so concurrent threads may lose an increment
+    now and then. Timings are sampled: one of every `sample_every` calls is timed.
+    """
+
+    __slots__ = (
+        "ids_generated",
+        "traceid_sets",
+        "traceid_clears",
+        "records_formatted",
+        "bytes_emitted",
+        "format_seconds",
+        "write_seconds",
+        "sample_every",
+        "_format_countdown",
+        "_write_countdown",
+    )
+
+    def __init__(
+        self,
+        sample_every: int = 100,
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """
+        :param sample_every: Time one of every sample_every formats and writes.
+        :param buckets: Upper bounds in seconds of the timing histogram buckets.
+        """
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1.")
+        self.ids_generated = 0
+        self.traceid_sets = 0
+        self.traceid_clears = 0
+        self.records_formatted = 0
+        self.bytes_emitted = 0
+        self.format_seconds = Histogram(buckets)
+        self.write_seconds = Histogram(buckets)
+        self.sample_every = sample_every
+        self._format_countdown = 1
+        self._write_countdown = 1
+
+    def format(
+        self,
+        serialize: typing.Callable[[typing.Any], typing.Any],
+        format_dict: typing.Callable[[typing.Any], typing.Any],
+        record: typing.Any,
+    ) -> typing.Any:
+        """
+        Return serialize(format_dict(record)), counting the record and timing a sample of the calls.
+        """
+        self.records_formatted += 1
+        self._format_countdown -= 1
+        if self._format_countdown > 0:
+            return serialize(format_dict(record))
+        self._format_countdown = self.sample_every
+        start = time.perf_counter()
+        data = serialize(format_dict(record))
+        self.format_seconds.observe(time.perf_counter() - start)
+        return data
+
+    def write(
+        self,
+        write: typing.Callable[[typing.Any], typing.Any],
+        data: bytes | str,
+        size: int | None = None,
+    ) -> None:
+        """
+        Call write(data), counting the UTF-8 bytes of data and timing a sample of the calls.
+        :param size: Size of data in bytes, when it is already known.
+        """
+        if size is None:
+            size = len(data) if type(data) is bytes else len(data.encode("utf-8"))  # type: ignore
+        self.bytes_emitted += size
+        self._write_countdown -= 1
+        if self._write_countdown > 0:
+            write(data)
+            return
+        self._write_countdown = self.sample_every
+        start = time.perf_counter()
+        write(data)
+        self.write_seconds.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> dict[str, typing.Any]:
+        """
+        Return the counters and the histogram snapshots as a dict.
+        """
+        data: dict[str, typing.Any] = {
+            name: getattr(self, name) for name, _ in COUNTERS
+        }
+        for name, _ in HISTOGRAMS:
+            data[name] = getattr(self, name).snapshot()
+        return data
+
+
+# The active collector, read by the instrumented call sites. None while disabled.
+collector: Metrics | None = None
+# The last enabled collector, kept readable after disable().
+_collected: Metrics | None = None
+
+
+def enable(
+    sample_every: int = 100, buckets: typing.Sequence[float] = DEFAULT_BUCKETS
+) -> Metrics:
+    """
+    Start collecting metrics with a fresh collector and return it.
+    :param sample_every: Time one of every sample_every formats and writes.
+    :param buckets: Upper bounds in seconds of the timing histogram buckets.
+    """
+    global collector, _collected
+    collector = _collected = Metrics(sample_every, buckets)
+    return collector
+
+
+def disable() -> None:
+    """
+    Stop collecting metrics. The values collected so far stay available through snapshot().
+    """
+    global collector
+    collector = None
+
+
+def is_enabled() -> bool:
+    return collector is not None
+
+
+def snapshot() -> dict[str, typing.Any]:
+    """
+    Return the counters and histograms of the active or last enabled collector.
+    All values are zero if metrics were never enabled.
+    """
+    return (_collected or Metrics()).snapshot()
+
+
+def prometheus_text(prefix: str = "traceid_") -> str:
+    """
+    Return the metrics in the Prometheus text exposition format, e.g. to serve from a /metrics route.
+    """
+    data = snapshot()
+    lines = []
+    for name, help_text in COUNTERS:
+        metric = f"{prefix}{name}_total"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {data[name]}")
+    for name, help_text in HISTOGRAMS:
+        metric = f"{prefix}{name}"
+        histogram = data[name]
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for bound, count in histogram["buckets"].items():
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{metric}_bucket{{le="{le}"}} {count}')
+        lines.append(f"{metric}_sum {histogram['sum']!r}")
+        lines.append(f"{metric}_count {histogram['count']}")
+    return "\n".join(lines) + "\n"
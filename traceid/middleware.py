@@ -0,0 +1,196 @@
+import typing
+
+
+from traceid import metrics
+from traceid.traceid import (
+    Generator,
+    InvalidTraceparentError,
+    TraceContext,
+    TraceId,
+    _enter_context,
+    _exit_context,
+    get_generator,
+    new_span_id,
+)
+
+# Characters accepted in an incoming request ID. Anything else is replaced by a generated traceid.
+_ALLOWED_BYTES = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.:"
+
+
+def _valid_request_id(value: bytes, max_length: int) -> bool:
+    # translate() deletes every allowed byte, a valid id leaves nothing behind.
+    return 0 < len(value) <= max_length and not value.translate(None, _ALLOWED_BYTES)
+
+
+class TraceIdASGIMiddleware(object):
+    """
+    Pure ASGI middleware that sets the traceid of each HTTP and websocket connection.
+
+    The request ID header is read straight from the raw scope["headers"] list. A valid value is used
+    as the traceid, otherwise a new one is generated. A valid W3C traceparent header takes precedence:
+    the request continues that trace in a child span of the remote span. Otherwise the request opens
+    a root span. The traceid is added to the response start message as raw bytes and the previous
+    traceid is restored through the ContextVar token afterwards.
+
+    Usage:
+        app = TraceIdASGIMiddleware(app)
+    """
+
+    def __init__(
+        self,
+        app: typing.Callable[..., typing.Awaitable[None]],
+        header_name: str = "X-Request-ID",
+        scheme: str | Generator | None = None,
+        max_length: int = 128,
+        traceparent: bool = True,
+    ):
+        """
+        :param app: The ASGI application to wrap.
+        :param header_name: Request and response header carrying the traceid.
+        :param scheme: Scheme used to generate missing traceids. Defaults to TraceId.default_scheme.
+        :param max_length: Longest request ID accepted from clients.
+        :param traceparent: Continue the trace of an incoming W3C traceparent header.
+        """
+        self.app = app
+        self.header_name = header_name.lower().encode("latin-1")
+        self.scheme = scheme
+        if scheme is not None:
+            get_generator(scheme)
+        self.max_length = max_length
+        self.traceparent = traceparent
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        header_name = self.header_name
+        request_id = traceparent = None
+        for name, value in scope["headers"]:
+            if name == header_name:
+                if _valid_request_id(value, self.max_length):
+                    request_id = value.decode("ascii")
+            elif name == b"traceparent" and self.traceparent:
+                traceparent = value.decode("latin-1")
+        context = _request_context(traceparent, request_id, self.scheme)
+        header = (header_name, context.text.encode("latin-1"))
+
+        async def send_with_traceid(message) -> None:
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        token = _enter_context(context)
+        try:
+            await self.app(scope, receive, send_with_traceid)
+        finally:
+            _exit_context(token, context)
+
+
+class TraceIdWSGIMiddleware(object):
+    """
+    WSGI middleware that sets the traceid of each request.
+
+    The request ID is read from the WSGI environ, validated, and generated when missing or invalid.
+    A valid W3C traceparent header takes precedence, as in TraceIdASGIMiddleware. The traceid is appended to the response headers, and the previous traceid is restored through
+    the ContextVar token when the server closes the response iterable.
+
+    Usage:
+        app.wsgi_app = TraceIdWSGIMiddleware(app.wsgi_app)
+    """
+
+    def __init__(
+        self,
+        app: typing.Callable[..., typing.Iterable[bytes]],
+        header_name: str = "X-Request-ID",
+        scheme: str | Generator | None = None,
+        max_length: int = 128,
+        traceparent: bool = True,
+    ):
+        """
+        :param app: The WSGI application to wrap.
+        :param header_name: Request and response header carrying the traceid.
+        :param scheme: Scheme used to generate missing traceids. Defaults to TraceId.default_scheme.
+        :param max_length: Longest request ID accepted from clients.
+        :param traceparent: Continue the trace of an incoming W3C traceparent header.
+        """
+        self.app = app
+        self.header_name = header_name
+        self.environ_key = "HTTP_" + header_name.upper().replace("-", "_")
+        self.scheme = scheme
+        if scheme is not None:
+            get_generator(scheme)
+        self.max_length = max_length
+        self.traceparent = traceparent
+
+    def __call__(self, environ, start_response) -> typing.Iterable[bytes]:
+        request_id = environ.get(self.environ_key)
+        if request_id is not None:
+            # WSGI passes header values as latin-1 decoded str
+            raw = request_id.encode("latin-1", "replace")
+            if not _valid_request_id(raw, self.max_length):
+                request_id = None
+        traceparent = environ.get("HTTP_TRACEPARENT") if self.traceparent else None
+        context = _request_context(traceparent, request_id, self.scheme)
+        header = (self.header_name, context.text)
+
+        def start_response_with_traceid(status, headers, exc_info=None):
+            headers = list(headers)
+            headers.append(header)
+            return start_response(status, headers, exc_info)
+
+        token = _enter_context(context)
+        try:
+            result = self.app(environ, start_response_with_traceid)
+        except BaseException:
+            _exit_context(token, context)
+            raise
+        return _ClosingIterable(result, token, context)
+
+
+class _ClosingIterable(object):
+    """
+    Wraps a WSGI response iterable and resets the traceid once the server closes it,
+    so lazily generated bodies still log with the request's traceid.
+    """
+
+    def __init__(
+        self, iterable: typing.Iterable[bytes], token, context: TraceContext
+    ) -> None:
+        self.iterable = iterable
+        self.token = token
+        self.context = context
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self) -> None:
+        try:
+            close = getattr(self.iterable, "close", None)
+            if close is not None:
+                close()
+        finally:
+            if self.token is not None:
+                token, self.token = self.token, None
+                _exit_context(token, self.context)
+
+
+def _request_context(
+    traceparent: str | None, request_id: str | None, scheme: str | Generator | None
+) -> TraceContext:
+    # A valid traceparent continues the remote trace, anything else starts a root span.
+    if traceparent is not None:
+        try:
+            return TraceContext.from_traceparent(traceparent).child()
+        except InvalidTraceparentError:
+            pass
+    if request_id is None:
+        return TraceContext(_generate(scheme), new_span_id())
+    return TraceContext(request_id, new_span_id())
+
+
+def _generate(scheme: str | Generator | None):
+    if metrics.collector is not None:
+        metrics.collector.ids_generated += 1
+    return get_generator(TraceId.default_scheme if scheme is None else scheme)()
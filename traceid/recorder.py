@@ -0,0 +1,214 @@
+import collections
+import logging
+import typing
+
+
+from traceid.logging import _capture_trace
+from traceid.traceid import (
+    TraceContext,
+    TraceId,
+    add_trace_end_hook,
+    remove_trace_end_hook,
+)
+
+
+class _TraceBuffer(object):
+    __slots__ = ("records", "marked")
+
+    def __init__(self, capacity: int):
+        self.records: typing.Deque[logging.LogRecord] = collections.deque(
+            maxlen=capacity
+        )
+        self.marked = False
+
+
+class FlightRecorderHandler(logging.Handler):
+    """
+    A tail-sampling wrapper around a target handler: low-level records of a trace are kept unformatted
+    in a ring buffer, and only formatted and written when the trace turns out to be interesting.
+
+    Records at or above passthrough_level go straight to the target. Records below it are buffered per
+    trace ID, up to `capacity` records per trace and `max_records` records in total; the least recently
+    used traces are evicted beyond that. When a record at or above flush_level is logged, or the trace is
+    marked with mark() or a FlightRecorderFilter, the buffer is written through the target in order and
+    the rest of the trace is written directly. The buffer of a trace is dropped without formatting when
+    the TraceId.scope() or middleware request that started it ends.
+
+    Records below passthrough_level logged outside of a trace are dropped. Message arguments are
+    formatted when the buffer is written, so they should not be mutated after the log call.
+
+    Usage:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(FlightRecorderHandler(handler))
+    """
+
+    def __init__(
+        self,
+        target: logging.Handler,
+        capacity: int = 200,
+        max_records: int = 10000,
+        max_traces: int = 10000,
+        passthrough_level: int = logging.INFO,
+        flush_level: int = logging.ERROR,
+        level: int = logging.NOTSET,
+    ):
+        """
+        :param target: Handler that formats and writes the records, e.g. with a JSONFormatter.
+        :param capacity: Maximum number of buffered records per trace, older records are overwritten.
+        :param max_records: Maximum number of buffered records across all traces.
+        :param max_traces: Maximum number of traces tracked at the same time.
+        :param passthrough_level: Records at or above this level are written directly.
+        :param flush_level: A record at or above this level writes the buffer of its trace.
+        :param level: Handler level.
+        """
+        if capacity < 1 or max_records < 1 or max_traces < 1:
+            raise ValueError("capacity, max_records and max_traces must be at least 1.")
+        super().__init__(level)
+        self.target = target
+        self.capacity = capacity
+        self.max_records = max_records
+        self.max_traces = max_traces
+        self.passthrough_level = passthrough_level
+        self.flush_level = flush_level
+        # Buffers by trace ID, in least recently used order
+        self._buffers: collections.OrderedDict[str, _TraceBuffer] = (
+            collections.OrderedDict()
+        )
+        self.buffered = 0
+        self.flushed = 0
+        self.discarded = 0
+        self.evicted = 0
+        add_trace_end_hook(self._discard)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the number of traces and records currently buffered, and the number of records
+        written from buffers, discarded at the end of their trace and evicted.
+        """
+        with self.lock:  # type: ignore
+            return {
+                "traces": len(self._buffers),
+                "buffered": self.buffered,
+                "flushed": self.flushed,
+                "discarded": self.discarded,
+                "evicted": self.evicted,
+            }
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Handler.handle() holds self.lock
+        context = TraceId.current()
+        if context is None:
+            if record.levelno >= self.passthrough_level:
+                self.target.handle(record)
+            return
+        buffer = self._buffers.get(context.text)
+        if buffer is not None and buffer.marked:
+            self.target.handle(record)
+        elif record.levelno >= self.flush_level:
+            self._flush(context.text)
+            self.target.handle(record)
+        elif record.levelno >= self.passthrough_level:
+            self.target.handle(record)
+        else:
+            # Freeze the trace fields, the buffer may be written from another span or context.
+            _capture_trace(record)
+            record._traceid_captured = True
+            if buffer is None:
+                buffer = self._buffers[context.text] = _TraceBuffer(self.capacity)
+            else:
+                self._buffers.move_to_end(context.text)
+            if len(buffer.records) == self.capacity:
+                self.buffered -= 1
+                self.evicted += 1
+            buffer.records.append(record)
+            self.buffered += 1
+            if self.buffered > self.max_records or len(self._buffers) > self.max_traces:
+                self._evict()
+
+    def mark(self, traceid: str | None = None) -> None:
+        """
+        Write the buffered records of a trace and every later record of it.
+        :param traceid: Trace ID as a string. Defaults to the current trace.
+        """
+        if traceid is None:
+            traceid = TraceId.peek_text()
+            if traceid is None:
+                return
+        with self.lock:  # type: ignore
+            self._flush(traceid)
+
+    def _flush(self, traceid: str) -> None:
+        buffer = self._buffers.get(traceid)
+        if buffer is None:
+            buffer = self._buffers[traceid] = _TraceBuffer(self.capacity)
+            if len(self._buffers) > self.max_traces:
+                self._evict()
+        buffer.marked = True
+        records = buffer.records
+        self.buffered -= len(records)
+        self.flushed += len(records)
+        while records:
+            self.target.handle(records.popleft())
+
+    def _evict(self) -> None:
+        while self._buffers and (
+            self.buffered > self.max_records or len(self._buffers) > self.max_traces
+        ):
+            _, buffer = self._buffers.popitem(last=False)
+            self.buffered -= len(buffer.records)
+            self.evicted += len(buffer.records)
+
+    def _discard(self, context: TraceContext) -> None:
+        if not self._buffers:
+            return
+        with self.lock:  # type: ignore
+            buffer = self._buffers.pop(context.text, None)
+            if buffer is not None:
+                self.buffered -= len(buffer.records)
+                self.discarded += len(buffer.records)
+
+    def flush(self) -> None:
+        self.target.flush()
+
+    def close(self) -> None:
+        """
+        Discard the buffers and stop following trace ends. The target handler is left open.
+        """
+        remove_trace_end_hook(self._discard)
+        with self.lock:  # type: ignore
+            self.discarded += self.buffered
+            self.buffered = 0
+            self._buffers.clear()
+        super().close()
+
+
+class FlightRecorderFilter(logging.Filter):
+    """
+    Marks the current trace of a FlightRecorderHandler when a record at or above `level` passes,
+    so errors logged by other loggers or handlers also write the buffered records of the trace.
+    It never filters records out.
+
+    Usage:
+        logging.getLogger("sqlalchemy").addFilter(FlightRecorderFilter(recorder))
+    """
+
+    def __init__(
+        self,
+        recorder: FlightRecorderHandler,
+        level: int = logging.ERROR,
+        name: str = "",
+    ):
+        """
+        :param recorder: The FlightRecorderHandler whose traces are marked.
+        :param level: Records at or above this level mark their trace.
+        """
+        super().__init__(name)
+        self.recorder = recorder
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.level:
+            self.recorder.mark()
+        return True
@@ -0,0 +1,323 @@
+import array
+import heapq
+import os
+import threading
+import time
+import typing
+
+# Level buckets of the record counts: levelno // 10, capped at CRITICAL.
+LEVELS: typing.Tuple[str, ...] = (
+    "NOTSET",
+    "DEBUG",
+    "INFO",
+    "WARNING",
+    "ERROR",
+    "CRITICAL",
+)
+_LEVEL_COUNT = len(LEVELS)
+_monotonic = time.monotonic
+
+
+class TraceStats(typing.NamedTuple):
+    """
+    The state of an active trace in a report.
+    :param traceid: Trace ID as a string.
+    :param started: Unix time when the trace started.
+    :param duration: Seconds since the trace started.
+    :param records: Number of records formatted by JSONFormatter.
+    :param bytes: Size of the formatted records in bytes.
+    :param levels: Number of records by level name, levels without records are left out.
+    """
+
+    traceid: str
+    started: float
+    duration: float
+    records: int
+    bytes: int
+    levels: dict[str, int]
+
+
+class ActiveTraceRegistry(object):
+    """
+    A bounded store of the traces in flight, with their start time, their record counts by level and
+    the bytes JSONFormatter produced for them.
+
+    The registry is opt-in, enable it with traceid.registry.enable(). A trace is registered when a traceid
+    is set by TraceId.set(), gen(), set_traceparent(), a scope or a middleware, and removed when that scope
+    or request ends or TraceId.clear() clears it. Nested starts of the same trace ID are counted, the trace
+    is removed when the last one ends.
+
+    The traces live in parallel arrays indexed by slot, and a dict maps trace IDs to slots. When all
+    `capacity` slots are taken, a CLOCK sweep evicts a trace that neither started nor logged since the
+    last sweep, so traces leaked by a set() that was never cleared are evicted before active ones.
+    A lock guards every update: they are safe from threads and, as they never await, from asyncio tasks.
+    """
+
+    __slots__ = (
+        "capacity",
+        "_slots",
+        "_keys",
+        "_free",
+        "_started",
+        "_depth",
+        "_counts",
+        "_bytes",
+        "_touched",
+        "_hand",
+        "_lock",
+        "started",
+        "ended",
+        "evicted",
+    )
+
+    def __init__(self, capacity: int = 10000):
+        """
+        :param capacity: Maximum number of traces tracked at the same time.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        capacity = self.capacity
+        self._slots: dict[str, int] = {}
+        self._keys: list[str | None] = [None] * capacity
+        # Free slots, popped from the end so the lowest slots are used first
+        self._free = list(range(capacity - 1, -1, -1))
+        # time.monotonic() of the start
+        self._started = array.array("d", bytes(8 * capacity))
+        self._depth = array.array("q", bytes(8 * capacity))
+        # _LEVEL_COUNT counters per slot
+        self._counts = array.array("q", bytes(8 * capacity * _LEVEL_COUNT))
+        self._bytes = array.array("q", bytes(8 * capacity))
+        # Reference bits of the CLOCK eviction
+        self._touched = bytearray(capacity)
+        self._hand = 0
+        self.started = 0
+        self.ended = 0
+        self.evicted = 0
+
+    def _after_fork_in_child(self) -> None:
+        # The traces belong to the parent, and its threads may have held the lock.
+        self._lock = threading.Lock()
+        self._reset()
+
+    def start(self, context: typing.Any) -> None:
+        """
+        Register the start of a trace.
+        :param context: The TraceContext of the trace.
+        """
+        text = context.text
+        with self._lock:
+            self.started += 1
+            slot = self._slots.get(text)
+            if slot is not None:
+                self._depth[slot] += 1
+                self._touched[slot] = 1
+                return
+            if not self._free:
+                self._evict()
+            slot = self._free.pop()
+            self._slots[text] = slot
+            self._keys[slot] = text
+            self._started[slot] = _monotonic()
+            self._depth[slot] = 1
+            base = slot * _LEVEL_COUNT
+            self._counts[base : base + _LEVEL_COUNT] = _ZERO_COUNTS
+            self._bytes[slot] = 0
+            self._touched[slot] = 1
+
+    def end(self, context: typing.Any) -> None:
+        """
+        Register the end of a trace. Unknown traces are ignored.
+        :param context: The TraceContext of the trace.
+        """
+        with self._lock:
+            slot = self._slots.get(context.text)
+            if slot is None:
+                return
+            self._depth[slot] -= 1
+            if self._depth[slot] > 0:
+                return
+            self.ended += 1
+            self._remove(slot)
+
+    def count(self, traceid: str | None, levelno: int, size: int) -> None:
+        """
+        Count a formatted record of a trace. Records of unknown traces are ignored.
+        :param traceid: Trace ID of the record as a string, or None.
+        :param levelno: Level of the record.
+        :param size: Size of the formatted record in bytes.
+        """
+        if traceid is None or traceid not in self._slots:
+            # Records outside of tracked traces skip the lock
+            return
+        level = levelno // 10
+        if level >= _LEVEL_COUNT:
+            level = _LEVEL_COUNT - 1
+        elif level < 0:
+            level = 0
+        with self._lock:
+            slot = self._slots.get(traceid)
+            if slot is None:
+                return
+            self._counts[slot * _LEVEL_COUNT + level] += 1
+            self._bytes[slot] += size
+            self._touched[slot] = 1
+
+    def _remove(self, slot: int) -> None:
+        del self._slots[self._keys[slot]]  # type: ignore
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def _evict(self) -> None:
+        # Every slot is taken: clear reference bits until a slot without one comes up.
+        touched = self._touched
+        capacity = self.capacity
+        hand = self._hand
+        while touched[hand]:
+            touched[hand] = 0
+            hand = (hand + 1) % capacity
+        self._hand = (hand + 1) % capacity
+        self.evicted += 1
+        self._remove(hand)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the number of active traces, and the number of traces started, ended and evicted.
+        """
+        with self._lock:
+            return {
+                "active": len(self._slots),
+                "started": self.started,
+                "ended": self.ended,
+                "evicted": self.evicted,
+            }
+
+    def _snapshot(self) -> tuple:
+        with self._lock:
+            return (
+                list(self._slots.items()),
+                self._started[:],
+                self._counts[:],
+                self._bytes[:],
+            )
+
+    def _report(
+        self, snapshot: tuple, items: typing.Iterable[tuple[str, int]]
+    ) -> list[TraceStats]:
+        _, started, counts, sizes = snapshot
+        now = _monotonic()
+        offset = time.time() - now
+        result = []
+        for text, slot in items:
+            base = slot * _LEVEL_COUNT
+            levels = {
+                name: count
+                for name, count in zip(LEVELS, counts[base : base + _LEVEL_COUNT])
+                if count
+            }
+            result.append(
+                TraceStats(
+                    text,
+                    offset + started[slot],
+                    now - started[slot],
+                    sum(levels.values()),
+                    sizes[slot],
+                    levels,
+                )
+            )
+        return result
+
+    def traces(self) -> list[TraceStats]:
+        """
+        Return the state of every active trace, in no particular order.
+        """
+        snapshot = self._snapshot()
+        return self._report(snapshot, snapshot[0])
+
+    def longest_running(self, n: int = 10) -> list[TraceStats]:
+        """
+        Return the n active traces that started first, longest running first.
+        """
+        snapshot = self._snapshot()
+        started = snapshot[1]
+        return self._report(
+            snapshot, heapq.nsmallest(n, snapshot[0], key=lambda item: started[item[1]])
+        )
+
+    def chattiest(self, n: int = 10, by: str = "bytes") -> list[TraceStats]:
+        """
+        Return the n active traces that logged the most, most first.
+        :param by: "bytes" to rank by formatted size, "records" by number of records.
+        """
+        if by not in ("bytes", "records"):
+            raise ValueError(f"Unknown ranking {by!r}. Use 'bytes' or 'records'.")
+        snapshot = self._snapshot()
+        if by == "bytes":
+            sizes = snapshot[3]
+            key = lambda item: sizes[item[1]]
+        else:
+            counts = snapshot[2]
+            key = lambda item: sum(
+                counts[item[1] * _LEVEL_COUNT : (item[1] + 1) * _LEVEL_COUNT]
+            )
+        return self._report(snapshot, heapq.nlargest(n, snapshot[0], key=key))
+
+
+_ZERO_COUNTS = array.array("q", bytes(8 * _LEVEL_COUNT))
+
+
+# The active registry, read by TraceId, the scopes, the middlewares and JSONFormatter. None while disabled.
+active: ActiveTraceRegistry | None = None
+
+
+def enable(capacity: int = 10000) -> ActiveTraceRegistry:
+    """
+    Start tracking active traces with a fresh registry and return it.
+    Traces started before are not tracked.
+    :param capacity: Maximum number of traces tracked at the same time.
+    """
+    global active
+    active = ActiveTraceRegistry(capacity)
+    return active
+
+
+def disable() -> None:
+    """
+    Stop tracking active traces.
+    """
+    global active
+    active = None
+
+
+def is_enabled() -> bool:
+    return active is not None
+
+
+def longest_running(n: int = 10) -> list[TraceStats]:
+    """
+    Return the n longest running active traces, or an empty list while the registry is disabled.
+    """
+    return [] if active is None else active.longest_running(n)
+
+
+def chattiest(n: int = 10, by: str = "bytes") -> list[TraceStats]:
+    """
+    Return the n active traces that logged the most, or an empty list while the registry is disabled.
+    :param by: "bytes" to rank by formatted size, "records" by number of records.
+    """
+    return [] if active is None else active.chattiest(n, by)
+
+
+def _after_fork_in_child() -> None:
+    if active is not None:
+        active._after_fork_in_child()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
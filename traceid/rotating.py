@@ -0,0 +1,559 @@
+import base64
+import datetime
+import gzip
+import hashlib
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import typing
+import weakref
+
+from traceid import metrics
+from traceid.logging import _format_bytes
+from traceid.traceid import TraceId
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+class BloomFilter(object):
+    """
+    A fixed-size Bloom filter of trace IDs, used by the segment manifests.
+    A lookup never misses an added trace ID and wrongly matches about 1% of the others
+    with the default size and up to 100,000 trace IDs.
+    """
+
+    __slots__ = ("bits", "hashes", "data")
+
+    def __init__(self, bits: int = 1 << 20, hashes: int = 7, data: bytes | None = None):
+        """
+        :param bits: Size of the filter in bits, a multiple of 8.
+        :param hashes: Bits set per trace ID.
+        :param data: Content of a saved filter.
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(bits // 8) if data is None else bytearray(data)
+
+    def _positions(self, key: str) -> typing.Iterator[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        bits = self.bits
+        for i in range(self.hashes):
+            yield (first + i * step) % bits
+
+    def add(self, key: str) -> None:
+        data = self.data
+        for position in self._positions(key):
+            data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        data = self.data
+        return all(
+            data[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class Manifest(object):
+    """
+    The trace IDs and time range of a segment written by RotatingJSONFileHandler,
+    stored beside it as `<segment>.manifest.json`.
+    """
+
+    __slots__ = ("segment", "records", "size", "start", "end", "complete", "traces")
+
+    def __init__(
+        self,
+        segment: str,
+        records: int = 0,
+        size: int = 0,
+        start: float | None = None,
+        end: float | None = None,
+        complete: bool = True,
+        traces: BloomFilter | None = None,
+    ):
+        """
+        :param segment: File name of the segment, compressed or not, without directory.
+        :param records: Number of records of the segment.
+        :param size: Uncompressed size of the segment in bytes.
+        :param start: Creation time of the first record, as a UNIX timestamp.
+        :param end: Creation time of the last record, as a UNIX timestamp.
+        :param complete: False if the segment holds records the manifest does not cover,
+            e.g. written before a restart without a clean close().
+        :param traces: Bloom filter of the trace IDs of the records.
+        """
+        self.segment = segment
+        self.records = records
+        self.size = size
+        self.start = start
+        self.end = end
+        self.complete = complete
+        self.traces = BloomFilter() if traces is None else traces
+
+    def add(self, traceid: str | None, created: float, size: int) -> None:
+        self.records += 1
+        self.size += size
+        if self.start is None:
+            self.start = created
+        self.end = created
+        if traceid is not None:
+            self.traces.add(traceid)
+
+    def may_contain(
+        self,
+        traceid: str | None = None,
+        start: float | None = None,
+        end: float | None = None,
+    ) -> bool:
+        """
+        Return False if the segment certainly has no record of the trace ID within [start, end).
+        """
+        if not self.complete:
+            return True
+        if start is not None and (self.end is None or self.end < start):
+            return False
+        if end is not None and (self.start is None or self.start >= end):
+            return False
+        return traceid is None or traceid in self.traces
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "segment": self.segment,
+                "records": self.records,
+                "size": self.size,
+                "start": self.start,
+                "end": self.end,
+                "complete": self.complete,
+                "traces": {
+                    "bits": self.traces.bits,
+                    "hashes": self.traces.hashes,
+                    "data": base64.b64encode(self.traces.data).decode("ascii"),
+                },
+            }
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "Manifest":
+        data = json.loads(text)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version {data.get('version')!r}.")
+        traces = data["traces"]
+        return cls(
+            data["segment"],
+            data["records"],
+            data["size"],
+            data["start"],
+            data["end"],
+            data["complete"],
+            BloomFilter(
+                traces["bits"], traces["hashes"], base64.b64decode(traces["data"])
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(f.read())
+
+    def save(self, path: str) -> None:
+        """
+        Write the manifest atomically.
+        """
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+        os.replace(path + ".tmp", path)
+
+
+def _segment_pattern(filename: str) -> re.Pattern[str]:
+    # <name>.<YYYYmmdd-HHMMSS>-<sequence>, optionally compressed
+    return re.compile(
+        re.escape(os.path.basename(filename)) + r"\.(\d{8}-\d{6}-\d{6})(\.gz|\.zst)?"
+    )
+
+
+def list_segments(filename: str) -> list[str]:
+    """
+    Return the paths of the rotated segments of a RotatingJSONFileHandler file, oldest first.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    pattern = _segment_pattern(filename)
+    segments = []
+    for name in os.listdir(directory):
+        match = pattern.fullmatch(name)
+        if match is not None:
+            segments.append((match.group(1), os.path.join(directory, name)))
+    return [path for _, path in sorted(segments)]
+
+
+def _manifest_path(segment: str) -> str:
+    for extension in COMPRESSIONS.values():
+        if segment.endswith(extension):
+            segment = segment[: -len(extension)]
+    return segment + MANIFEST_SUFFIX
+
+
+def _timestamp(moment: datetime.datetime | float | None) -> float | None:
+    if isinstance(moment, datetime.datetime):
+        return moment.timestamp()
+    return moment
+
+
+def find_segments(
+    filename: str,
+    traceid: str | None = None,
+    start: datetime.datetime | float | None = None,
+    end: datetime.datetime | float | None = None,
+) -> list[str]:
+    """
+    Return the files of a RotatingJSONFileHandler, oldest first, that may hold records of a trace
+    within [start, end). Segments whose manifest rules them out are skipped. Segments without a
+    manifest, e.g. still being compressed, and a non-empty active file are always returned,
+    unless the handler was closed.
+    :param filename: The file name given to the handler.
+    :param traceid: Trace ID to look for.
+    :param start: Start of the time range, a datetime or UNIX timestamp, inclusive.
+    :param end: End of the time range, a datetime or UNIX timestamp, exclusive.
+    """
+    start, end = _timestamp(start), _timestamp(end)
+    found = []
+    for segment in list_segments(filename):
+        try:
+            manifest = Manifest.load(_manifest_path(segment))
+        except (OSError, ValueError, KeyError):
+            found.append(segment)
+            continue
+        if manifest.may_contain(traceid, start, end):
+            found.append(segment)
+    try:
+        size = os.path.getsize(filename)
+    except FileNotFoundError:
+        size = 0
+    if size:
+        # The manifest of the active file is only written by close().
+        try:
+            manifest = Manifest.load(filename + MANIFEST_SUFFIX)
+        except (OSError, ValueError, KeyError):
+            manifest = None
+        if (
+            manifest is None
+            or manifest.size != size
+            or manifest.may_contain(traceid, start, end)
+        ):
+            found.append(filename)
+    return found
+
+
+def _compressor(compression: str | None) -> str | None:
+    if compression == "auto":
+        try:
+            importlib.import_module("zstandard")
+            return "zstd"
+        except ImportError:
+            return "gzip"
+    if compression == "zstd":
+        try:
+            importlib.import_module("zstandard")
+        except ImportError:
+            raise ImportError(
+                "zstd compression requires zstandard. Please install it with `pip install zstandard`."
+            ) from None
+    elif compression not in (None, "gzip"):
+        raise ValueError(
+            f"Unknown compression {compression!r}. Available compressions: auto, gzip, zstd, None."
+        )
+    return compression
+
+
+def _compress(source: str, compression: str) -> str:
+    target = source + COMPRESSIONS[compression]
+    with open(source, "rb") as src, open(target + ".tmp", "wb") as dst:
+        if compression == "gzip":
+            with gzip.GzipFile(
+                filename="", mode="wb", fileobj=dst, compresslevel=6, mtime=0
+            ) as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+        else:
+            zstandard = importlib.import_module("zstandard")
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+    os.replace(target + ".tmp", target)
+    os.unlink(source)
+    return target
+
+
+class RotatingJSONFileHandler(logging.Handler):
+    """
+    A file handler for JSON lines, e.g. from JSONFormatter, that buffers writes, rotates by size or time
+    and compresses the rotated segments on a background thread.
+
+    Formatted lines are collected in memory and written with one write() call once `buffer_size` bytes
+    are pending or `flush_interval` seconds have passed. The size of the file is tracked without tell().
+    When the file reaches `max_bytes`, or `interval` seconds after its first record, it is renamed to
+    `<filename>.<YYYYmmdd-HHMMSS>-<sequence>` and a new file is started. The rename is the only work done
+    on the logging thread: compression, the segment manifest and the removal of old segments happen on
+    the background thread.
+
+    Each segment gets a manifest with its time range and a Bloom filter of its trace IDs, so
+    find_segments() can skip segments that do not hold a trace.
+
+    Usage:
+        handler = RotatingJSONFileHandler("logs/app.log", max_bytes=256 << 20, backup_count=50)
+        handler.setFormatter(JSONFormatter())
+        logging.getLogger().addHandler(handler)
+
+        for path in find_segments("logs/app.log", traceid="4bf92f3577b34da6a3ce929d0e0e4736"):
+            ...
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = 64 << 20,
+        interval: float | None = None,
+        buffer_size: int = 64 << 10,
+        flush_interval: float = 1.0,
+        backup_count: int | None = None,
+        compression: str | None = "auto",
+        manifest_bits: int = 1 << 20,
+        level: int = logging.NOTSET,
+    ):
+        """
+        :param filename: Path of the active file. Segments are written beside it.
+        :param max_bytes: Rotate once the file reaches this size. 0 disables rotation by size.
+        :param interval: Rotate this many seconds after the first record of the file. None disables it.
+        :param buffer_size: Write the pending lines once they reach this many bytes.
+        :param flush_interval: Write the pending lines at least every flush_interval seconds.
+        :param backup_count: Number of segments to keep. None keeps every segment.
+        :param compression: "auto" (zstd if zstandard is installed, else gzip), "gzip", "zstd" or None.
+        :param manifest_bits: Size in bits of the Bloom filter of trace IDs in each manifest.
+        :param level: Handler level.
+        """
+        if manifest_bits < 8 or manifest_bits % 8:
+            raise ValueError("manifest_bits must be a positive multiple of 8.")
+        super().__init__(level)
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.backup_count = backup_count
+        self.compression = _compressor(compression)
+        self.manifest_bits = manifest_bits
+        self.rotations = 0
+        self.closed = False
+        self._buffer = bytearray()
+        self._flushed_at = time.monotonic()
+        self._sequence = 0
+        self._last_traceid: str | None = None
+        self._open()
+        self._start()
+        _rotating_handlers.add(self)
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self._file = open(self.filename, "ab", buffering=0)
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._opened_at: float | None = None
+        self._manifest = None
+        manifest_path = self.filename + MANIFEST_SUFFIX
+        if self._size:
+            # The manifest written by close() is valid if nothing was appended since.
+            try:
+                manifest = Manifest.load(manifest_path)
+                if manifest.size == self._size:
+                    self._manifest = manifest
+                    self._opened_at = manifest.start
+            except (OSError, ValueError, KeyError):
+                pass
+        if self._manifest is None:
+            self._manifest = Manifest(
+                os.path.basename(self.filename),
+                complete=not self._size,
+                traces=BloomFilter(self.manifest_bits),
+            )
+            if self._size:
+                self._manifest.size = self._size
+        self._last_traceid = None
+        try:
+            os.unlink(manifest_path)
+        except FileNotFoundError:
+            pass
+
+    def _start(self) -> None:
+        self._jobs: queue.Queue[tuple[str, Manifest] | None] = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="traceid-RotatingJSONFileHandler", daemon=True
+        )
+        self._thread.start()
+
+    def _after_fork_in_child(self) -> None:
+        # The pending lines and the background thread belong to the parent.
+        if not self.closed:
+            self._buffer.clear()
+            self._start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = _format_bytes(self, record) + b"\n"
+            if self.closed:
+                return
+            created = record.created
+            if self._opened_at is None:
+                self._opened_at = created
+            elif (self.max_bytes and self._size + len(data) > self.max_bytes) or (
+                self.interval and created - self._opened_at >= self.interval
+            ):
+                self._rotate()
+                self._opened_at = created
+            traceid = record.__dict__.get("trace_id")
+            if traceid is None:
+                traceid = TraceId.peek_text()
+            elif type(traceid) is not str:
+                traceid = str(traceid)
+            manifest = self._manifest
+            if traceid == self._last_traceid:
+                # Consecutive records of a trace update the Bloom filter once.
+                manifest.add(None, created, len(data))
+            else:
+                manifest.add(traceid, created, len(data))
+                self._last_traceid = traceid
+            self._buffer += data
+            self._size += len(data)
+            if (
+                len(self._buffer) >= self.buffer_size
+                or time.monotonic() - self._flushed_at >= self.flush_interval
+            ):
+                self._write()
+        except RecursionError:  # pragma: no cover
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _write(self) -> None:
+        # Called with the handler lock held.
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        if metrics.collector is None:
+            self._file.write(data)
+        else:
+            metrics.collector.write(self._file.write, data, len(data))
+
+    def _rotate(self) -> None:
+        self._write()
+        self._file.close()
+        self._sequence += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        segment = f"{self.filename}.{stamp}-{self._sequence % 1000000:06d}"
+        while os.path.exists(segment) or any(
+            os.path.exists(segment + extension) for extension in COMPRESSIONS.values()
+        ):
+            self._sequence += 1
+            segment = f"{self.filename}.{stamp}-{self._sequence % 1000000:06d}"
+        os.rename(self.filename, segment)
+        manifest = self._manifest
+        manifest.segment = os.path.basename(segment)
+        self._jobs.put((segment, manifest))
+        self.rotations += 1
+        self._open()
+
+    def rotate(self) -> None:
+        """
+        Rotate the file now, unless it is empty.
+        """
+        with self.lock:  # type: ignore
+            if not self.closed and self._size:
+                self._rotate()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                job = self._jobs.get(timeout=self.flush_interval)
+            except queue.Empty:
+                with self.lock:  # type: ignore
+                    if not self.closed and self._buffer:
+                        if time.monotonic() - self._flushed_at >= self.flush_interval:
+                            self._write()
+                continue
+            try:
+                if job is None:
+                    return
+                self._finish_segment(*job)
+            except Exception:
+                # Keep the thread alive: the segment stays uncompressed and is still found.
+                logging.getLogger(__name__).exception(
+                    "Failed to finish log segment %s", job[0] if job else None
+                )
+            finally:
+                self._jobs.task_done()
+
+    def _finish_segment(self, segment: str, manifest: Manifest) -> None:
+        if self.compression is not None:
+            segment = _compress(segment, self.compression)
+            manifest.segment = os.path.basename(segment)
+        manifest.save(_manifest_path(segment))
+        if self.backup_count is not None:
+            segments = list_segments(self.filename)
+            for old in segments[: max(0, len(segments) - self.backup_count)]:
+                for path in (old, _manifest_path(old)):
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+
+    def wait(self) -> None:
+        """
+        Wait until the rotated segments are compressed and their manifests written.
+        """
+        if self._thread.is_alive():
+            self._jobs.join()
+
+    def flush(self) -> None:
+        """
+        Write the pending lines to the file.
+        """
+        with self.lock:  # type: ignore
+            if not self.closed:
+                self._write()
+
+    def close(self) -> None:
+        """
+        Write the pending lines, finish the rotated segments and close the file.
+        The manifest of the active file is saved, so it stays complete after a restart.
+        """
+        with self.lock:  # type: ignore
+            if self.closed:
+                super().close()
+                return
+            self._write()
+            self._file.close()
+            self.closed = True
+            if self._size:
+                self._manifest.save(self.filename + MANIFEST_SUFFIX)
+        if self._thread.is_alive():
+            self._jobs.put(None)
+            self._thread.join()
+        super().close()
+
+
+_rotating_handlers: "weakref.WeakSet[RotatingJSONFileHandler]" = weakref.WeakSet()
+
+
+def _restart_rotating_handlers() -> None:
+    for handler in list(_rotating_handlers):
+        handler._after_fork_in_child()
+
+
+os.register_at_fork(after_in_child=_restart_rotating_handlers)
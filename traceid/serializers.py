@@ -0,0 +1,159 @@
+import importlib
+import json
+import typing
+
+
+class JSONBackend(object):
+    """
+    Base class for the JSON serializers used by JSONFormatter.
+
+    A backend is built once with the formatter's json_* options and then reused for every record.
+    """
+
+    name: str = ""
+
+    def __init__(
+        self,
+        ensure_ascii: bool = False,
+        indent: int | None = None,
+        separators: tuple[str, str] | None = None,
+        default: typing.Callable[[typing.Any], typing.Any] | None = None,
+    ):
+        self.ensure_ascii = ensure_ascii
+        self.indent = indent
+        self.separators = separators
+        self.default = default
+
+    def dumps(self, data: typing.Any) -> str:
+        """
+        Serialize data to a JSON string.
+        """
+        raise NotImplementedError
+
+    def dumpb(self, data: typing.Any) -> bytes:
+        """
+        Serialize data to UTF-8 encoded JSON bytes.
+        """
+        return self.dumps(data).encode("utf-8")
+
+    def _unsupported(self, option: str, value: typing.Any) -> ValueError:
+        return ValueError(
+            f"JSON backend {self.name!r} does not support {option}={value!r}."
+        )
+
+
+class StdlibBackend(JSONBackend):
+    """
+    The json module of the standard library, with a pre-built json.JSONEncoder.
+    Its output is identical to json.dumps() with the same options.
+    """
+
+    name = "json"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoder = json.JSONEncoder(
+            ensure_ascii=self.ensure_ascii,
+            indent=self.indent,
+            separators=self.separators,
+            default=self.default,
+        )
+        self.dumps = self.encoder.encode  # type: ignore
+
+
+class OrjsonBackend(JSONBackend):
+    """
+    orjson backend. It writes compact UTF-8 JSON, so json_ensure_ascii is not supported,
+    json_indent must be None or 2 and json_separators must be None or (",", ":").
+    """
+
+    name = "orjson"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        orjson = importlib.import_module("orjson")
+        if self.ensure_ascii:
+            raise self._unsupported("ensure_ascii", self.ensure_ascii)
+        option = 0
+        if self.indent == 2:
+            option |= orjson.OPT_INDENT_2
+        elif self.indent is not None:
+            raise self._unsupported("indent", self.indent)
+        if self.separators is not None and tuple(self.separators) != (",", ":"):
+            raise self._unsupported("separators", self.separators)
+        self._dumps = orjson.dumps
+        self._option = option or None
+
+    def dumps(self, data: typing.Any) -> str:
+        return self._dumps(data, default=self.default, option=self._option).decode()
+
+    def dumpb(self, data: typing.Any) -> bytes:
+        return self._dumps(data, default=self.default, option=self._option)
+
+
+class MsgspecBackend(JSONBackend):
+    """
+    msgspec backend. It writes compact UTF-8 JSON, so json_ensure_ascii and json_indent are not supported
+    and json_separators must be None or (",", ":"). json_default is used as msgspec's enc_hook.
+    """
+
+    name = "msgspec"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        msgspec_json = importlib.import_module("msgspec.json")
+        if self.ensure_ascii:
+            raise self._unsupported("ensure_ascii", self.ensure_ascii)
+        if self.indent is not None:
+            raise self._unsupported("indent", self.indent)
+        if self.separators is not None and tuple(self.separators) != (",", ":"):
+            raise self._unsupported("separators", self.separators)
+        self.encoder = msgspec_json.Encoder(enc_hook=self.default)
+        self.dumpb = self.encoder.encode  # type: ignore
+
+    def dumps(self, data: typing.Any) -> str:
+        return self.encoder.encode(data).decode()
+
+
+BACKENDS: dict[str, type[JSONBackend]] = {
+    "orjson": OrjsonBackend,
+    "msgspec": MsgspecBackend,
+    "json": StdlibBackend,
+}
+
+
+def get_backend(
+    name: str = "json",
+    ensure_ascii: bool = False,
+    indent: int | None = None,
+    separators: tuple[str, str] | None = None,
+    default: typing.Callable[[typing.Any], typing.Any] | None = None,
+) -> JSONBackend:
+    """
+    Build a JSON backend.
+    :param name: "json", "orjson", "msgspec" or "auto". "auto" picks the first installed backend
+        that supports the given options, in the order orjson, msgspec, json.
+    :raises ValueError: If the backend is unknown or does not support the given options.
+    :raises ImportError: If the requested backend is not installed.
+    """
+    options = dict(
+        ensure_ascii=ensure_ascii, indent=indent, separators=separators, default=default
+    )
+    if name == "auto":
+        for backend in BACKENDS.values():
+            try:
+                return backend(**options)
+            except (ImportError, ValueError):
+                continue
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown JSON backend {name!r}. Available backends: auto, {', '.join(BACKENDS)}."
+        ) from None
+    try:
+        return backend(**options)
+    except ImportError:
+        raise ImportError(
+            f"JSON backend {name!r} is not installed. Please install it with `pip install {name}`."
+        ) from None
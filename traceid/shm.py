@@ -0,0 +1,533 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import typing
+import weakref
+import zlib
+
+from traceid.logging import _format_bytes
+
+# A ring file holds a header followed by `capacity` bytes of records. Each worker process writes its
+# own ring, the collector is the only reader: a single-producer single-consumer queue without locks.
+# The producer owns the tail and the drop counters, the collector owns the head; they live on separate
+# cache lines. Head and tail are byte offsets that only grow, their position in the data is
+# offset % capacity. A record is a length and a commit word followed by the formatted line, padded to
+# 8 bytes. A record never wraps: the end of the data is skipped with a padding marker instead.
+# The commit word is a CRC-32 of the line seeded with the offset and the length of the record, see _commit().
+# All integers are little-endian.
+MAGIC = b"TIDRING2"
+# magic, capacity, pid of the producer
+HEADER = struct.Struct("<8sQQ")
+# tail, dropped records, dropped bytes
+PRODUCER_OFFSET = 64
+PRODUCER = struct.Struct("<QQQ")
+HEAD_OFFSET = 128
+U64 = struct.Struct("<Q")
+DATA_OFFSET = 192
+# length, commit word
+RECORD = struct.Struct("<II")
+PADDING = 0xFFFFFFFF
+ALIGN = 8
+# Odd, so that a zeroed record never carries a valid commit word.
+COMMIT_SEED = 0x9E3779B1
+# Seconds a record may stay uncommitted below the tail before the collector reports the ring as corrupted.
+COMMIT_TIMEOUT = 1.0
+
+
+def _aligned(size: int) -> int:
+    return (size + ALIGN - 1) & ~(ALIGN - 1)
+
+
+def _commit(offset: int, length: int, data: typing.Any = b"") -> int:
+    # A stale record left by an earlier lap at the same position has another offset, so another commit word.
+    return zlib.crc32(data, (offset + length + COMMIT_SEED) & 0xFFFFFFFF)
+
+
+class Ring(object):
+    """
+    A memory-mapped ring file, written by SharedRingHandler and drained by SharedRingCollector.
+
+    The producer writes a record before it advances the tail, and the collector reads the records before
+    it advances the head. Python has no memory barriers, and on weakly ordered CPUs such as arm64 the
+    collector may see the new tail before the bytes of the record. So every record carries a commit word
+    derived from its offset and contents: the collector checks it after copying the record, and leaves a
+    record that does not match yet for the next read_into(). A record still not matching after
+    COMMIT_TIMEOUT seconds is reported as corrupted.
+    """
+
+    __slots__ = (
+        "path",
+        "capacity",
+        "pid",
+        "tail",
+        "head",
+        "_mmap",
+        "_buffer",
+        "_pending_head",
+        "_pending_since",
+    )
+
+    def __init__(self, path: str, capacity: int | None = None):
+        """
+        :param path: Path of the ring file. Use a tmpfs directory such as /dev/shm for shared memory.
+        :param capacity: Create the ring with this many bytes of data if the file is not a ring yet.
+            Without capacity an existing ring is opened, or ValueError is raised.
+        """
+        self.path = path
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if capacity else 0), 0o600)
+        try:
+            if os.fstat(fd).st_size < DATA_OFFSET or not self._valid(fd):
+                if not capacity:
+                    raise ValueError(f"{path} is not a ring file.")
+                capacity = _aligned(capacity)
+                os.ftruncate(fd, DATA_OFFSET + capacity)
+                self._mmap = mmap.mmap(fd, DATA_OFFSET + capacity)
+                self._mmap[:DATA_OFFSET] = bytes(DATA_OFFSET)
+                # The magic is written last, the collector ignores the file until then.
+                HEADER.pack_into(self._mmap, 0, MAGIC, capacity, os.getpid())
+            else:
+                self._mmap = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self._buffer = memoryview(self._mmap)
+        _, self.capacity, self.pid = HEADER.unpack_from(self._buffer, 0)
+        if len(self._buffer) < DATA_OFFSET + self.capacity:
+            self.close()
+            raise ValueError(f"{path} is truncated.")
+        self.tail = PRODUCER.unpack_from(self._buffer, PRODUCER_OFFSET)[0]
+        self.head = U64.unpack_from(self._buffer, HEAD_OFFSET)[0]
+        # Head of a record found uncommitted by read_into(), and when
+        self._pending_head = -1
+        self._pending_since = 0.0
+        if capacity and self.pid != os.getpid():
+            # A ring left behind by an exited process with the same pid: keep appending to it.
+            self.pid = os.getpid()
+            HEADER.pack_into(self._buffer, 0, MAGIC, self.capacity, self.pid)
+
+    @staticmethod
+    def _valid(fd: int) -> bool:
+        magic, capacity, _ = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+        return magic == MAGIC and os.fstat(fd).st_size >= DATA_OFFSET + capacity
+
+    def write(self, data: bytes) -> bool:
+        """
+        Append a record. Return False without writing if the ring has no room for it.
+        Only the producing process may call this.
+        """
+        capacity = self.capacity
+        need = _aligned(RECORD.size + len(data))
+        tail = self.tail
+        position = tail % capacity
+        skip = capacity - position if capacity - position < need else 0
+        head = U64.unpack_from(self._buffer, HEAD_OFFSET)[0]
+        if tail + skip + need - head > capacity:
+            return False
+        buffer = self._buffer
+        if skip:
+            RECORD.pack_into(
+                buffer, DATA_OFFSET + position, PADDING, _commit(tail, PADDING)
+            )
+            tail += skip
+            position = 0
+        start = DATA_OFFSET + position + RECORD.size
+        buffer[start : start + len(data)] = data
+        RECORD.pack_into(
+            buffer, start - RECORD.size, len(data), _commit(tail, len(data), data)
+        )
+        self.tail = tail + need
+        U64.pack_into(buffer, PRODUCER_OFFSET, self.tail)
+        return True
+
+    def count_dropped(self, size: int) -> None:
+        _, dropped, dropped_bytes = PRODUCER.unpack_from(self._buffer, PRODUCER_OFFSET)
+        PRODUCER.pack_into(
+            self._buffer, PRODUCER_OFFSET, self.tail, dropped + 1, dropped_bytes + size
+        )
+
+    def dropped(self) -> tuple[int, int]:
+        """
+        Return the number of records and bytes the producer dropped because the ring was full.
+        """
+        _, dropped, dropped_bytes = PRODUCER.unpack_from(self._buffer, PRODUCER_OFFSET)
+        return dropped, dropped_bytes
+
+    def pending(self) -> int:
+        """
+        Return the number of bytes written and not drained yet, including the record headers.
+        """
+        tail = PRODUCER.unpack_from(self._buffer, PRODUCER_OFFSET)[0]
+        return tail - U64.unpack_from(self._buffer, HEAD_OFFSET)[0]
+
+    def read_into(self, out: bytearray) -> int:
+        """
+        Append the pending records to out and release their room. Return the number of records read.
+        Records the producer has not committed yet, as far as this process can see, are left for the next call.
+        Only the collector may call this.
+        """
+        buffer = self._buffer
+        capacity = self.capacity
+        head = self.head
+        tail = PRODUCER.unpack_from(buffer, PRODUCER_OFFSET)[0]
+        records = 0
+        while head < tail:
+            position = head % capacity
+            start = DATA_OFFSET + position + RECORD.size
+            length, commit = RECORD.unpack_from(buffer, start - RECORD.size)
+            if length == PADDING:
+                if commit != _commit(head, PADDING):
+                    self._uncommitted(head)
+                    break
+                head += capacity - position
+                continue
+            if length > capacity - position - RECORD.size:
+                self._uncommitted(head)
+                break
+            data = buffer[start : start + length]
+            if commit != _commit(head, length, data):
+                self._uncommitted(head)
+                break
+            out += data
+            head += _aligned(RECORD.size + length)
+            records += 1
+        self.head = head
+        U64.pack_into(buffer, HEAD_OFFSET, head)
+        return records
+
+    def _uncommitted(self, head: int) -> None:
+        now = time.monotonic()
+        if head != self._pending_head:
+            self._pending_head = head
+            self._pending_since = now
+        elif now - self._pending_since >= COMMIT_TIMEOUT:
+            raise ValueError(f"{self.path} is corrupted at offset {head}.")
+
+    def skip(self) -> None:
+        """
+        Release every pending record without reading it.
+        """
+        self.head = PRODUCER.unpack_from(self._buffer, PRODUCER_OFFSET)[0]
+        U64.pack_into(self._buffer, HEAD_OFFSET, self.head)
+
+    def close(self) -> None:
+        self._buffer.release()
+        self._mmap.close()
+
+
+class SharedRingHandler(logging.Handler):
+    """
+    A handler for multi-process servers, such as gunicorn or uvicorn workers, that writes the formatted
+    lines into a shared-memory ring per process instead of a shared stream.
+
+    emit() formats the record, e.g. with JSONFormatter.format_bytes(), and copies the line into the ring
+    of the current process, `<directory>/<pid>.ring`, without taking any lock shared with other
+    processes. A SharedRingCollector drains the rings of all processes into a single stream.
+
+    When the ring is full the record is dropped, after waiting up to `block_timeout` seconds for the
+    collector to make room. Drops are counted by the handler and in the ring, where the collector reads them.
+    A forked child opens its own ring.
+    """
+
+    terminator = b"\n"
+
+    def __init__(
+        self,
+        directory: str,
+        size: int = 1 << 20,
+        block_timeout: float = 0.0,
+        level: int = logging.NOTSET,
+    ):
+        """
+        :param directory: Directory of the ring files, shared with the collector. Use a tmpfs directory,
+            such as /dev/shm/<app>, to keep the rings in memory.
+        :param size: Size in bytes of the ring of each process.
+        :param block_timeout: Seconds to wait for room in a full ring before dropping the record.
+        :param level: Handler level.
+        """
+        if size < 64:
+            raise ValueError("size must be at least 64 bytes.")
+        super().__init__(level)
+        self.directory = directory
+        self.size = size
+        self.block_timeout = block_timeout
+        self.written = 0
+        self.dropped = 0
+        self._ring: Ring | None = None
+        _ring_handlers.add(self)
+
+    def _open(self) -> Ring:
+        os.makedirs(self.directory, exist_ok=True)
+        self._ring = Ring(
+            os.path.join(self.directory, f"{os.getpid()}.ring"), self.size
+        )
+        return self._ring
+
+    def _after_fork_in_child(self) -> None:
+        # The ring belongs to the parent, the child writes its own.
+        self._ring = None
+        self.written = 0
+        self.dropped = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the counters of the handler and the bytes waiting in its ring.
+        """
+        ring = self._ring
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "pending": 0 if ring is None else ring.pending(),
+        }
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Handler.handle() holds self.lock, so the threads of this process take turns as the producer.
+        try:
+            data = _format_bytes(self, record) + self.terminator
+            ring = self._ring or self._open()
+            if ring.write(data) or self._wait(ring, data):
+                self.written += 1
+            else:
+                self.dropped += 1
+                ring.count_dropped(len(data))
+        except RecursionError:  # pragma: no cover
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _wait(self, ring: Ring, data: bytes) -> bool:
+        if self.block_timeout <= 0 or len(data) + RECORD.size > ring.capacity:
+            return False
+        deadline = time.monotonic() + self.block_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.0005)
+            if ring.write(data):
+                return True
+        return False
+
+    def close(self) -> None:
+        """
+        Unmap the ring. The file is left for the collector, which removes it once drained.
+        """
+        with self.lock:  # type: ignore
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+        super().close()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedRingCollector(object):
+    """
+    Drains the rings written by the SharedRingHandler of every process into a single binary stream.
+
+    The records of all rings are gathered into one buffer and written with a few large write() calls.
+    Run it on a thread of the master process with start(), or as a separate process:
+        python -m traceid.shm /dev/shm/app > app.log
+
+    New rings are picked up every `scan_interval` seconds. The ring of an exited process is removed once drained.
+    Lines of different processes are interleaved in the order they are drained, not strictly by time.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        stream: typing.BinaryIO | None = None,
+        interval: float = 0.01,
+        write_size: int = 1 << 20,
+        scan_interval: float = 1.0,
+    ):
+        """
+        :param directory: Directory of the ring files.
+        :param stream: Binary stream to write to. Defaults to sys.stdout.buffer.
+        :param interval: Seconds to sleep when every ring is empty.
+        :param write_size: Write the gathered records once they reach this many bytes.
+        :param scan_interval: Seconds between scans of the directory for new rings.
+        """
+        if stream is None:
+            stream = sys.stdout.buffer
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.stream = stream
+        self.interval = interval
+        self.write_size = write_size
+        self.scan_interval = scan_interval
+        self.records = 0
+        self.bytes = 0
+        self.writes = 0
+        self.corrupted = 0
+        self._rings: dict[str, Ring] = {}
+        # Drop counters of the removed rings
+        self._dropped = 0
+        self._dropped_bytes = 0
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def scan(self) -> None:
+        """
+        Open the new rings of the directory and remove the drained rings of exited processes.
+        """
+        self._scanned = time.monotonic()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".ring") and entry.path not in self._rings:
+                try:
+                    self._rings[entry.path] = Ring(entry.path)
+                except (OSError, ValueError):
+                    # Not initialized yet, or removed meanwhile.
+                    continue
+        for path, ring in list(self._rings.items()):
+            if ring.pending() == 0 and not _pid_alive(ring.pid):
+                dropped, dropped_bytes = ring.dropped()
+                self._dropped += dropped
+                self._dropped_bytes += dropped_bytes
+                del self._rings[path]
+                ring.close()
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def drain(self, rescan: bool = False) -> int:
+        """
+        Write the pending records of every ring to the stream. Return the number of bytes written.
+        :param rescan: Scan the directory for new rings first, even before scan_interval has passed.
+        """
+        with self._lock:
+            if rescan or time.monotonic() - self._scanned >= self.scan_interval:
+                self.scan()
+            out = bytearray()
+            written = 0
+            for path, ring in list(self._rings.items()):
+                try:
+                    self.records += ring.read_into(out)
+                except ValueError:
+                    # Skip the unreadable records of a ring.
+                    self.corrupted += 1
+                    ring.skip()
+                if len(out) >= self.write_size:
+                    written += self._write(out)
+                    out = bytearray()
+            if out:
+                written += self._write(out)
+            if written:
+                self.stream.flush()
+            return written
+
+    def _write(self, data: bytearray) -> int:
+        self.stream.write(data)
+        self.bytes += len(data)
+        self.writes += 1
+        return len(data)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the number of open rings, the records, bytes and write() calls written so far,
+        the bytes waiting in the rings and the records and bytes the producers dropped.
+        """
+        with self._lock:
+            dropped, dropped_bytes = self._dropped, self._dropped_bytes
+            pending = 0
+            for ring in self._rings.values():
+                ring_dropped, ring_dropped_bytes = ring.dropped()
+                dropped += ring_dropped
+                dropped_bytes += ring_dropped_bytes
+                pending += ring.pending()
+            return {
+                "rings": len(self._rings),
+                "records": self.records,
+                "bytes": self.bytes,
+                "writes": self.writes,
+                "pending": pending,
+                "dropped": dropped,
+                "dropped_bytes": dropped_bytes,
+                "corrupted": self.corrupted,
+            }
+
+    def run(self) -> None:
+        """
+        Drain the rings until stop() is called.
+        """
+        while not self._stop.is_set():
+            if not self.drain():
+                self._stop.wait(self.interval)
+        self.drain(rescan=True)
+
+    def start(self) -> "SharedRingCollector":
+        """
+        Drain the rings on a daemon thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="traceid-SharedRingCollector", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the thread started by start() after a last drain.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self) -> None:
+        """
+        Stop draining and unmap the rings. The ring files are left in place.
+        """
+        self.stop()
+        with self._lock:
+            for ring in self._rings.values():
+                ring.close()
+            self._rings.clear()
+
+
+_ring_handlers: "weakref.WeakSet[SharedRingHandler]" = weakref.WeakSet()
+
+
+def _reset_ring_handlers() -> None:
+    for handler in list(_ring_handlers):
+        handler._after_fork_in_child()
+
+
+os.register_at_fork(after_in_child=_reset_ring_handlers)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m traceid.shm",
+        description="Drain the shared-memory rings of SharedRingHandler to stdout.",
+    )
+    parser.add_argument("directory", help="Directory of the ring files.")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.01,
+        help="Seconds to sleep when every ring is empty (default: 0.01).",
+    )
+    args = parser.parse_args(argv)
+    collector = SharedRingCollector(args.directory, interval=args.interval)
+    try:
+        collector.run()
+    except KeyboardInterrupt:
+        collector.drain(rescan=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import asyncio
+import collections.abc
+import contextvars
+import time
+import typing
+
+
+from traceid.traceid import TraceContext, TraceId
+
+# Set once a TraceTaskFactory times its tasks, logging only looks up the current task after that.
+_timing_used = False
+
+_get_running_loop = asyncio._get_running_loop
+_current_task = asyncio.current_task
+_perf_counter = time.perf_counter
+
+
+class TaskTimer(collections.abc.Coroutine):
+    """
+    Wraps the coroutine of a task and accumulates its timing, one clock reading before and after each step.
+
+    started and ended are time.perf_counter() values taken when the task was created and when its coroutine
+    returned, raised or was cancelled. cpu is the sum of the clock over the steps of the task, so time spent
+    in other tasks or waiting for I/O is not counted. context is the TraceContext the task started with.
+
+    A timed task runs the TaskTimer, so task.get_coro() returns the TaskTimer rather than the coroutine
+    passed to create_task(). The cr_* attributes and __name__ forward to that coroutine, which keeps task
+    reprs and stacks unchanged, and the coroutine itself is available as the coro attribute.
+    """
+
+    __slots__ = (
+        "_coro",
+        "_step_started",
+        "clock",
+        "on_done",
+        "context",
+        "started",
+        "ended",
+        "cpu",
+        "steps",
+    )
+
+    def __init__(
+        self,
+        coro: typing.Coroutine,
+        clock: typing.Callable[[], float] = time.thread_time,
+        on_done: typing.Callable[["TaskTimer"], None] | None = None,
+        context: TraceContext | None = None,
+    ):
+        """
+        :param coro: The coroutine run by the task.
+        :param clock: Clock read around each step, time.thread_time() measures CPU time.
+        :param on_done: Callback receiving the timer when the coroutine ends. It must not raise.
+        :param context: The TraceContext of the task.
+        """
+        self._coro = coro
+        self._step_started = 0.0
+        self.clock = clock
+        self.on_done = on_done
+        self.context = context
+        self.started = _perf_counter()
+        self.ended: float | None = None
+        self.cpu = 0.0
+        self.steps = 0
+
+    def __repr__(self) -> str:
+        return f"<TaskTimer {self._coro!r} steps={self.steps} cpu={self.cpu:.6f}>"
+
+    def send(self, value: typing.Any) -> typing.Any:
+        clock = self.clock
+        self.steps += 1
+        start = self._step_started = clock()
+        try:
+            result = self._coro.send(value)
+        except BaseException:
+            self.cpu += clock() - start
+            self._finish()
+            raise
+        self.cpu += clock() - start
+        return result
+
+    def throw(self, *args) -> typing.Any:
+        clock = self.clock
+        self.steps += 1
+        start = self._step_started = clock()
+        try:
+            result = self._coro.throw(*args)
+        except BaseException:
+            self.cpu += clock() - start
+            self._finish()
+            raise
+        self.cpu += clock() - start
+        return result
+
+    def close(self) -> None:
+        self._coro.close()
+
+    def _finish(self) -> None:
+        self.ended = _perf_counter()
+        if self.on_done is not None:
+            self.on_done(self)
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> typing.Any:
+        return self.send(None)
+
+    @property
+    def coro(self) -> typing.Coroutine:
+        """
+        The coroutine passed to create_task().
+        """
+        return self._coro
+
+    # Introspection used by Task.__repr__(), Task.get_stack() and debuggers.
+    @property
+    def cr_code(self):
+        return getattr(self._coro, "cr_code", None)
+
+    @property
+    def cr_frame(self):
+        return getattr(self._coro, "cr_frame", None)
+
+    @property
+    def cr_running(self) -> bool:
+        return getattr(self._coro, "cr_running", False)
+
+    @property
+    def cr_await(self):
+        return getattr(self._coro, "cr_await", None)
+
+    @property
+    def __name__(self) -> str:  # type: ignore
+        return getattr(self._coro, "__qualname__", type(self._coro).__name__)
+
+    def wall_time(self) -> float:
+        """
+        Return the seconds since the task was created, or from its creation to its end once it ended.
+        """
+        ended = self.ended
+        return (_perf_counter() if ended is None else ended) - self.started
+
+    def cpu_time(self) -> float:
+        """
+        Return the clock time of the steps of the task so far, including the running step when called
+        from inside the task. With time.thread_time(), call it on the thread of the event loop.
+        """
+        if self.cr_running:
+            return self.cpu + self.clock() - self._step_started
+        return self.cpu
+
+
+class TraceTaskFactory(object):
+    """
+    An event loop task factory that gives every task a child span of the trace it is created in,
+    and optionally times it with a TaskTimer.
+
+    Without it, the tasks of asyncio.gather() or create_task() share the TraceContext of their parent.
+    With it, each task starts with TraceContext.child(): the same traceid, a new random span_id and the
+    span of the creating task as parent_id, so JSONFormatter keys span_id and parent_span_id tell the
+    tasks apart. Tasks created outside a trace are left alone. Deriving a span costs a context copy and
+    8 bytes of the shared random pool; nothing is converted.
+
+    Timing is opt-in: with timing=True, the coroutine of each task is wrapped in a TaskTimer, which costs
+    a wrapper object per task and two clock readings per step, and task.get_coro() returns the TaskTimer.
+    JSONFormatter keys task_wall_ms and task_cpu_ms output the timing of the current task.
+
+    Usage:
+        async def main():
+            install_task_factory()
+            async with TraceId.scope():
+                await asyncio.gather(fetch_user(), fetch_orders())
+    """
+
+    __slots__ = ("spans", "timing", "clock", "on_done", "inner")
+
+    def __init__(
+        self,
+        spans: bool = True,
+        timing: bool = False,
+        clock: typing.Callable[[], float] = time.thread_time,
+        on_done: typing.Callable[[TaskTimer], None] | None = None,
+        inner: typing.Callable[..., asyncio.Task] | None = None,
+    ):
+        """
+        :param spans: If True, tasks created in a trace start a child span.
+        :param timing: If True, tasks are timed with a TaskTimer.
+        :param clock: Clock of the TaskTimer. time.thread_time() measures CPU time; time.perf_counter()
+            is cheaper and measures the time a task holds the event loop, including blocking calls.
+        :param on_done: Callback receiving the TaskTimer of each task when its coroutine ends,
+            e.g. to record the timings. It runs inside the task and must not raise. Requires timing.
+        :param inner: Task factory to create the tasks with, e.g. the previous factory of the loop.
+            Defaults to asyncio.Task.
+        """
+        global _timing_used
+        if on_done is not None and not timing:
+            raise ValueError("on_done requires timing=True.")
+        if timing:
+            _timing_used = True
+        self.spans = spans
+        self.timing = timing
+        self.clock = clock
+        self.on_done = on_done
+        self.inner = inner
+
+    def __call__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        coro: typing.Coroutine,
+        context: contextvars.Context | None = None,
+        **kwargs,
+    ) -> asyncio.Task:
+        span = None
+        if self.spans:
+            if context is None:
+                parent = TraceId.traceid_var.get(None)
+                if parent is not None:
+                    context = contextvars.copy_context()
+            else:
+                parent = context.get(TraceId.traceid_var)
+                if parent is not None:
+                    # Leave the context passed by the caller untouched.
+                    context = context.copy()
+            if parent is not None:
+                span = parent.child()
+                context.run(TraceId.traceid_var.set, span)  # type: ignore
+        elif context is None:
+            span = TraceId.traceid_var.get(None)
+        else:
+            span = context.get(TraceId.traceid_var)
+        if self.timing:
+            coro = TaskTimer(coro, self.clock, self.on_done, span)
+        if self.inner is None:
+            return asyncio.Task(coro, loop=loop, context=context, **kwargs)
+        return self.inner(loop, coro, context=context, **kwargs)
+
+
+def install_task_factory(
+    loop: asyncio.AbstractEventLoop | None = None, **options
+) -> TraceTaskFactory:
+    """
+    Install a TraceTaskFactory on a loop, on top of the task factory the loop already has.
+    Only tasks created afterwards are covered, not the task calling it.
+    :param loop: Event loop. Defaults to the running loop.
+    :param options: Arguments of TraceTaskFactory.
+    :return: The installed factory.
+    """
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    options.setdefault("inner", loop.get_task_factory())
+    factory = TraceTaskFactory(**options)
+    loop.set_task_factory(factory)
+    return factory
+
+
+def task_timer(task: asyncio.Task | None = None) -> TaskTimer | None:
+    """
+    Return the TaskTimer of a task, or None if the task is not timed.
+    :param task: The task. Defaults to the current task.
+    """
+    if task is None:
+        loop = _get_running_loop()
+        if loop is None:
+            return None
+        task = _current_task(loop)
+        if task is None:
+            return None
+    coro = task.get_coro()
+    return coro if type(coro) is TaskTimer else None
+
+
+def current_task_times() -> tuple[float, float] | None:
+    """
+    Return (wall, cpu) of the current task in milliseconds, rounded to microseconds,
+    or None outside of a timed task.
+    """
+    if not _timing_used:
+        return None
+    timer = task_timer()
+    if timer is None:
+        return None
+    return (
+        round(timer.wall_time() * 1000.0, 3),
+        round(timer.cpu_time() * 1000.0, 3),
+    )
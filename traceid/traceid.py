@@ -1,6 +1,13 @@
 import contextvars
+import functools
+import inspect
+import os
+import time
+import typing
 import uuid
 
+from traceid import metrics, registry
+
 
 class TraceIdException(Exception):
     """
@@ -27,17 +34,360 @@ class TraceIdAlreadySetError(TraceIdException):
     pass
 
 
+class RandomPool(object):
+    """
+    A buffer of CSPRNG bytes refilled in bulk from os.urandom().
+
+    Each refill is cut into chunks of the requested size up front, so take() is a single
+    next() on a list iterator: no lock and no slicing per id, and no chunk is ever handed out twice.
+    The module level random_pool is reset in forked children, so parent and child never share random bytes.
+    """
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self._chunks: dict[int, typing.Iterator[bytes]] = {}
+
+    def reset(self) -> None:
+        """
+        Drop the buffered bytes. The next take() refills the pool.
+        """
+        self._chunks = {}
+
+    def take(self, n: int) -> bytes:
+        """
+        Return n random bytes from the pool.
+        """
+        try:
+            return next(self._chunks[n])
+        except (KeyError, StopIteration):
+            return self._refill(n)
+
+    def _refill(self, n: int) -> bytes:
+        size = max(self.size, n)
+        data = os.urandom(size - size % n)
+        chunks = iter([data[i : i + n] for i in range(0, len(data), n)])
+        self._chunks[n] = chunks
+        return next(chunks)
+
+
+random_pool = RandomPool()
+os.register_at_fork(after_in_child=random_pool.reset)
+
+_CROCKFORD = b"0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Maps every byte to a Crockford base32 character by its low 5 bits. 256 is a multiple of 32,
+# so random bytes translate to uniformly random characters.
+_CROCKFORD_BYTES = bytes(_CROCKFORD[i & 31] for i in range(256))
+_UUID_VERSION_MASK = ~(0xF << 76) & ~(0x3 << 62) & ((1 << 128) - 1)
+_UUID7_BITS = (0x7 << 76) | (0x2 << 62)
+_ulid_prefix: tuple[int, str] = (-1, "")
+# Slot setters of uuid.UUID, used to build a UUID from a known-valid int.
+_new_object = object.__new__
+_set_uuid_int = uuid.UUID.int.__set__  # type: ignore
+_set_uuid_is_safe = uuid.UUID.is_safe.__set__  # type: ignore
+_UUID_SAFE_UNKNOWN = uuid.SafeUUID.unknown
+
+
+def gen_uuid4() -> uuid.UUID:
+    """
+    Random UUID from uuid.uuid4(). This is the default scheme.
+    """
+    return uuid.uuid4()
+
+
+def gen_uuid7() -> uuid.UUID:
+    """
+    Time-ordered UUID version 7 (RFC 9562): 48 bits of unix milliseconds followed by random bits.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(random_pool.take(10))
+    # version 7 in bits 76-79, variant 0b10 in bits 62-63
+    value = value & _UUID_VERSION_MASK | _UUID7_BITS
+    # The value is already a valid 128-bit UUID, skip the argument parsing of UUID.__init__.
+    # This is what the standard library does internally since Python 3.14.
+    result = _new_object(uuid.UUID)
+    _set_uuid_int(result, value)
+    _set_uuid_is_safe(result, _UUID_SAFE_UNKNOWN)
+    return result
+
+
+def gen_hex64() -> str:
+    """
+    64-bit random id as 16 lowercase hex characters.
+    """
+    return random_pool.take(8).hex()
+
+
+def gen_hex128() -> str:
+    """
+    128-bit random id as 32 lowercase hex characters.
+    """
+    return random_pool.take(16).hex()
+
+
+def gen_ulid() -> str:
+    """
+    ULID: 48 bits of unix milliseconds and 80 random bits as 26 Crockford base32 characters.
+    ULIDs sort lexicographically by creation time.
+    """
+    global _ulid_prefix
+    millisecond = time.time_ns() // 1_000_000
+    cached = _ulid_prefix
+    if cached[0] != millisecond:
+        # The 10 timestamp characters only change once per millisecond.
+        prefix = bytes(
+            _CROCKFORD[(millisecond >> shift) & 31] for shift in range(45, -1, -5)
+        ).decode()
+        cached = _ulid_prefix = (millisecond, prefix)
+    # 16 random bytes, 5 random bits each, give the 80 random bits.
+    return cached[1] + random_pool.take(16).translate(_CROCKFORD_BYTES).decode()
+
+
+Generator = typing.Callable[[], uuid.UUID | str]
+
+GENERATORS: dict[str, Generator] = {
+    "uuid4": gen_uuid4,
+    "uuid7": gen_uuid7,
+    "hex64": gen_hex64,
+    "hex128": gen_hex128,
+    "ulid": gen_ulid,
+}
+
+
+def register_generator(name: str, generator: Generator) -> None:
+    """
+    Register a traceid generator under a scheme name, so it can be used with TraceId.gen(name).
+    :param name: Scheme name.
+    :param generator: Zero-argument callable returning a new traceid.
+    """
+    if not callable(generator):
+        raise ValueError(f"Generator for scheme {name!r} must be callable.")
+    GENERATORS[name] = generator
+
+
+def get_generator(scheme: str | Generator) -> Generator:
+    """
+    Resolve a scheme name or a callable to a generator.
+    """
+    if callable(scheme):
+        return scheme
+    try:
+        return GENERATORS[scheme]
+    except KeyError:
+        raise ValueError(
+            f"Unknown traceid scheme {scheme!r}. Available schemes: {', '.join(GENERATORS)}."
+        ) from None
+
+
+class InvalidTraceparentError(TraceIdException, ValueError):
+    """
+    Raised when a W3C traceparent header cannot be parsed.
+    """
+
+    pass
+
+
+# Deletes every lowercase hex digit, a valid hex string translates to "".
+_HEX_DELETE = str.maketrans("", "", "0123456789abcdef")
+
+
+def new_span_id() -> str:
+    """
+    Return a random 64-bit span id as 16 lowercase hex characters.
+    """
+    return random_pool.take(8).hex()
+
+
+class TraceContext(object):
+    """
+    The value stored in TraceId.traceid_var.
+
+    It keeps the original traceid together with its canonical string form, so that logging can reuse
+    the string instead of converting the traceid on every record, and the optional span fields:
+        span_id: 16 hex characters identifying the current span, or None.
+        parent_id: span_id of the parent span, or None for a root span.
+        flags: W3C trace flags, 1 means sampled.
+        state: a dict shared by every span of the trace, where components such as SamplingFilter
+            cache per-trace decisions.
+    A TraceContext is treated as immutable, apart from its state dict: child spans are new objects
+    sharing the traceid and the state.
+    """
+
+    __slots__ = ("traceid", "text", "span_id", "parent_id", "flags", "state")
+
+    def __init__(
+        self,
+        traceid: uuid.UUID | str,
+        span_id: str | None = None,
+        parent_id: str | None = None,
+        flags: int = 1,
+    ):
+        self.traceid = traceid
+        self.text: str = traceid if type(traceid) is str else str(traceid)
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.flags = flags
+        self.state: dict[typing.Any, typing.Any] = {}
+
+    def __repr__(self) -> str:
+        if self.span_id is None:
+            return f"TraceContext({self.traceid!r})"
+        return f"TraceContext({self.traceid!r}, span_id={self.span_id!r}, parent_id={self.parent_id!r}, flags={self.flags})"
+
+    def child(self, span_id: str | None = None) -> "TraceContext":
+        """
+        Return a child span of this context: same traceid, flags and state, a new span_id and this span as parent.
+        The cached string form is shared, nothing is converted.
+        """
+        child = _new_object(TraceContext)
+        child.traceid = self.traceid
+        child.text = self.text
+        child.span_id = new_span_id() if span_id is None else span_id
+        child.parent_id = self.span_id
+        child.flags = self.flags
+        child.state = self.state
+        return child
+
+    @property
+    def w3c_trace_id(self) -> str:
+        """
+        The traceid as the 32 lowercase hex characters used by W3C trace context.
+        Raises ValueError if the traceid is neither a UUID nor 128-bit hex.
+        """
+        traceid = self.traceid
+        if type(traceid) is uuid.UUID:
+            return traceid.hex
+        text = self.text
+        if len(text) == 36 and text[8] == "-":
+            text = text.replace("-", "")
+        text = text.lower()
+        if len(text) == 32 and not text.translate(_HEX_DELETE):
+            return text
+        raise ValueError(f"Traceid {self.text!r} can't be used as a W3C trace-id.")
+
+    def to_traceparent(self) -> str:
+        """
+        Serialize the context as a W3C traceparent header value.
+        """
+        if self.span_id is None:
+            raise ValueError(
+                "TraceContext has no span. Please use TraceId.span() to start one."
+            )
+        return f"00-{self.w3c_trace_id}-{self.span_id}-{self.flags:02x}"
+
+    @classmethod
+    def from_traceparent(cls, header: str) -> "TraceContext":
+        """
+        Parse a W3C traceparent header value, without regular expressions.
+        The returned context describes the remote span: its span_id is the header's parent-id.
+        """
+        if (
+            len(header) < 55
+            or header[2] != "-"
+            or header[35] != "-"
+            or header[52] != "-"
+            or (len(header) > 55 and header[55] != "-")
+        ):
+            raise InvalidTraceparentError(f"Invalid traceparent {header!r}.")
+        version = header[0:2]
+        trace_id = header[3:35]
+        span_id = header[36:52]
+        flags = header[53:55]
+        if (
+            (version + trace_id + span_id + flags).translate(_HEX_DELETE)
+            or version == "ff"
+            or (version == "00" and len(header) != 55)
+            or trace_id == "00000000000000000000000000000000"
+            or span_id == "0000000000000000"
+        ):
+            raise InvalidTraceparentError(f"Invalid traceparent {header!r}.")
+        return cls(trace_id, span_id, None, int(flags, 16))
+
+
+# Callbacks run with the TraceContext of a trace when the scope that started it exits.
+TRACE_END_HOOKS: list[typing.Callable[[TraceContext], None]] = []
+
+
+def add_trace_end_hook(hook: typing.Callable[[TraceContext], None]) -> None:
+    """
+    Register a callback that receives the TraceContext of a trace when it ends: when a TraceId.scope(),
+    a TraceId.span() that started a new trace, or a middleware request exits, or when TraceId.clear()
+    clears a trace started by TraceId.set(), gen() or set_traceparent(). Spans of an ongoing trace do
+    not end a trace. The callback must not raise.
+    """
+    TRACE_END_HOOKS.append(hook)
+
+
+def remove_trace_end_hook(hook: typing.Callable[[TraceContext], None]) -> None:
+    """
+    Unregister a callback added with add_trace_end_hook(). Unknown callbacks are ignored.
+    """
+    try:
+        TRACE_END_HOOKS.remove(hook)
+    except ValueError:
+        pass
+
+
+def trace_ended(context: TraceContext) -> None:
+    """
+    Run the trace end hooks for a trace that ended outside of TraceId.scope(), e.g. in a middleware.
+    """
+    for hook in TRACE_END_HOOKS:
+        hook(context)
+
+
+def _enter_context(
+    context: TraceContext, starts_trace: bool = True
+) -> contextvars.Token[TraceContext | None]:
+    """
+    Make context current, counting it in the metrics and, when it starts a trace, the active trace registry.
+    Every scope and middleware goes through _enter_context() and _exit_context().
+    """
+    token = TraceId.traceid_var.set(context)
+    if metrics.collector is not None:
+        metrics.collector.traceid_sets += 1
+    if starts_trace and registry.active is not None:
+        registry.active.start(context)
+    return token
+
+
+def _exit_context(
+    token: contextvars.Token[TraceContext | None], ended: TraceContext | None
+) -> None:
+    """
+    Restore the context that was current before _enter_context(), and end the trace `ended` if it is given.
+    """
+    TraceId.traceid_var.reset(token)
+    if metrics.collector is not None:
+        metrics.collector.traceid_clears += 1
+    if ended is not None:
+        _end_trace(ended)
+
+
+def _end_trace(context: TraceContext) -> None:
+    if registry.active is not None:
+        registry.active.end(context)
+    if TRACE_END_HOOKS:
+        trace_ended(context)
+
+
+# Key of TraceContext.state marking a trace started by TraceId.set(), gen() or set_traceparent(),
+# which TraceId.clear() ends. It is popped, so clearing the trace twice ends it once.
+_SET_BY_TRACEID = object()
+
+
 class TraceId(object):
-    traceid_var = contextvars.ContextVar[uuid.UUID | str]("__traceid__")
+    traceid_var = contextvars.ContextVar[TraceContext | None]("__traceid__")
+    default_scheme: str | Generator = "uuid4"
 
     @classmethod
-    def set(cls, traceid: uuid.UUID | str, coverage: bool = False) -> None:
+    def set(
+        cls, traceid: uuid.UUID | str, coverage: bool = False
+    ) -> contextvars.Token[TraceContext | None]:
         """
         Set the traceid for the current context.
         Args:
             traceid: The traceid to set. Cannot be None.
         Returns:
-            None
+            The ContextVar token, pass it to TraceId.clear() to restore the previous traceid.
         """
         if traceid is None:  # type: ignore
             raise ValueError("TraceId cannot be set to None.")
@@ -45,7 +395,9 @@ class TraceId(object):
             raise TraceIdAlreadySetError(
                 "TraceId is already set. Please use TraceId.clear() to clear the traceid."
             )
-        cls.traceid_var.set(traceid)
+        context = TraceContext(traceid)
+        context.state[_SET_BY_TRACEID] = True
+        return _enter_context(context)
 
     @classmethod
     def get(cls) -> uuid.UUID | str:
@@ -55,25 +407,74 @@ class TraceId(object):
             The traceid for the current context.
         """
         try:
-            id = cls.traceid_var.get()
-            if id is None:  # type: ignore
+            context = cls.traceid_var.get()
+            if context is None:
                 raise TraceIdNotYetSetError(
                     "TraceId is not yet set. Please use TraceId.gen() to generate a new traceid or TraceId.set() to set an existing traceid."
                 )
-            return id
+            return context.traceid
         except LookupError:
             raise TraceIdNotYetSetError(
                 "TraceId is not yet set. Please use TraceId.gen() to generate a new traceid or TraceId.set() to set an existing traceid."
             )
 
     @classmethod
-    def clear(cls) -> None:
+    def peek(cls) -> uuid.UUID | str | None:
+        """
+        Get the traceid for the current context without raising.
+        This is a single ContextVar lookup, intended for hot paths such as logging.
+        Returns:
+            The traceid for the current context, or None if it is not set.
+        """
+        context = cls.traceid_var.get(None)
+        if context is None:
+            return None
+        return context.traceid
+
+    @classmethod
+    def peek_text(cls) -> str | None:
         """
-        Clear the traceid for the current context.
+        Get the cached string form of the traceid for the current context without raising.
+        The string is built once when the traceid is set, so this never converts the traceid.
+        Returns:
+            The traceid as a string, or None if it is not set.
+        """
+        context = cls.traceid_var.get(None)
+        if context is None:
+            return None
+        return context.text
+
+    @classmethod
+    def current(cls) -> TraceContext | None:
+        """
+        Get the TraceContext for the current context without raising.
+        Returns:
+            The TraceContext, or None if the traceid is not set.
+        """
+        return cls.traceid_var.get(None)
+
+    @classmethod
+    def clear(cls, token: contextvars.Token[TraceContext | None] | None = None) -> None:
+        """
+        Clear the traceid for the current context. When the cleared trace was started by TraceId.set(),
+        gen() or set_traceparent(), from its root or one of its spans, the trace ends: it leaves the
+        active trace registry and the trace end hooks run. Traces of a scope end when the scope exits.
+        Args:
+            token: A token returned by TraceId.set() or TraceId.gen(). If given, the traceid that was
+                current before that call is restored through ContextVar.reset(). Otherwise the traceid is
+                overwritten with None. Prefer TraceId.scope() to pair both ends automatically.
         Returns:
             None
         """
-        cls.traceid_var.set(None)  # type: ignore
+        context = cls.traceid_var.get(None)
+        if token is not None:
+            cls.traceid_var.reset(token)
+        else:
+            cls.traceid_var.set(None)
+        if metrics.collector is not None:
+            metrics.collector.traceid_clears += 1
+        if context is not None and context.state.pop(_SET_BY_TRACEID, False):
+            _end_trace(context)
 
     @classmethod
     def is_set(cls) -> bool:
@@ -85,9 +486,197 @@ class TraceId(object):
         return cls.traceid_var.get(None) is not None
 
     @classmethod
-    def gen(cls):
+    def set_default_scheme(cls, scheme: str | Generator) -> None:
+        """
+        Set the scheme used by TraceId.gen() when no scheme is given.
+        Args:
+            scheme: A registered scheme name (uuid4, uuid7, hex64, hex128, ulid) or a generator callable.
+        Returns:
+            None
+        """
+        get_generator(scheme)
+        cls.default_scheme = scheme
+
+    @classmethod
+    def gen(
+        cls, scheme: str | Generator | None = None
+    ) -> contextvars.Token[TraceContext | None] | None:
         """
         Generate and set a new traceid.
+        Args:
+            scheme: The scheme used to generate the traceid. Defaults to TraceId.default_scheme.
+        Returns:
+            The ContextVar token, or None if a traceid was already set and nothing changed.
         """
+        generator = get_generator(cls.default_scheme if scheme is None else scheme)
         if not cls.is_set():
-            cls.set(uuid.uuid4())
+            if metrics.collector is not None:
+                metrics.collector.ids_generated += 1
+            return cls.set(generator())
+        return None
+
+    @classmethod
+    def scope(
+        cls,
+        traceid: uuid.UUID | str | None = None,
+        scheme: str | Generator | None = None,
+    ) -> "TraceScope":
+        """
+        Set or generate a traceid for a block of code and restore the previous one afterwards.
+        Works as a context manager, an async context manager and a decorator:
+            with TraceId.scope():
+                ...
+            async with TraceId.scope("my-traceid"):
+                ...
+            @TraceId.scope(scheme="uuid7")
+            async def handle():
+                ...
+        Args:
+            traceid: The traceid to set. Generated when None.
+            scheme: The scheme used to generate the traceid. Defaults to TraceId.default_scheme.
+        """
+        return TraceScope(traceid, scheme)
+
+    @classmethod
+    def span(cls, scheme: str | Generator | None = None) -> "SpanScope":
+        """
+        Start a child span of the current context for a block of code, and restore the parent afterwards.
+        Without a current traceid a new trace is generated with a root span.
+        Works as a context manager, an async context manager and a decorator. Entering returns the TraceContext.
+        Args:
+            scheme: The scheme used to generate a traceid when none is set. Defaults to TraceId.default_scheme.
+        """
+        return SpanScope(None, scheme)
+
+    @classmethod
+    def set_traceparent(
+        cls, header: str, coverage: bool = False
+    ) -> contextvars.Token[TraceContext | None]:
+        """
+        Continue a trace from a W3C traceparent header: set a new span whose parent is the remote span.
+        Args:
+            header: The traceparent header value.
+        Returns:
+            The ContextVar token.
+        Raises:
+            InvalidTraceparentError: If the header is malformed.
+        """
+        context = TraceContext.from_traceparent(header).child()
+        if not coverage and cls.is_set():
+            raise TraceIdAlreadySetError(
+                "TraceId is already set. Please use TraceId.clear() to clear the traceid."
+            )
+        context.state[_SET_BY_TRACEID] = True
+        return _enter_context(context)
+
+    @classmethod
+    def traceparent(cls) -> str | None:
+        """
+        Get the W3C traceparent header value for the current span.
+        Returns:
+            The header value, or None when there is no W3C context to propagate: the traceid is not set,
+            no span was started (e.g. after a plain TraceId.gen(), use TraceId.span() or a middleware),
+            or the traceid is neither a UUID nor 128-bit hex (e.g. hex64, ulid or a client X-Request-ID).
+        """
+        context = cls.traceid_var.get(None)
+        if context is None or context.span_id is None:
+            return None
+        try:
+            trace_id = context.w3c_trace_id
+        except ValueError:
+            return None
+        return f"00-{trace_id}-{context.span_id}-{context.flags:02x}"
+
+
+class TraceScope(object):
+    """
+    A scope that sets a traceid on enter and restores the previous one on exit through ContextVar.reset().
+
+    Entering returns the traceid of the scope. A scope object may be re-entered, but it must not be
+    shared by concurrently running tasks; as a decorator every call enters its own scope.
+    """
+
+    __slots__ = ("traceid", "scheme", "_tokens")
+
+    def __init__(
+        self,
+        traceid: uuid.UUID | str | None = None,
+        scheme: str | Generator | None = None,
+    ):
+        if scheme is not None:
+            get_generator(scheme)
+        self.traceid = traceid
+        self.scheme = scheme
+        # (token, context) of each entered scope, the context is None unless the scope started a trace
+        self._tokens: list[
+            tuple[contextvars.Token[TraceContext | None], TraceContext | None]
+        ] = []
+
+    def _new_context(self) -> tuple[TraceContext, bool]:
+        """
+        Return the context of the scope and whether it starts a new trace.
+        """
+        traceid = self.traceid
+        if traceid is None:
+            scheme = TraceId.default_scheme if self.scheme is None else self.scheme
+            traceid = get_generator(scheme)()
+            if metrics.collector is not None:
+                metrics.collector.ids_generated += 1
+        return TraceContext(traceid), True
+
+    def _entered(self, context: TraceContext) -> typing.Any:
+        return context.traceid
+
+    def __enter__(self) -> typing.Any:
+        context, started = self._new_context()
+        token = _enter_context(context, started)
+        self._tokens.append((token, context if started else None))
+        return self._entered(context)
+
+    def __exit__(self, *exc_info) -> None:
+        token, context = self._tokens.pop()
+        _exit_context(token, context)
+
+    async def __aenter__(self) -> typing.Any:
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.__exit__()
+
+    def __call__(self, func):
+        scope_class, traceid, scheme = type(self), self.traceid, self.scheme
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with scope_class(traceid, scheme):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with scope_class(traceid, scheme):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+class SpanScope(TraceScope):
+    """
+    A scope that sets a child span of the current context on enter and restores the parent on exit.
+    Entering returns the TraceContext of the span.
+    """
+
+    __slots__ = ()
+
+    def _new_context(self) -> tuple[TraceContext, bool]:
+        parent = TraceId.traceid_var.get(None)
+        if parent is None:
+            context, _ = super()._new_context()
+            context.span_id = new_span_id()
+            return context, True
+        return parent.child(), False
+
+    def _entered(self, context: TraceContext) -> TraceContext:
+        return context